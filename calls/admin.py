@@ -1,7 +1,14 @@
+import datetime
 from django.contrib import admin
+from django.contrib.admin.views.main import ORDER_VAR
 from django.contrib.auth.admin import UserAdmin
+from django.db.models import Max, Min
+from django.utils import timezone
 from .models import User, Call
 from .forms import CustomUserCreationForm, CustomUserChangeForm
+from .pagination import EstimatedCountPaginator
+from .search import highlight, search_annotations, transcript_query
+from .stats import normalize_reason, reason_counts
 
 class CustomUserAdmin(UserAdmin):
     add_form = CustomUserCreationForm
@@ -20,9 +27,83 @@ class CustomUserAdmin(UserAdmin):
 
 admin.site.register(User, CustomUserAdmin)
 
+class TransferReasonFilter(admin.SimpleListFilter):
+    # Facets with counts from the reason rollup; filtering uses the GIN index on Call.reasons
+    title = 'transfer reason'
+    parameter_name = 'reason'
+
+    def lookups(self, request, model_admin):
+        return [(row['reason'], f"{row['reason']} ({row['calls']})") for row in reason_counts()]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(reasons__contains=[normalize_reason(self.value())])
+        return queryset
+
+
+class CreatedMonthFilter(admin.SimpleListFilter):
+    """
+    Calls of one month. The choices span the first and last call, which Postgres
+    reads from the ends of call_created_idx; date_hierarchy would list its years
+    with a DISTINCT date_trunc over the whole table on every changelist load.
+    """
+    title = 'month'
+    parameter_name = 'month'
+
+    def lookups(self, request, model_admin):
+        bounds = Call.objects.aggregate(first=Min('created_at'), last=Max('created_at'))
+        if bounds['first'] is None:
+            return []
+        first, last = timezone.localtime(bounds['first']), timezone.localtime(bounds['last'])
+        year, month = last.year, last.month
+        choices = []
+        while (year, month) >= (first.year, first.month):
+            choices.append((f'{year}-{month:02d}', datetime.date(year, month, 1).strftime('%B %Y')))
+            year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+        return choices
+
+    def queryset(self, request, queryset):
+        try:
+            year, month = map(int, (self.value() or '').split('-'))
+            start = datetime.datetime(year, month, 1)
+        except ValueError:
+            return queryset
+        end = datetime.datetime(year + month // 12, month % 12 + 1, 1)
+        return queryset.filter(created_at__gte=timezone.make_aware(start), created_at__lt=timezone.make_aware(end))
+
+
 @admin.register(Call)
 class CallAdmin(admin.ModelAdmin):
-    list_display = ('session_id', 'caller_id', 'user', 'created_at', 'wav_size')
+    list_display = ('session_id', 'caller_id', 'user', 'created_at', 'duration', 'wav_size', 'transcript_match')
+    list_select_related = ('user',)
+    # icontains, served by the pg_trgm indexes on UPPER(session_id) / UPPER(caller_id)
     search_fields = ('session_id', 'caller_id')
-    list_filter = ('created_at',)
-    ordering = ('-created_at',)
+    # Ranges on call_created_idx
+    list_filter = ('created_at', CreatedMonthFilter, TransferReasonFilter)
+    ordering = ('-created_at', '-id')
+    exclude = ('transcript',)
+    # Search the users (CustomUserAdmin.search_fields) instead of rendering all of them in a <select>
+    autocomplete_fields = ('user',)
+    # Large table: planner estimates instead of COUNT(*), and no second count of the unfiltered table
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('peaks', 'transcript', 'search_vector')
+
+    def get_search_results(self, request, queryset, search_term):
+        # Session / caller ids as usual, plus full-text matches in the transcript
+        if not search_term:
+            return super().get_search_results(request, queryset, search_term)
+        id_matches, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        query = transcript_query(search_term)
+        matches = id_matches | queryset.filter(search_vector=query)
+        matches = matches.annotate(**search_annotations(query))
+        # Best transcript matches first, unless a column sort was picked
+        if ORDER_VAR not in request.GET:
+            matches = matches.order_by('-rank', '-pk')
+        return matches, may_have_duplicates
+
+    @admin.display(description='Transcript')
+    def transcript_match(self, obj):
+        return highlight(getattr(obj, 'headline', None))
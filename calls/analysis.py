@@ -0,0 +1,130 @@
+"""
+Audio metrics and waveform peaks, computed once per recording at ingest.
+
+Kept free of Django imports so it can run in spawned worker processes.
+
+The peak envelope is stored as `PEAK_BUCKETS` (or fewer, for very short calls)
+(min, max) pairs of signed bytes, amplitude scaled to -127..127.
+"""
+import numpy as np
+
+from .wav import (
+    WAVE_FORMAT_ALAW, WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_MULAW, WAVE_FORMAT_PCM, read_wav_header,
+)
+
+ANALYSIS_FIELDS = ('peaks', 'rms', 'silence_ratio', 'talk_time')
+
+PEAK_BUCKETS = 1000
+WINDOW_MS = 20
+# 20 ms windows quieter than this (dBFS) count as silence
+SILENCE_DB = -40.0
+# Windows decoded per vectorized block, bounding memory for long recordings
+BLOCK_WINDOWS = 4096
+
+
+def _g711_table(decode):
+    return np.array([decode(i) for i in range(256)], dtype=np.float32) / 32768.0
+
+
+def _ulaw(byte):
+    byte = ~byte & 0xFF
+    sign, exponent, mantissa = byte & 0x80, (byte >> 4) & 0x07, byte & 0x0F
+    sample = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return -sample if sign else sample
+
+
+def _alaw(byte):
+    byte ^= 0x55
+    sign, exponent, mantissa = byte & 0x80, (byte >> 4) & 0x07, byte & 0x0F
+    sample = (mantissa << 4) + 8 if exponent == 0 else ((mantissa << 4) + 0x108) << (exponent - 1)
+    return sample if sign else -sample
+
+
+ULAW_TABLE = _g711_table(_ulaw)
+ALAW_TABLE = _g711_table(_alaw)
+
+
+def _decoder(header):
+    # Returns (numpy dtype of one stored sample, function mapping raw samples to float32 in [-1, 1])
+    tag, bits = header['format_tag'], header['bits_per_sample']
+    if tag == WAVE_FORMAT_PCM and bits == 8:
+        return np.uint8, lambda a: (a.astype(np.float32) - 128.0) / 128.0
+    if tag == WAVE_FORMAT_PCM and bits == 16:
+        return np.dtype('<i2'), lambda a: a.astype(np.float32) / 32768.0
+    if tag == WAVE_FORMAT_PCM and bits == 32:
+        return np.dtype('<i4'), lambda a: a.astype(np.float32) / 2147483648.0
+    if tag == WAVE_FORMAT_IEEE_FLOAT and bits == 32:
+        return np.dtype('<f4'), lambda a: a.astype(np.float32)
+    if tag == WAVE_FORMAT_MULAW and bits == 8:
+        return np.uint8, lambda a: ULAW_TABLE[a]
+    if tag == WAVE_FORMAT_ALAW and bits == 8:
+        return np.uint8, lambda a: ALAW_TABLE[a]
+    raise ValueError(f"Unsupported WAV encoding (format {tag:#x}, {bits} bits)")
+
+
+def analyze_wav(path, buckets=PEAK_BUCKETS):
+    """
+    Read the PCM data of `path` once through a memory map and return
+    {'peaks', 'rms', 'silence_ratio', 'talk_time'} (talk_time in seconds).
+    """
+    with open(path, 'rb') as f:
+        header = read_wav_header(f)
+    dtype, decode = _decoder(header)
+
+    channels = header['channels'] or 1
+    frames = header['data_size'] // (np.dtype(dtype).itemsize * channels)
+    if frames == 0:
+        return {'peaks': b'', 'rms': 0.0, 'silence_ratio': 1.0, 'talk_time': 0.0}
+
+    data = np.memmap(path, dtype=dtype, mode='r', offset=header['data_offset'], shape=(frames, channels))
+    window = max(header['sample_rate'] * WINDOW_MS // 1000, 1)
+
+    # Per-window min, max and sum of squares over the mono mix, one block at a time
+    win_min, win_max, win_sq, win_len = [], [], [], []
+    block_frames = window * BLOCK_WINDOWS
+    for start in range(0, frames, block_frames):
+        block = decode(np.asarray(data[start:start + block_frames]))
+        mono = block.mean(axis=1) if channels > 1 else block[:, 0]
+        n = len(mono)
+        pad = -n % window
+        lengths = np.full((n + pad) // window, window)
+        if pad:
+            mono = np.concatenate([mono, np.zeros(pad, dtype=np.float32)])
+            lengths[-1] = window - pad
+        windows = mono.reshape(-1, window)
+        win_min.append(windows.min(axis=1))
+        win_max.append(windows.max(axis=1))
+        win_sq.append(np.square(windows, dtype=np.float64).sum(axis=1))
+        win_len.append(lengths)
+    del data
+
+    win_min = np.concatenate(win_min)
+    win_max = np.concatenate(win_max)
+    win_sq = np.concatenate(win_sq)
+    win_len = np.concatenate(win_len)
+
+    win_rms = np.sqrt(win_sq / win_len)
+    silent = win_rms < 10 ** (SILENCE_DB / 20)
+    talk_frames = int(win_len[~silent].sum())
+
+    # Downsample the window envelope to at most `buckets` (min, max) pairs
+    n_buckets = min(buckets, len(win_min))
+    edges = np.linspace(0, len(win_min), n_buckets + 1).astype(np.int64)[:-1]
+    peaks = np.stack([np.minimum.reduceat(win_min, edges), np.maximum.reduceat(win_max, edges)], axis=1)
+    peaks = np.clip(np.round(peaks * 127), -127, 127).astype(np.int8)
+
+    return {
+        'peaks': peaks.tobytes(),
+        'rms': float(np.sqrt(win_sq.sum() / frames)),
+        'silence_ratio': float(silent.mean()),
+        'talk_time': talk_frames / header['sample_rate'],
+    }
+
+
+def analyze_recording(path):
+    # Field values for Call; all None when the file cannot be analysed (missing, not PCM/G.711,
+    # malformed in a way the header checks missed): one bad file must not fail its batch or scan
+    try:
+        return analyze_wav(path)
+    except Exception:
+        return dict.fromkeys(ANALYSIS_FIELDS)
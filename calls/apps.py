@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class CallsConfig(AppConfig):
     name = 'calls'
+
+    def ready(self):
+        from . import signals  # noqa: F401
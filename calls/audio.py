@@ -0,0 +1,254 @@
+import asyncio
+import os
+import mimetypes
+import secrets
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from .coldstore import ARCHIVE_SUFFIX, is_archive, open_recording
+
+# Default chunk size; serve_recording uses settings.AUDIO_STREAM_CHUNK_SIZE
+CHUNK_SIZE = 64 * 1024
+# More ranges than this (after merging overlaps) are answered with the whole file
+MAX_RANGES = 16
+
+
+def recording_etag(st):
+    # Size and mtime identify a recording's content; both change when it is rewritten
+    return quote_etag(f'{st.st_size:x}-{st.st_mtime_ns:x}')
+
+
+def parse_range_header(header, size):
+    """
+    Parse a `Range: bytes=...` header into a sorted list of merged (start, end)
+    inclusive byte ranges.
+
+    Returns None when the header should be ignored (missing, malformed, not bytes
+    or too many ranges) and [] when no range is satisfiable.
+    """
+    if not header or '=' not in header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition('-')
+        if not sep:
+            return None
+        try:
+            if first.strip() == '':
+                # Suffix range: the last N bytes
+                length = int(last)
+                if length < 0:
+                    return None
+                if length == 0:
+                    continue
+                start, end = max(size - length, 0), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last.strip() else size - 1
+                if start < 0 or (last.strip() and end < start):
+                    return None
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, end))
+
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+def if_range_matches(request, etag, st):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        # Strong comparison only; weak tags never match
+        return if_range == etag
+    if if_range.startswith('W/'):
+        return False
+    date = parse_http_date_safe(if_range)
+    return date is not None and date == int(st.st_mtime)
+
+
+def iter_file_range(f, start, length, chunk_size=CHUNK_SIZE):
+    try:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    finally:
+        f.close()
+
+
+def iter_multipart_ranges(path, ranges, parts, boundary, chunk_size=CHUNK_SIZE):
+    with open_recording(path) as f:
+        for (start, end), part_header in zip(ranges, parts):
+            yield part_header
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = f.read(min(chunk_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+            yield b'\r\n'
+        yield f'--{boundary}--\r\n'.encode()
+
+
+def read_at(f, offset, size):
+    f.seek(offset)
+    return f.read(size)
+
+
+async def aiter_file_range(path, start, length, chunk_size=CHUNK_SIZE):
+    """
+    Async counterpart of iter_file_range for ASGI. Each blocking read runs in
+    the default thread pool, so the event loop never waits on the disk.
+
+    A chunk is read only once the server asks for the next one. The ASGI server
+    does that after the previous chunk was sent, which throttles reading to the
+    listener's speed: a slow client keeps one chunk in memory, not the file.
+    """
+    f = await asyncio.to_thread(open_recording, path)
+    try:
+        offset, end = start, start + length
+        while offset < end:
+            data = await asyncio.to_thread(read_at, f, offset, min(chunk_size, end - offset))
+            if not data:
+                break
+            offset += len(data)
+            yield data
+    finally:
+        f.close()
+
+
+async def aiter_multipart_ranges(path, ranges, parts, boundary, chunk_size=CHUNK_SIZE):
+    for (start, end), part_header in zip(ranges, parts):
+        yield part_header
+        async for data in aiter_file_range(path, start, end - start + 1, chunk_size):
+            yield data
+        yield b'\r\n'
+    yield f'--{boundary}--\r\n'.encode()
+
+
+def offload_response(path, content_type):
+    """
+    Let the front-end server send the bytes (and handle Range/conditionals itself).
+    AUDIO_OFFLOAD is 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache mod_xsendfile).
+    """
+    response = HttpResponse(content_type=content_type)
+    if settings.AUDIO_OFFLOAD == 'x-accel-redirect':
+        # nginx maps AUDIO_OFFLOAD_PREFIX to AUDIO_OFFLOAD_ROOT in an `internal` location
+        relative = os.path.relpath(path, settings.AUDIO_OFFLOAD_ROOT)
+        response['X-Accel-Redirect'] = settings.AUDIO_OFFLOAD_PREFIX.rstrip('/') + '/' + relative.replace(os.sep, '/')
+    else:
+        response['X-Sendfile'] = path
+    return response
+
+
+def serve_recording(request, path, download=False, asynchronous=False):
+    """
+    Serve a recording with Range (single and multipart), conditional request and
+    optional X-Accel-Redirect / X-Sendfile support. Cold-tier archives
+    (calls.coldstore) are served as the original recording, decompressing only
+    the blocks each range needs.
+
+    With `asynchronous`, the body is an async iterator for ASGI servers (see
+    aiter_file_range). Under WSGI Django would buffer such a body whole, so
+    leave it off there.
+    """
+    archived = is_archive(path)
+    name = path[:-len(ARCHIVE_SUFFIX)] if archived else path
+    content_type, encoding = mimetypes.guess_type(name)
+    content_type = content_type or 'application/octet-stream'
+    disposition = 'attachment' if download else 'inline'
+    disposition = f'{disposition}; filename="{os.path.basename(name)}"'
+
+    # The front-end server cannot decompress archives
+    if settings.AUDIO_OFFLOAD and not archived:
+        response = offload_response(path, content_type)
+        response['Content-Disposition'] = disposition
+        return response
+
+    chunk_size = settings.AUDIO_STREAM_CHUNK_SIZE
+    st = os.stat(path)
+    size = st.st_size
+    if archived:
+        with open_recording(path) as f:
+            size = f.size
+    etag = recording_etag(st)
+    last_modified = http_date(st.st_mtime)
+
+    # 304 for If-None-Match / If-Modified-Since, 412 for failed If-Match / If-Unmodified-Since
+    response = get_conditional_response(request, etag=etag, last_modified=int(st.st_mtime))
+    if response is None:
+        ranges = None
+        if request.method in ('GET', 'HEAD') and if_range_matches(request, etag, st):
+            ranges = parse_range_header(request.headers.get('Range'), size)
+
+        if ranges is None and (asynchronous or archived):
+            if asynchronous:
+                body = aiter_file_range(path, 0, size, chunk_size)
+            else:
+                # Not a FileResponse: wsgi.file_wrapper would send the compressed bytes
+                body = iter_file_range(open_recording(path), 0, size, chunk_size)
+            response = StreamingHttpResponse(body, content_type=content_type)
+            response['Content-Length'] = str(size)
+        elif ranges is None:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+            response.block_size = chunk_size
+        elif not ranges:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            if asynchronous:
+                body = aiter_file_range(path, start, end - start + 1, chunk_size)
+            else:
+                body = iter_file_range(open_recording(path), start, end - start + 1, chunk_size)
+            response = StreamingHttpResponse(body, status=206, content_type=content_type)
+            response['Content-Length'] = str(end - start + 1)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        else:
+            boundary = secrets.token_hex(16)
+            parts = [
+                (f'--{boundary}\r\nContent-Type: {content_type}\r\n'
+                 f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n').encode()
+                for start, end in ranges
+            ]
+            length = sum(len(part) + (end - start + 1) + 2 for part, (start, end) in zip(parts, ranges))
+            length += len(f'--{boundary}--\r\n')
+            iter_ranges = aiter_multipart_ranges if asynchronous else iter_multipart_ranges
+            response = StreamingHttpResponse(
+                iter_ranges(path, ranges, parts, boundary, chunk_size), status=206,
+                content_type=f'multipart/byteranges; boundary={boundary}')
+            response['Content-Length'] = str(length)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    if response.status_code in (200, 206):
+        response['Content-Disposition'] = disposition
+    return response
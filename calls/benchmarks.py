@@ -0,0 +1,224 @@
+"""
+Measurements behind `manage.py benchmark_calls`. Each function runs against
+whatever database is configured (the command points it at a throwaway test
+database) and returns plain dicts, so results can be dumped as JSON and compared
+between commits.
+"""
+import asyncio
+import datetime
+import io
+import os
+import random
+import time
+from asgiref.sync import sync_to_async
+from django import db
+from django.core.management.base import OutputWrapper
+from django.core.management.color import no_style
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from watchdog.observers import Observer
+from .ingest import CallWriter
+from .models import Call, User
+from .pipeline import IngestPipeline
+from .scanner import Scanner
+from .synthetic import make_clips, write_call
+
+
+def percentiles(values, points=(50, 95, 99)):
+    ordered = sorted(values)
+    if not ordered:
+        return {}
+    result = {f'p{point}': ordered[min(len(ordered) * point // 100, len(ordered) - 1)] for point in points}
+    result['max'] = ordered[-1]
+    return result
+
+
+def rate(count, seconds):
+    return count / seconds if seconds else 0.0
+
+
+def bench_sync(base_dir, workers=None, processes=False, batch_size=1000, touch_fraction=0.01):
+    """
+    sync_calls three times over the same tree: a full sync into an empty table,
+    an incremental sync with nothing changed, and an incremental sync after
+    `touch_fraction` of the recordings got a new mtime.
+    """
+    def run(incremental):
+        writer = CallWriter(create_users=True, batch_size=batch_size)
+        # The options sync_calls passes, so the timings include linking conversations
+        scanner = Scanner(base_dir, workers=workers, use_processes=processes, incremental=incremental,
+                          link_conversation=True)
+        start = time.perf_counter()
+        scanner.run(writer)
+        seconds = time.perf_counter() - start
+        written = writer.count_created + writer.count_updated
+        files = written + scanner.count_skipped
+        return {'files': files, 'written': written, 'seconds': seconds, 'files_per_sec': rate(files, seconds)}
+
+    results = {'full': run(incremental=False), 'incremental': run(incremental=True)}
+
+    wavs = [
+        os.path.join(dir_path, name)
+        for dir_path, _, names in os.walk(base_dir) for name in names if name.endswith('_full.wav')
+    ]
+    now = time.time()
+    for path in random.Random(0).sample(wavs, max(int(len(wavs) * touch_fraction), 1)):
+        os.utime(path, (now, now))
+    results['incremental_touched'] = run(incremental=True)
+    return results
+
+
+def wait_for_calls(closed_at, timeout, poll=0.01):
+    # session_id -> seconds from the wav being closed until its row was visible
+    latencies = {}
+    deadline = time.perf_counter() + timeout
+    while len(latencies) < len(closed_at) and time.perf_counter() < deadline:
+        pending = [session_id for session_id in closed_at if session_id not in latencies]
+        seen = list(Call.objects.filter(session_id__in=pending).values_list('session_id', flat=True))
+        now = time.perf_counter()
+        for session_id in seen:
+            latencies[session_id] = now - closed_at[session_id]
+        time.sleep(poll)
+    return latencies
+
+
+def bench_watch(root, burst=200, settle_time=0.5, batch_size=100, timeout=120):
+    """
+    Start the watch_calls pipeline and observer on `root`/call_sessions, write a
+    burst of `burst` calls for registered callers as fast as possible and report
+    the ingest latency percentiles (wav closed -> row visible, polled every 10 ms).
+    """
+    from .management.commands.watch_calls import CallHandler
+
+    base_dir = os.path.join(root, 'call_sessions')
+    callers = list(User.objects.filter(phone_number__in=os.listdir(base_dir)).values_list('phone_number', flat=True))
+    if not callers:
+        raise ValueError("No registered callers in the tree; run a sync first.")
+
+    stdout = OutputWrapper(io.StringIO())
+    pipeline = IngestPipeline(stdout, no_style(), settle_time=settle_time, batch_size=batch_size)
+    observer = Observer()
+    observer.schedule(CallHandler(stdout, no_style(), pipeline), base_dir, recursive=True)
+    pipeline.start()
+    observer.start()
+
+    rng = random.Random(1)
+    clips = make_clips(8000, 1.0, 5.0, rng, count=4)
+    prefix = f'{int(time.time())}.bench'
+    now = datetime.datetime.now(datetime.timezone.utc)
+    try:
+        # Warm-up call: the writer spawns its analysis processes on the first batch
+        closed_at = {}
+        write_call(root, callers[0], f'{prefix}-warmup', now, clips, rng)
+        closed_at[f'{prefix}-warmup'] = time.perf_counter()
+        wait_for_calls(closed_at, timeout)
+
+        closed_at = {}
+        start = time.perf_counter()
+        for i in range(burst):
+            session_id = f'{prefix}{i}'
+            write_call(root, rng.choice(callers), session_id, now, clips, rng)
+            closed_at[session_id] = time.perf_counter()
+        write_seconds = time.perf_counter() - start
+        latencies = wait_for_calls(closed_at, timeout)
+        total_seconds = time.perf_counter() - start
+    finally:
+        observer.stop()
+        observer.join()
+        pipeline.stop()
+
+    return {
+        'calls': burst,
+        'ingested': len(latencies),
+        'write_seconds': write_seconds,
+        'calls_per_sec': rate(len(latencies), total_seconds),
+        'latency': percentiles(list(latencies.values())),
+    }
+
+
+def bench_dashboard(user, depths=(1, 10, 50)):
+    """
+    Follow the dashboard's Next links for `user` and report query count and
+    latency at each page depth, plus a transcript search and a reason filter.
+    Needs setup_test_environment() for response.context.
+    """
+    client = Client()
+    client.force_login(user)
+
+    def fetch(url):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = client.get(url)
+            seconds = time.perf_counter() - start
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} returned {response.status_code}")
+        return response, {'queries': len(queries), 'ms': seconds * 1000}
+
+    dashboard = reverse('dashboard')
+    pages = []
+    url = dashboard
+    for depth in range(1, max(depths) + 1):
+        response, result = fetch(url)
+        if depth in depths:
+            pages.append({'page': depth, **result})
+        cursor = response.context['page_obj'].next_cursor if response.context['page_obj'] else None
+        if not cursor:
+            break
+        url = f'{dashboard}?after={cursor}'
+
+    reason = user.reason_stats.values_list('reason', flat=True).first()
+    extra = {'search': fetch(f'{dashboard}?q=invoice')[1]}
+    if reason:
+        extra['reason'] = fetch(f'{dashboard}?reason={reason}')[1]
+    return {'pages': pages, **extra}
+
+
+def bench_audio(call, requests=100, concurrency=50, range_bytes=64 * 1024):
+    """
+    Throughput of the play endpoint for one recording: sequential full and
+    ranged GETs through the WSGI path, then `concurrency` concurrent full GETs
+    through the ASGI path. In-process (test clients), so no network or server.
+    """
+    url = reverse('play_audio', args=[call.pk])
+    range_header = {'range': f'bytes=0-{range_bytes - 1}'}
+
+    client = Client()
+    client.force_login(call.user)
+
+    def run_sync(headers):
+        received = 0
+        start = time.perf_counter()
+        for _ in range(requests):
+            response = client.get(url, headers=headers)
+            received += sum(len(chunk) for chunk in response.streaming_content)
+            response.close()
+        seconds = time.perf_counter() - start
+        return {'requests': requests, 'seconds': seconds, 'req_per_sec': rate(requests, seconds),
+                'mb_per_sec': rate(received / 2 ** 20, seconds)}
+
+    async def run_async():
+        async_client = AsyncClient()
+        await async_client.aforce_login(call.user)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with semaphore:
+                response = await async_client.get(url)
+                return sum([len(chunk) async for chunk in response.streaming_content])
+
+        start = time.perf_counter()
+        received = sum(await asyncio.gather(*(one() for _ in range(requests))))
+        seconds = time.perf_counter() - start
+        # The async views' queries ran on asgiref's sync thread, which keeps its connection open
+        await sync_to_async(db.connections.close_all)()
+        return {'requests': requests, 'concurrency': concurrency, 'seconds': seconds,
+                'req_per_sec': rate(requests, seconds), 'mb_per_sec': rate(received / 2 ** 20, seconds)}
+
+    return {
+        'file_bytes': call.wav_size,
+        'sync_full': run_sync({}),
+        'sync_range': run_sync(range_header),
+        'async_full': asyncio.run(run_async()),
+    }
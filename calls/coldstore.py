@@ -0,0 +1,205 @@
+"""
+Cold tier for aged recordings (`manage.py archive_recordings`).
+
+A recording is archived as a block-compressed container: the file is cut into
+fixed-size blocks, each compressed on its own (lzma, with a delta filter sized
+to the PCM sample frame, or zlib), followed by an index of block offsets. Any
+byte range can then be served by decompressing only the blocks it covers;
+ArchiveReader exposes that as a seekable file so calls.audio and calls.export
+read archives like plain recordings (open_recording).
+
+    header   <4sBBBxIQ  magic, version, codec, delta distance, block size, original size
+    blocks   compressed independently
+    index    <Q per block, plus the end of the last block
+    trailer  <Q4s       index offset, magic
+"""
+import io
+import lzma
+import os
+import struct
+import sys
+import zlib
+from array import array
+from django.conf import settings
+from .wav import WAVE_FORMAT_PCM, read_wav_header
+
+ARCHIVE_SUFFIX = '.pbxz'
+MAGIC = b'PBXZ'
+TRAILER_MAGIC = b'PBXI'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBxIQ')
+TRAILER = struct.Struct('<Q4s')
+CODECS = {'zlib': 1, 'lzma': 2}
+BLOCK_SIZE = 64 * 1024
+
+
+def is_archive(path):
+    return path.endswith(ARCHIVE_SUFFIX)
+
+
+def archive_path(call):
+    return os.path.join(settings.COLD_RECORDINGS_ROOT, call.archive_filename)
+
+
+def open_recording(path):
+    # Binary, seekable file object for a plain recording or an archive
+    return ArchiveReader(path) if is_archive(path) else open(path, 'rb')
+
+
+def _lzma_filters(delta, block_size):
+    filters = [{'id': lzma.FILTER_DELTA, 'dist': delta}] if delta else []
+    # The dictionary never needs to outgrow a block; keeps the per-block setup cheap
+    return filters + [{'id': lzma.FILTER_LZMA2, 'preset': 6, 'dict_size': max(block_size, 4096)}]
+
+
+def _delta_distance(f):
+    # Bytes per PCM sample frame, so each channel's samples are differenced against their own
+    try:
+        header = read_wav_header(f)
+    except ValueError:
+        return 0
+    finally:
+        f.seek(0)
+    if header['format_tag'] == WAVE_FORMAT_PCM and 0 < header['block_align'] <= 256:
+        return header['block_align']
+    return 0
+
+
+def write_archive(src, dst, codec='lzma', block_size=BLOCK_SIZE):
+    """
+    Compress the recording at `src` into an archive at `dst` (written to a
+    temporary name, fsynced and renamed, with the recording's mtime).
+    Returns (original size, archive size, crc32 of the original).
+    """
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = dst + '.tmp'
+    crc = 0
+    try:
+        with open(src, 'rb') as f, open(tmp, 'wb') as out:
+            st = os.fstat(f.fileno())
+            delta = _delta_distance(f) if codec == 'lzma' else 0
+            if codec == 'lzma':
+                filters = _lzma_filters(delta, block_size)
+                compress = lambda data: lzma.compress(data, format=lzma.FORMAT_XZ, check=lzma.CHECK_NONE, filters=filters)
+            else:
+                compress = lambda data: zlib.compress(data, 6)
+            out.write(HEADER.pack(MAGIC, VERSION, CODECS[codec], delta, block_size, st.st_size))
+            offsets = array('Q')
+            size = 0
+            while True:
+                data = f.read(block_size)
+                if not data:
+                    break
+                size += len(data)
+                crc = zlib.crc32(data, crc)
+                offsets.append(out.tell())
+                out.write(compress(data))
+            offsets.append(out.tell())
+            if size != st.st_size:
+                raise ValueError(f"{src} changed while it was archived")
+            index_offset = out.tell()
+            if sys.byteorder != 'little':
+                offsets.byteswap()
+            out.write(offsets.tobytes())
+            out.write(TRAILER.pack(index_offset, TRAILER_MAGIC))
+            out.flush()
+            os.fsync(out.fileno())
+        os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp, dst)
+    finally:
+        # Only left behind if the archive failed; a half-written one would never be cleaned up
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+    return size, os.path.getsize(dst), crc
+
+
+def archive_crc(path):
+    # crc32 of the decompressed recording, to check an archive against its source
+    crc = 0
+    with ArchiveReader(path) as f:
+        while True:
+            data = f.read(BLOCK_SIZE)
+            if not data:
+                return crc
+            crc = zlib.crc32(data, crc)
+
+
+class ArchiveReader(io.RawIOBase):
+    """
+    Read-only, seekable view of the original recording in an archive. A read
+    decompresses the block under the current position (the last one is kept),
+    so seeking costs nothing and a range read touches only its blocks. There
+    is deliberately no fileno(): servers would sendfile() the compressed bytes.
+    """
+
+    def __init__(self, path):
+        self.name = path
+        self.raw = open(path, 'rb')
+        try:
+            magic, version, codec, delta, self.block_size, self.size = HEADER.unpack(self.raw.read(HEADER.size))
+            if magic != MAGIC or version != VERSION or codec not in CODECS.values():
+                raise ValueError(f"{path} is not a recording archive")
+            self.raw.seek(-TRAILER.size, os.SEEK_END)
+            index_offset, trailer_magic = TRAILER.unpack(self.raw.read(TRAILER.size))
+            if trailer_magic != TRAILER_MAGIC:
+                raise ValueError(f"{path} is truncated")
+            count = -(-self.size // self.block_size)
+            self.raw.seek(index_offset)
+            self.offsets = array('Q')
+            self.offsets.frombytes(self.raw.read((count + 1) * self.offsets.itemsize))
+            if len(self.offsets) != count + 1:
+                raise ValueError(f"{path} has a truncated index")
+            if sys.byteorder != 'little':
+                self.offsets.byteswap()
+        except Exception:
+            self.raw.close()
+            raise
+        # An xz block carries its own filter chain (delta included)
+        self.decompress = zlib.decompress if codec == CODECS['zlib'] else lzma.decompress
+        self.position = 0
+        self.cached_index = None
+        self.cached_block = b''
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self.position = offset
+        return offset
+
+    def _block(self, index):
+        if index != self.cached_index:
+            start = self.offsets[index]
+            self.raw.seek(start)
+            self.cached_block = self.decompress(self.raw.read(self.offsets[index + 1] - start))
+            self.cached_index = index
+        return self.cached_block
+
+    def readinto(self, buffer):
+        if self.position >= self.size:
+            return 0
+        index, skip = divmod(self.position, self.block_size)
+        block = memoryview(self._block(index))[skip:]
+        n = min(len(buffer), len(block))
+        buffer[:n] = block[:n]
+        self.position += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.raw.close()
+        super().close()
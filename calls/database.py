@@ -0,0 +1,56 @@
+"""
+Connection handling for long-running code outside requests (watch_calls'
+main loop and pipeline threads).
+
+Django only recycles a thread's connection around requests: request_started
+and request_finished call close_old_connections(), which applies CONN_MAX_AGE
+and CONN_HEALTH_CHECKS. Threads that never see a request call refresh() at the
+start of each unit of work, close their connection when they finish, and on
+losing the server wait for it with wait_for_database() instead of dropping
+the work or dying.
+"""
+from django import db
+
+MAX_BACKOFF = 60
+# Server unreachable or the connection broken; also transient server-side failures, which a retry handles too
+CONNECTION_ERRORS = (db.InterfaceError, db.OperationalError)
+
+
+def refresh():
+    """
+    What request_started does for a request, before a unit of work: close this
+    thread's connection if it outlived CONN_MAX_AGE or an error left it
+    unusable, and health-check a reused one. CONN_MAX_AGE = 0 means a connection
+    per web request; a worker thread keeps its own (after a `SELECT 1`) instead.
+    """
+    if db.connection.settings_dict['CONN_MAX_AGE'] != 0:
+        db.close_old_connections()
+    elif db.connection.connection is not None and not db.connection.is_usable():
+        db.connection.close()
+
+
+def connection_lost(error):
+    # An error that was the connection's fault (restart, failover, network) rather than the query's
+    if isinstance(error, db.InterfaceError):
+        return True
+    if not isinstance(error, db.OperationalError):
+        return False
+    return db.connection.connection is None or not db.connection.is_usable()
+
+
+def wait_for_database(stopping, backoff=1):
+    """
+    Block until this thread can connect again, retrying with exponential
+    backoff (up to MAX_BACKOFF seconds). Returns False if `stopping` (a
+    threading.Event) is set first.
+    """
+    while True:
+        db.connection.close()
+        try:
+            db.connection.ensure_connection()
+            return True
+        except CONNECTION_ERRORS:
+            pass
+        if stopping.wait(backoff):
+            return False
+        backoff = min(backoff * 2, MAX_BACKOFF)
@@ -0,0 +1,143 @@
+import asyncio
+import datetime
+import os
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from django import db
+from django.utils import timezone
+from .coldstore import archive_path, open_recording
+from .models import Call
+
+CHUNK_SIZE = 1024 * 1024
+# ZIP timestamps cannot predate 1980
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+
+class ZipSink:
+    """
+    Write-only, non-seekable file object for zipfile. Without seek(), zipfile
+    streams each entry followed by a data descriptor instead of rewinding to
+    patch the local header, so the archive can be sent as it is produced.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def export_queryset(user=None, caller_id=None, date_from=None, date_to=None, reasons=()):
+    # Calls to export, oldest first. date_from/date_to are inclusive local dates.
+    calls = Call.objects.all()
+    if user is not None:
+        calls = calls.filter(user=user)
+    if caller_id:
+        calls = calls.filter(caller_id=caller_id)
+    if date_from:
+        calls = calls.filter(created_at__gte=timezone.make_aware(datetime.datetime.combine(date_from, datetime.time.min)))
+    if date_to:
+        next_day = date_to + datetime.timedelta(days=1)
+        calls = calls.filter(created_at__lt=timezone.make_aware(datetime.datetime.combine(next_day, datetime.time.min)))
+    if reasons:
+        # Any of the reasons: reasons && ARRAY[...], on the GIN index
+        calls = calls.filter(reasons__overlap=list(reasons))
+    return calls.order_by('created_at', 'id').only(
+        'caller_id', 'session_id', 'wav_filename', 'txt_filename', 'full_conversation_filename',
+        'storage_tier', 'archive_filename')
+
+
+def call_files(call, base_dir):
+    # (name in the archive, path on disk) for the recordings and transcript of one call
+    folder = f'{call.caller_id}/{call.session_id}'
+    wav_path = archive_path(call) if call.storage_tier == 'cold' else os.path.join(base_dir, call.wav_filename)
+    files = [(f'{folder}/{os.path.basename(call.wav_filename)}', wav_path)]
+    if call.full_conversation_filename:
+        files.append((f'{folder}/full_conversation.wav',
+                      os.path.normpath(os.path.join(base_dir, call.full_conversation_filename))))
+    if call.txt_filename:
+        files.append((f'{folder}/{call.txt_filename}',
+                      os.path.join(base_dir, os.path.dirname(call.wav_filename), call.txt_filename)))
+    return files
+
+
+def iter_export_zip(calls, base_dir, chunk_size=CHUNK_SIZE):
+    """
+    Yield a ZIP of the recordings and transcripts of `calls` as it is written.
+
+    Entries are stored (WAV does not compress) and copied chunk_size bytes at a
+    time, with ZIP64 headers once an entry or the archive outgrows 4 GiB. Memory
+    use is one chunk plus the central directory (about 100 bytes per file);
+    files that disappeared since ingest are left out. Cold-tier recordings are
+    decompressed into the ZIP.
+    """
+    sink = ZipSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for call in calls.iterator(chunk_size=500):
+            for arcname, path in call_files(call, base_dir):
+                try:
+                    f = open_recording(path)
+                    mtime = os.stat(path).st_mtime
+                except (OSError, ValueError):
+                    continue
+                with f:
+                    # The recording's size (decompressed, for archives)
+                    size = f.seek(0, os.SEEK_END)
+                    f.seek(0)
+                    info = zipfile.ZipInfo(arcname, date_time=max(time.localtime(mtime)[:6], ZIP_EPOCH))
+                    info.compress_type = zipfile.ZIP_STORED
+                    # Lets zipfile pick ZIP64 headers up front for entries over 4 GiB
+                    info.file_size = size
+                    with archive.open(info, 'w') as entry:
+                        remaining = size
+                        while remaining > 0:
+                            data = f.read(min(chunk_size, remaining))
+                            if not data:
+                                break
+                            remaining -= len(data)
+                            entry.write(data)
+                            yield sink.drain()
+                yield sink.drain()
+    # Central directory
+    yield sink.drain()
+
+
+def _finish(iterator):
+    iterator.close()
+    db.connection.close()
+
+
+async def aiter_in_thread(iterator):
+    """
+    Drive a blocking iterator from an async view. Every step runs on the same
+    dedicated thread, so the iterator keeps one DB connection (and its open
+    cursor) throughout; the next step only starts once the server has taken
+    the previous chunk.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='export')
+    try:
+        while True:
+            chunk = await loop.run_in_executor(executor, next, iterator, None)
+            if chunk is None:
+                break
+            if chunk:
+                yield chunk
+    finally:
+        executor.submit(_finish, iterator)
+        executor.shutdown(wait=False)
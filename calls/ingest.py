@@ -0,0 +1,373 @@
+import os
+import datetime
+import logging
+import time
+from collections import defaultdict
+from django.db import connection, transaction
+from django.db.models import Case, Value, When
+from django.utils.timezone import make_aware
+from .analysis import ANALYSIS_FIELDS
+from .metrics import INGEST_BATCH_SIZE, INGEST_FILES, INGEST_UPSERT_SECONDS
+from .live import notify_calls
+from .models import Call, User, ScannedFile
+from .partitions import is_partitioned, retention_cutoff
+from .registry import notify_users_changed
+from .search import transcript_vector
+from .stats import STATS_FIELDS, StatsDelta, split_transfer_reasons
+from .transcripts import transfer_fields
+from .wav import WAV_FIELDS, wav_metadata
+
+logger = logging.getLogger(__name__)
+
+# Fields rewritten when an existing call is upserted again; also created_at, unless the table is
+# partitioned and it is part of the conflict target (CallWriter then moves such rows beforehand)
+CALL_UPDATE_FIELDS = [
+    'user', 'caller_id', 'wav_filename', 'txt_filename', 'wav_size', 'txt_size',
+    'transfer_reasons', 'transfer_reason_descriptions', 'reasons', 'last_updated_at', 'missing_at',
+    'peaks', 'rms', 'silence_ratio', 'talk_time', 'transcript', *WAV_FIELDS,
+    # Left at their defaults (hot, no archive): a recording restored to the hot tree is served from there
+    'storage_tier', 'archive_filename',
+]
+# Only rewritten when the scan looked for (and found) the full conversation recording
+CONVERSATION_FIELDS = ['full_conversation_filename', 'conversation_duration']
+# Advisory lock namespace (first key of pg_advisory_xact_lock(int, int)) for sessions being written,
+# next to calls.sharding's
+SESSION_LOCKS = 0x70627803
+
+
+def lock_sessions(session_ids):
+    """
+    Hold a transaction-level advisory lock on each session until commit, taken
+    in one order so writers can't deadlock. Covers sessions that have no row
+    yet, which SELECT ... FOR UPDATE can't lock.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT pg_advisory_xact_lock(%s, key) FROM '
+            '(SELECT DISTINCT hashtext(session_id) AS key FROM unnest(%s::text[]) AS session_id ORDER BY key) AS keys',
+            [SESSION_LOCKS, list(session_ids)])
+
+
+def parse_session_id(filename):
+    # Filename: {caller_id}_{session_id}_full.wav
+    # The user script says: session_id=$(echo "$base_name" | cut -d'_' -f2)
+    base_name = filename.replace('_full.wav', '')
+    parts = base_name.split('_')
+    session_id = parts[1] if len(parts) >= 2 else base_name  # Fallback
+    return base_name, session_id
+
+
+def read_transcript(txt_path):
+    # Returns (transfer_reasons, transfer_reason_descriptions, full text); the full text is
+    # what transcript search indexes
+    with open(txt_path, 'rb') as f:
+        content = f.read().decode('utf-8', errors='ignore').replace('\r\n', '\n')
+    # Postgres text cannot hold NUL bytes
+    return (*transfer_fields(content), content.replace('\x00', ''))
+
+
+def file_signature(st):
+    # What the manifest compares to decide whether a file changed since the last scan
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def stat_or_none(path):
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+
+def mtime_datetime(st):
+    # Call.created_at is the wav's mtime
+    return make_aware(datetime.datetime.fromtimestamp(st.st_mtime))
+
+
+def conversation_path(dir_path, base_name):
+    # Conversation file lives in a sibling directory: ../../{caller_id}_{session_id}/full_conversation.wav
+    # relative to dir_path, i.e. ../{base_name}/full_conversation.wav relative to call_sessions
+    # (settings.RECORDINGS_ROOT).
+    sounds_root = os.path.abspath(os.path.join(dir_path, '../../'))
+    return os.path.join(sounds_root, base_name, 'full_conversation.wav')
+
+
+def conversation_filename(base_name):
+    # Call.full_conversation_filename: relative to call_sessions, like wav_filename
+    return os.path.join('..', base_name, 'full_conversation.wav')
+
+
+def build_call_record(dir_path, filename, caller_id, wav_stat, txt_stat, link_conversation=False):
+    """
+    Build the field values for one `_full.wav` recording, ready for CallWriter.add().
+    Header metadata (calls.wav) is read here; audio analysis fields are left as
+    None and filled by callers from calls.analysis.
+    """
+    base_name, session_id = parse_session_id(filename)
+    txt_filename = filename.replace('_full.wav', '_full.txt')
+
+    txt_size = 0
+    transfer_reasons = ""
+    transfer_reason_descriptions = ""
+    transcript = ""
+    if txt_stat is not None:
+        txt_size = txt_stat.st_size
+        transfer_reasons, transfer_reason_descriptions, transcript = read_transcript(
+            os.path.join(dir_path, txt_filename))
+
+    record = {
+        'session_id': session_id,
+        'caller_id': caller_id,
+        'wav_filename': os.path.join(caller_id, filename),
+        'txt_filename': txt_filename,
+        'wav_size': wav_stat.st_size,
+        'txt_size': txt_size,
+        'created_at': mtime_datetime(wav_stat),
+        'transfer_reasons': transfer_reasons,
+        'transfer_reason_descriptions': transfer_reason_descriptions,
+        'reasons': split_transfer_reasons(transfer_reasons),
+        'transcript': transcript,
+        # On disk again (or moved) if reconcile_calls had marked it missing
+        'missing_at': None,
+        **wav_metadata(os.path.join(dir_path, filename)),
+        **dict.fromkeys(ANALYSIS_FIELDS),
+    }
+
+    if link_conversation:
+        # Only set when found so we never clear an existing link
+        conversation = conversation_path(dir_path, base_name)
+        if os.path.exists(conversation):
+            record['full_conversation_filename'] = conversation_filename(base_name)
+            record['conversation_duration'] = wav_metadata(conversation)['duration']
+
+    return record
+
+
+def manifest_entries(caller_id, filename, wav_stat, txt_stat, conversation_stat=None):
+    # Plain tuples so scanner workers can hand them across process boundaries
+    txt_filename = filename.replace('_full.wav', '_full.txt')
+    entries = [(os.path.join(caller_id, filename), wav_stat)]
+    if txt_stat is not None:
+        entries.append((os.path.join(caller_id, txt_filename), txt_stat))
+    if conversation_stat is not None:
+        # Filed under the caller folder, so a conversation arriving later invalidates the recording
+        entries.append((conversation_filename(parse_session_id(filename)[0]), conversation_stat))
+    return [(path, caller_id) + file_signature(st) for path, st in entries]
+
+
+def load_manifests(caller_ids):
+    manifests = {caller_id: {} for caller_id in caller_ids}
+    rows = ScannedFile.objects.filter(directory__in=caller_ids).values_list(
+        'directory', 'path', 'inode', 'size', 'mtime_ns')
+    for directory, path, inode, size, mtime_ns in rows:
+        manifests[directory][path] = (inode, size, mtime_ns)
+    return manifests
+
+
+def load_existing_calls(caller_ids):
+    """
+    What is already stored for these callers' recordings, for skipping unchanged
+    calls without a manifest: caller_id -> {wav_filename: (wav_size, txt_size,
+    created_at, linked)}, compared against call_signature().
+    """
+    existing = {caller_id: {} for caller_id in caller_ids}
+    rows = Call.objects.filter(user__phone_number__in=caller_ids).values_list(
+        'caller_id', 'wav_filename', 'wav_size', 'txt_size', 'created_at', 'full_conversation_filename')
+    for caller_id, wav_filename, wav_size, txt_size, created_at, conversation in rows:
+        if caller_id in existing:
+            existing[caller_id][wav_filename] = (wav_size, txt_size, created_at, bool(conversation))
+    return existing
+
+
+def call_signature(wav_stat, txt_stat):
+    return (wav_stat.st_size, txt_stat.st_size if txt_stat is not None else 0, mtime_datetime(wav_stat))
+
+
+def link_conversation(conversation):
+    """
+    Point the call of a full_conversation.wav (`{sessions}/{caller_id}_{session_id}/`)
+    at it with one targeted update; 0 if the call is not ingested yet, in which case
+    build_call_record links it when its recording arrives.
+    """
+    base_name = os.path.basename(os.path.dirname(conversation))
+    return Call.objects.filter(session_id=parse_session_id(base_name)[1]).update(
+        full_conversation_filename=conversation_filename(base_name),
+        conversation_duration=wav_metadata(conversation)['duration'],
+    )
+
+
+def link_missing_conversations(base_dir, calls):
+    # Link the calls in `calls` whose conversation recording has appeared since; returns how many
+    linked = 0
+    for wav_filename in calls.filter(full_conversation_filename__isnull=True).values_list('wav_filename', flat=True).iterator():
+        dir_path = os.path.join(base_dir, os.path.dirname(wav_filename))
+        conversation = conversation_path(dir_path, parse_session_id(os.path.basename(wav_filename))[0])
+        if os.path.exists(conversation):
+            linked += link_conversation(conversation)
+    return linked
+
+
+class CallWriter:
+    """
+    Buffers call records and writes them in batches: one query to create missing
+    users, one upsert for the calls, one upsert for the scan manifest and one per
+    rollup table (calls.stats), all in a single transaction.
+    """
+    batch_size = 1000
+
+    def __init__(self, create_users=True, batch_size=None, users=None):
+        self.create_users = create_users
+        # calls.registry.RegisteredUsers: resolve callers from memory instead of a query per batch
+        self.users = users
+        if batch_size:
+            self.batch_size = batch_size
+        self.pending = {}
+        self.manifest = {}
+        self.count_created = 0
+        self.count_updated = 0
+        # Callers no user could be created for (their phone number is another user's username)
+        self.unresolved_callers = set()
+
+    def add(self, record, entries=()):
+        # Later records for the same session replace earlier ones; Postgres refuses
+        # to touch the same row twice in one INSERT ... ON CONFLICT statement.
+        self.pending[record['session_id']] = record
+        for path, directory, inode, size, mtime_ns in entries:
+            self.manifest[path] = ScannedFile(
+                path=path, directory=directory, inode=inode, size=size, mtime_ns=mtime_ns)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def write(self, records):
+        """
+        Upsert `records` as one batch, bypassing the auto-flush in add().
+        Returns the Call objects that were upserted.
+        """
+        for record in records:
+            self.pending[record['session_id']] = record
+        return self.flush()
+
+    def flush(self):
+        """
+        Write everything buffered; returns the Call objects that were upserted.
+        """
+        if not self.pending and not self.manifest:
+            return []
+        records = list(self.pending.values())
+        entries = list(self.manifest.values())
+        self.pending = {}
+        self.manifest = {}
+
+        start = time.perf_counter()
+        with transaction.atomic():
+            users = self._resolve_users({r['caller_id'] for r in records})
+            # Previous versions of the rows about to be overwritten, for the rollup deltas. Writers racing
+            # on a session (watcher, sync_calls, partition catch-up) would each subtract the same version
+            # and count the call twice: the session locks make them take turns, the row locks keep
+            # other updates and deletes out until commit
+            session_ids = [r['session_id'] for r in records]
+            lock_sessions(session_ids)
+            versions = defaultdict(list)
+            for row in (Call.objects.select_for_update().filter(session_id__in=session_ids)
+                        .order_by('id').values('id', 'session_id', *STATS_FIELDS)):
+                versions[row['session_id']].append(row)
+
+            cutoff = retention_cutoff()
+            calls = []
+            linked = []
+            for record in records:
+                user_id = users.get(record['caller_id'])
+                if user_id is None and not self.create_users:
+                    continue
+                if cutoff is not None and record['created_at'] < cutoff:
+                    # Would land in an expired month (partition_calls)
+                    continue
+                call = Call(user_id=user_id, **record)
+                # Only overwrite full_conversation_filename when this scan found it
+                (linked if 'full_conversation_filename' in record else calls).append(call)
+
+            existing = {}
+            duplicates = []
+            for call in calls + linked:
+                rows = versions.get(call.session_id)
+                if rows:
+                    # More than one only on a partitioned table, from writers racing with different
+                    # mtimes: keep the row the upsert would match, or else the oldest
+                    keep = next((row for row in rows if row['created_at'] == call.created_at), rows[0])
+                    existing[call.session_id] = keep
+                    duplicates.extend(row['id'] for row in rows if row is not keep)
+            if duplicates:
+                # One by one, so post_delete takes them out of the rollups
+                Call.objects.filter(pk__in=duplicates).delete()
+
+            if is_partitioned():
+                # The upsert matches on (session_id, created_at): first move the rows of sessions whose
+                # recording changed mtime (possibly into another partition)
+                moved = [call for call in calls + linked
+                         if call.session_id in existing and existing[call.session_id]['created_at'] != call.created_at]
+                if moved:
+                    Call.objects.filter(session_id__in=[call.session_id for call in moved]).update(created_at=Case(
+                        *[When(session_id=call.session_id, then=Value(call.created_at)) for call in moved]))
+                unique_fields, update_fields = ['session_id', 'created_at'], CALL_UPDATE_FIELDS
+            else:
+                unique_fields, update_fields = ['session_id'], CALL_UPDATE_FIELDS + ['created_at']
+
+            for batch, batch_fields in ((calls, update_fields), (linked, update_fields + CONVERSATION_FIELDS)):
+                if batch:
+                    Call.objects.bulk_create(
+                        batch,
+                        update_conflicts=True,
+                        unique_fields=unique_fields,
+                        update_fields=batch_fields,
+                    )
+
+            # search_vector is derived in SQL from the transcript just written
+            written_sessions = [call.session_id for call in calls + linked]
+            if written_sessions:
+                Call.objects.filter(session_id__in=written_sessions).update(search_vector=transcript_vector())
+
+            stats = StatsDelta()
+            for call in calls + linked:
+                stats.replace(existing.get(call.session_id), {field: getattr(call, field) for field in STATS_FIELDS})
+            stats.apply()
+
+            if entries:
+                ScannedFile.objects.bulk_create(
+                    entries,
+                    update_conflicts=True,
+                    unique_fields=['path'],
+                    update_fields=['directory', 'inode', 'size', 'mtime_ns', 'scanned_at'],
+                )
+
+            # Live dashboards (calls.live); delivered on commit
+            notify_calls(calls + linked)
+
+        INGEST_UPSERT_SECONDS.observe(time.perf_counter() - start)
+        written = calls + linked
+        INGEST_BATCH_SIZE.observe(len(written))
+        INGEST_FILES.labels('written').inc(len(written))
+        for call in written:
+            if call.session_id in existing:
+                self.count_updated += 1
+            else:
+                self.count_created += 1
+        return written
+
+    def _resolve_users(self, caller_ids):
+        if self.users is not None and not self.create_users:
+            return self.users.resolve(caller_ids)
+        users = dict(User.objects.filter(phone_number__in=caller_ids).values_list('phone_number', 'id'))
+        missing = caller_ids - users.keys()
+        if missing and self.create_users:
+            User.objects.bulk_create(
+                [User(phone_number=caller_id, username=caller_id) for caller_id in missing],
+                ignore_conflicts=True,
+            )
+            notify_users_changed()
+            users.update(User.objects.filter(phone_number__in=missing).values_list('phone_number', 'id'))
+            # ignore_conflicts also skips a caller whose username is taken by a user with another phone number
+            unresolved = missing - users.keys() - self.unresolved_callers
+            if unresolved:
+                self.unresolved_callers |= unresolved
+                logger.warning("No user for callers %s: username taken by another user; their calls are stored without one",
+                               ', '.join(sorted(unresolved)))
+        return users
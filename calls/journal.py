@@ -0,0 +1,79 @@
+"""
+Durable ingest journal for watch_calls.
+
+Recordings are appended to IngestJournalEntry as the settle stage first sees
+them and marked done in the same transaction that writes their calls, so
+whatever was in flight when the watcher stopped is replayed on restart.
+IngestCheckpoint records, per partition of caller folders (calls.sharding, or
+ALL for a single watcher), a time before which every recording is either
+journaled or written: a restart only rescans caller folders and recordings
+modified after it, instead of the whole archive.
+"""
+import datetime
+import os
+from django.utils import timezone
+from .models import IngestCheckpoint, IngestJournalEntry
+
+ALL = 'all'
+# Margin for inotify and the observer's queue between a write and its event reaching the journal
+CHECKPOINT_SLACK = datetime.timedelta(seconds=5)
+# Done entries are kept this long behind the checkpoint, for inspection
+DONE_RETENTION = datetime.timedelta(days=1)
+PRUNE_INTERVAL = datetime.timedelta(hours=1)
+
+
+def partition_checkpoint(partition, partitions):
+    # Changing --partitions starts from fresh checkpoints (and a full scan)
+    return f'partition:{partition}/{partitions}'
+
+
+class IngestJournal:
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self.pruned_at = None
+
+    def key(self, wav_path):
+        return os.path.relpath(wav_path, self.base_dir)
+
+    def append(self, wav_paths):
+        now = timezone.now()
+        entries = []
+        for wav_path in wav_paths:
+            path = self.key(wav_path)
+            entries.append(IngestJournalEntry(
+                path=path, caller_id=path.split(os.sep, 1)[0], observed_at=now, done_at=None))
+        # Seen again: pending again, even if an earlier version was already written
+        IngestJournalEntry.objects.bulk_create(
+            entries, update_conflicts=True, unique_fields=['path'], update_fields=['observed_at', 'done_at'])
+
+    def complete(self, wav_paths, observed_before):
+        # Entries observed again after the batch was collected stay pending
+        IngestJournalEntry.objects.filter(
+            path__in=[self.key(wav_path) for wav_path in wav_paths],
+            observed_at__lte=observed_before,
+            done_at__isnull=True,
+        ).update(done_at=timezone.now())
+
+    def pending(self, caller_ids=None):
+        entries = IngestJournalEntry.objects.filter(done_at__isnull=True)
+        if caller_ids is not None:
+            entries = entries.filter(caller_id__in=caller_ids)
+        return [os.path.join(self.base_dir, path) for path in entries.values_list('path', flat=True)]
+
+    def checkpoint(self, names):
+        # The oldest of these checkpoints, or None (scan everything) if any is missing
+        positions = dict(IngestCheckpoint.objects.filter(name__in=names).values_list('name', 'position'))
+        if not names or len(positions) < len(set(names)):
+            return None
+        return min(positions.values())
+
+    def advance(self, names, position):
+        if not names:
+            return
+        IngestCheckpoint.objects.bulk_create(
+            [IngestCheckpoint(name=name, position=position) for name in names],
+            update_conflicts=True, unique_fields=['name'], update_fields=['position'],
+        )
+        if self.pruned_at is None or position - self.pruned_at >= PRUNE_INTERVAL:
+            IngestJournalEntry.objects.filter(done_at__lt=position - DONE_RETENTION).delete()
+            self.pruned_at = position
@@ -0,0 +1,112 @@
+"""
+Live dashboard updates.
+
+watch_calls NOTIFYs CALLS_CHANNEL in the transaction that writes a batch, so
+events go out on commit. Each web process holds one LISTEN connection
+(CallEvents, started with the first subscriber) and fans the events out to the
+Server-Sent Events streams of the calls' users (calls.views.CallEventsView).
+"""
+import asyncio
+import json
+from collections import defaultdict
+from asgiref.sync import sync_to_async
+from django.db import connection
+
+CALLS_CHANNEL = 'pbx_calls'
+# NOTIFY payloads are limited to 8000 bytes
+NOTIFY_CHUNK = 500
+# Events buffered per browser; a stream that falls further behind drops events
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+def notify_calls(calls):
+    # One notification per user (and NOTIFY_CHUNK ids) with the ids of their new or updated calls
+    by_user = defaultdict(list)
+    for call in calls:
+        if call.user_id is not None:
+            by_user[call.user_id].append(call.pk)
+    payloads = [
+        json.dumps({'user': user_id, 'ids': ids[i:i + NOTIFY_CHUNK]})
+        for user_id, ids in by_user.items() for i in range(0, len(ids), NOTIFY_CHUNK)
+    ]
+    if payloads:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload', [CALLS_CHANNEL, payloads])
+
+
+class CallEvents:
+    """
+    Per-process LISTEN on CALLS_CHANNEL, read on the event loop (add_reader on a
+    dedicated psycopg2 connection), so any number of streams share one
+    connection and no thread. Stops listening when the last stream goes away.
+    """
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+        self.task = None
+
+    def subscribe(self, user_id):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.subscribers[user_id].add(queue)
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self._listen())
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        queues = self.subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[user_id]
+
+    def dispatch(self, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        for queue in self.subscribers.get(event.get('user'), ()):
+            try:
+                queue.put_nowait(event['ids'])
+            except asyncio.QueueFull:
+                pass
+
+    @staticmethod
+    def _connect():
+        conn = connection.get_new_connection(connection.get_connection_params())
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN {CALLS_CHANNEL}')
+        return conn
+
+    async def _listen(self):
+        loop = asyncio.get_running_loop()
+        backoff = 1
+        while self.subscribers:
+            conn = None
+            try:
+                conn = await sync_to_async(self._connect, thread_sensitive=False)()
+                backoff = 1
+                readable = asyncio.Event()
+                loop.add_reader(conn.fileno(), readable.set)
+                try:
+                    while self.subscribers:
+                        try:
+                            # Wake up now and then to notice that everyone has left
+                            await asyncio.wait_for(readable.wait(), timeout=5)
+                        except asyncio.TimeoutError:
+                            continue
+                        readable.clear()
+                        conn.poll()
+                        while conn.notifies:
+                            self.dispatch(conn.notifies.pop(0).payload)
+                finally:
+                    loop.remove_reader(conn.fileno())
+            except Exception:
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+call_events = CallEvents()
@@ -0,0 +1,100 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Value
+from django.db.models.functions import Concat
+from django.utils import timezone
+from calls.coldstore import ARCHIVE_SUFFIX, BLOCK_SIZE, CODECS, archive_crc, write_archive
+from calls.models import Call
+
+
+def archive_recording(src, dst, codec, block_size):
+    # Runs in a worker process; the archive is read back and checked before the source may go
+    size, archived_size, crc = write_archive(src, dst, codec=codec, block_size=block_size)
+    matches = False
+    try:
+        matches = archive_crc(dst) == crc
+    finally:
+        # Also when the archive is too damaged to read back
+        if not matches:
+            os.remove(dst)
+    if not matches:
+        raise ValueError(f"{dst} does not match {src}")
+    return size, archived_size
+
+
+class Command(BaseCommand):
+    help = 'Moves recordings older than COLD_AFTER_DAYS to the cold tier: block-compressed archives under COLD_RECORDINGS_ROOT that stay playable'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', type=str, default=None, help='Path to call sessions (default: RECORDINGS_ROOT)')
+        parser.add_argument('--days', type=int, default=settings.COLD_AFTER_DAYS, help='Archive calls older than this many days')
+        parser.add_argument('--codec', choices=sorted(CODECS), default=settings.COLD_CODEC, help='Block compression')
+        parser.add_argument('--block-size', type=int, default=BLOCK_SIZE, help='Bytes per independently compressed block')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Parallel compression processes')
+        parser.add_argument('--batch-size', type=int, default=100, help='Recordings archived per database update')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be archived')
+
+    def handle(self, *args, **options):
+        base_dir = options['path'] or settings.RECORDINGS_ROOT
+        cold_dir = settings.COLD_RECORDINGS_ROOT
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        calls = Call.objects.filter(storage_tier='hot', missing_at=None, created_at__lt=cutoff).order_by('id').only(
+            'id', 'wav_filename')
+        batch_size = options['batch_size']
+
+        archived = failed = 0
+        total_size = total_archived = 0
+        last_id = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            while True:
+                # Keyset over the primary key, as backfill_call_metadata
+                batch = list(calls.filter(id__gt=last_id)[:batch_size])
+                if not batch:
+                    break
+                last_id = batch[-1].id
+                sources = {call.id: os.path.join(base_dir, call.wav_filename) for call in batch}
+                batch = [call for call in batch if os.path.isfile(sources[call.id])]
+                if options['dry_run']:
+                    archived += len(batch)
+                    total_size += sum(os.path.getsize(sources[call.id]) for call in batch)
+                    continue
+
+                futures = {
+                    call.id: executor.submit(
+                        archive_recording, sources[call.id], os.path.join(cold_dir, call.wav_filename + ARCHIVE_SUFFIX),
+                        options['codec'], options['block_size'])
+                    for call in batch
+                }
+                done = []
+                for call_id, future in futures.items():
+                    try:
+                        size, archived_size = future.result()
+                    except Exception as e:
+                        failed += 1
+                        self.stdout.write(self.style.ERROR(f"Error archiving {sources[call_id]}: {e}"))
+                        continue
+                    done.append(call_id)
+                    total_size += size
+                    total_archived += archived_size
+
+                with transaction.atomic():
+                    Call.objects.filter(pk__in=done).update(
+                        storage_tier='cold', archive_filename=Concat('wav_filename', Value(ARCHIVE_SUFFIX)))
+                # Only once the rows point at the archives
+                for call_id in done:
+                    os.remove(sources[call_id])
+                archived += len(done)
+                self.stdout.write(f"Archived {archived} recordings...")
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f"Would archive {archived} recordings ({total_size / 2 ** 20:.1f} MiB) older than {options['days']} days."))
+            return
+        ratio = total_size / total_archived if total_archived else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {archived} recordings: {total_size / 2 ** 20:.1f} MiB -> {total_archived / 2 ** 20:.1f} MiB "
+            f"({ratio:.1f}x). Failed: {failed}"))
@@ -0,0 +1,71 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from calls.coldstore import archive_path, open_recording
+from calls.models import Call
+from calls.wav import WAV_FIELDS, wav_metadata
+
+
+def read_metadata(base_dir, call):
+    # Header reads only: a few hundred bytes per recording (one block of an archive)
+    if call.storage_tier == 'cold':
+        values = wav_metadata(archive_path(call), open_file=open_recording)
+    else:
+        values = wav_metadata(os.path.join(base_dir, call.wav_filename))
+    values['conversation_duration'] = None
+    if call.full_conversation_filename:
+        values['conversation_duration'] = wav_metadata(
+            os.path.join(base_dir, call.full_conversation_filename))['duration']
+    return values
+
+
+class Command(BaseCommand):
+    help = 'Fills duration, sample rate, channels and codec of existing calls from their WAV headers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', type=str, default=None, help='Path to call sessions (default: RECORDINGS_ROOT)')
+        parser.add_argument('--all', action='store_true', help='Re-read every call, not only those without a duration')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Calls read and updated per batch')
+        parser.add_argument('--workers', type=int, default=8, help='Parallel header reads')
+
+    def handle(self, *args, **options):
+        base_dir = options['path'] or settings.RECORDINGS_ROOT
+        if not os.path.exists(base_dir):
+            self.stdout.write(self.style.ERROR(f"Directory {base_dir} does not exist."))
+            return
+
+        calls = Call.objects.all()
+        if not options['all']:
+            calls = calls.filter(duration=None)
+        fields = [*WAV_FIELDS, 'conversation_duration']
+        # The stored conversation_duration is written back when the conversation can't be read
+        calls = calls.order_by('id').only(
+            'id', 'wav_filename', 'full_conversation_filename', 'storage_tier', 'archive_filename', *fields)
+        batch_size = options['batch_size']
+
+        updated = missing = 0
+        last_id = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            while True:
+                # Keyset over the primary key; rows whose files can't be read keep what they have and are passed over
+                batch = list(calls.filter(id__gt=last_id)[:batch_size])
+                if not batch:
+                    break
+                last_id = batch[-1].id
+                results = executor.map(read_metadata, [base_dir] * len(batch), batch)
+                read = []
+                for call, values in zip(batch, results):
+                    if all(values[field] is None for field in WAV_FIELDS):
+                        missing += 1
+                        continue
+                    for field in fields:
+                        if field in WAV_FIELDS or values[field] is not None:
+                            setattr(call, field, values[field])
+                    read.append(call)
+                Call.objects.bulk_update(read, fields)
+                updated += len(read)
+                self.stdout.write(f"Updated {updated} calls...")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Backfill complete. Updated: {updated}, Unreadable or missing: {missing}"))
@@ -0,0 +1,132 @@
+import json
+import os
+import shutil
+import tempfile
+from django import db
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from calls import benchmarks
+from calls.ingest import CallWriter
+from calls.models import Call, ScannedFile, User
+from calls.scanner import Scanner
+from calls.synthetic import generate_tree
+
+SUITES = ('sync', 'watch', 'dashboard', 'audio')
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks sync_calls, watch_calls, the dashboard and the audio endpoint on a synthetic '
+            'recording tree, against a throwaway test database (created and dropped like the test runner does)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', type=str, default=None,
+                            help='Existing sounds directory to benchmark (default: generate one in a temp dir)')
+        parser.add_argument('--callers', type=int, default=10, help='Caller folders to generate')
+        parser.add_argument('--calls', type=int, default=200, help='Calls per caller to generate')
+        parser.add_argument('--only', type=str, default=','.join(SUITES), help=f"Comma-separated subset of {', '.join(SUITES)}")
+        parser.add_argument('--workers', type=int, default=None, help='Sync scanner workers (default: CPU count)')
+        parser.add_argument('--processes', action='store_true', help='Sync with a process pool instead of threads')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Calls written per bulk upsert')
+        parser.add_argument('--burst', type=int, default=200, help='Calls written at once for the watcher benchmark')
+        parser.add_argument('--settle-time', type=float, default=0.5, help='Watcher settle time (seconds)')
+        parser.add_argument('--depths', type=str, default='1,5,10', help='Dashboard page depths to report')
+        parser.add_argument('--requests', type=int, default=100, help='Requests per audio benchmark')
+        parser.add_argument('--concurrency', type=int, default=50, help='Concurrent streams for the async audio benchmark')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the test database between runs')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        suites = [suite.strip() for suite in options['only'].split(',') if suite.strip()]
+        unknown = set(suites) - set(SUITES)
+        if unknown:
+            raise CommandError(f"Unknown benchmark(s): {', '.join(sorted(unknown))}")
+        depths = sorted({int(depth) for depth in options['depths'].split(',') if depth.strip()})
+
+        root = options['path']
+        temp_dir = None
+        if root is None:
+            temp_dir = root = tempfile.mkdtemp(prefix='pbx_bench_')
+            self.log(f"Generating {options['callers']} x {options['calls']} calls in {root}...")
+            generate_tree(root, options['callers'], options['calls'])
+        base_dir = os.path.join(root, 'call_sessions')
+        if not os.path.isdir(base_dir):
+            raise CommandError(f"Directory {base_dir} does not exist.")
+
+        setup_test_environment()
+        connection = db.connections['default']
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False,
+                                                      keepdb=options['keepdb'])
+        results = {}
+        try:
+            if options['keepdb']:
+                Call.objects.all().delete()
+                ScannedFile.objects.all().delete()
+            if 'sync' in suites:
+                self.log("Benchmarking sync_calls...")
+                results['sync'] = benchmarks.bench_sync(
+                    base_dir, workers=options['workers'], processes=options['processes'],
+                    batch_size=options['batch_size'])
+            else:
+                # The other benchmarks need the calls in the database
+                Scanner(base_dir, workers=options['workers'], use_processes=options['processes'],
+                        link_conversation=True).run(CallWriter(batch_size=options['batch_size']))
+
+            if 'watch' in suites:
+                self.log("Benchmarking watch_calls ingest latency...")
+                results['watch'] = benchmarks.bench_watch(
+                    root, burst=options['burst'], settle_time=options['settle_time'])
+
+            user = User.objects.annotate(n=Count('calls')).order_by('-n').first()
+            if 'dashboard' in suites:
+                self.log(f"Benchmarking the dashboard of {user.phone_number}...")
+                results['dashboard'] = benchmarks.bench_dashboard(user, depths=depths)
+
+            if 'audio' in suites:
+                self.log("Benchmarking the audio endpoint...")
+                call = Call.objects.filter(user=user).select_related('user').order_by('-wav_size').first()
+                with override_settings(RECORDINGS_ROOT=base_dir, AUDIO_OFFLOAD=''):
+                    results['audio'] = benchmarks.bench_audio(
+                        call, requests=options['requests'], concurrency=options['concurrency'])
+        finally:
+            try:
+                db.connections.close_all()
+                connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            finally:
+                teardown_test_environment()
+                if temp_dir:
+                    shutil.rmtree(temp_dir, ignore_errors=True)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.report(results)
+
+    def log(self, message):
+        # Progress goes to stderr so --json output stays parseable
+        self.stderr.write(message)
+
+    def report(self, results):
+        write = self.stdout.write
+        if 'sync' in results:
+            for name, run in results['sync'].items():
+                write(f"sync {name:<20} {run['files']:>8} files  {run['seconds']:8.2f}s  {run['files_per_sec']:10.0f} files/s"
+                      f"  ({run['written']} written)")
+        if 'watch' in results:
+            watch = results['watch']
+            latency = '  '.join(f"{key} {value * 1000:.0f}ms" for key, value in watch['latency'].items())
+            write(f"watch burst of {watch['calls']}: {watch['ingested']} ingested, "
+                  f"{watch['calls_per_sec']:.0f} calls/s, latency {latency}")
+        if 'dashboard' in results:
+            dashboard = results['dashboard']
+            for page in dashboard['pages']:
+                write(f"dashboard page {page['page']:<5} {page['queries']:>3} queries  {page['ms']:8.1f}ms")
+            for name in ('search', 'reason'):
+                if name in dashboard:
+                    write(f"dashboard {name:<10} {dashboard[name]['queries']:>3} queries  {dashboard[name]['ms']:8.1f}ms")
+        if 'audio' in results:
+            audio = results['audio']
+            for name in ('sync_full', 'sync_range', 'async_full'):
+                run = audio[name]
+                write(f"audio {name:<12} {run['req_per_sec']:10.0f} req/s  {run['mb_per_sec']:10.1f} MB/s"
+                      f"  ({run['requests']} requests of a {audio['file_bytes']} byte file)")
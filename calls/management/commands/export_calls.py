@@ -0,0 +1,69 @@
+import os
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from calls.export import CHUNK_SIZE, export_queryset, iter_export_zip
+from calls.models import User
+from calls.stats import normalize_reason
+
+
+class Command(BaseCommand):
+    help = 'Writes a ZIP of the recordings and transcripts of the selected calls, streamed without temp files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=str, default=None, help='Phone number of the user whose calls to export')
+        parser.add_argument('--caller', type=str, default=None, help='Only calls from this caller id')
+        parser.add_argument('--from', dest='date_from', type=str, default=None, help='First day (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='date_to', type=str, default=None, help='Last day (YYYY-MM-DD), inclusive')
+        parser.add_argument('--reason', action='append', default=[], help='Transfer reason; repeat for any of several')
+        parser.add_argument('--output', type=str, default='-', help="ZIP file to write, or '-' for stdout")
+        parser.add_argument('--path', type=str, default=None, help='Path to call sessions (default: RECORDINGS_ROOT)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Bytes copied per read')
+
+    def handle(self, *args, **options):
+        if not options['user'] and not options['caller']:
+            raise CommandError("Pass --user and/or --caller.")
+
+        dates = {}
+        for key in ('date_from', 'date_to'):
+            value = options[key]
+            try:
+                dates[key] = parse_date(value) if value else None
+            except ValueError:
+                dates[key] = None
+            if value and dates[key] is None:
+                raise CommandError(f"Invalid date {value!r}, expected YYYY-MM-DD")
+
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(phone_number=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']} not found")
+
+        base_dir = options['path'] or settings.RECORDINGS_ROOT
+        if not os.path.exists(base_dir):
+            raise CommandError(f"Directory {base_dir} does not exist.")
+
+        calls = export_queryset(
+            user=user,
+            caller_id=options['caller'],
+            reasons=[normalize_reason(reason) for reason in options['reason'] if reason.strip()],
+            **dates,
+        )
+
+        to_stdout = options['output'] == '-'
+        out = sys.stdout.buffer if to_stdout else open(options['output'], 'wb')
+        written = 0
+        try:
+            for chunk in iter_export_zip(calls, base_dir, options['chunk_size']):
+                out.write(chunk)
+                written += len(chunk)
+        finally:
+            if not to_stdout:
+                out.close()
+
+        # Keep stdout clean for the archive itself
+        log = self.stderr if to_stdout else self.stdout
+        log.write(self.style.SUCCESS(f"Export complete. Wrote {written} bytes."))
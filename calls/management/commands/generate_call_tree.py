@@ -0,0 +1,44 @@
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from calls.synthetic import generate_tree
+
+
+class Command(BaseCommand):
+    help = 'Generates a synthetic Asterisk recording tree (call_sessions plus full_conversation dirs) for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=str, help='Sounds directory to create (call_sessions/ goes inside it)')
+        parser.add_argument('--callers', type=int, default=100, help='Number of caller folders')
+        parser.add_argument('--calls', type=int, default=50, help='Calls per caller')
+        parser.add_argument('--first-caller', type=int, default=10000, help='First caller id (phone number)')
+        parser.add_argument('--days', type=int, default=30, help='Spread call times over this many past days')
+        parser.add_argument('--sample-rate', type=int, default=8000, help='Recording sample rate (Hz)')
+        parser.add_argument('--min-duration', type=float, default=1.0, help='Shortest recording (seconds)')
+        parser.add_argument('--max-duration', type=float, default=10.0, help='Longest recording (seconds)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed')
+
+    def handle(self, *args, **options):
+        root = options['path']
+        if os.path.exists(os.path.join(root, 'call_sessions')):
+            raise CommandError(f"{root} already contains call_sessions/; pick an empty directory.")
+        total = options['callers'] * options['calls']
+
+        def progress(done):
+            if done % 10000 < options['calls']:
+                self.stdout.write(f"Wrote {done}/{total} calls...")
+
+        start = time.monotonic()
+        written = generate_tree(
+            root, options['callers'], options['calls'],
+            first_caller=options['first_caller'],
+            days=options['days'],
+            sample_rate=options['sample_rate'],
+            min_duration=options['min_duration'],
+            max_duration=options['max_duration'],
+            seed=options['seed'],
+            progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {written} calls for {options['callers']} callers in {root} "
+            f"({time.monotonic() - start:.1f}s)"))
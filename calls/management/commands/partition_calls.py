@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from calls.partitions import (
+    add_months, convert_table, create_partition, expire_default, expire_partition, is_partitioned,
+    list_partitions, month_start, partition_name, retention_cutoff,
+)
+
+
+class Command(BaseCommand):
+    help = 'Maintains the monthly partitions of the calls table: creates upcoming months and detaches or drops expired ones (run daily)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true', help='Convert the unpartitioned calls table first (locks it while the rows are copied)')
+        parser.add_argument('--premake', type=int, default=settings.CALL_PARTITION_PREMAKE, help='Months to create ahead of the current one')
+        parser.add_argument('--action', choices=['detach', 'drop'], default=settings.CALL_RETENTION_ACTION, help='What to do with expired months (CALL_RETENTION_MONTHS)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would change')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        if not is_partitioned():
+            if not options['convert']:
+                self.stdout.write(self.style.ERROR("The calls table is not partitioned; run with --convert first."))
+                return
+            if dry_run:
+                self.stdout.write("Would convert the calls table to monthly partitions.")
+                return
+            self.stdout.write("Converting the calls table to monthly partitions...")
+            convert_table(options['premake'])
+            self.stdout.write(self.style.SUCCESS("Converted."))
+
+        existing = {name for name, _ in list_partitions()}
+        current = month_start(timezone.now())
+        for months in range(options['premake'] + 1):
+            start = add_months(current, months)
+            name = partition_name(start)
+            if name in existing:
+                continue
+            if dry_run:
+                self.stdout.write(f"Would create {name}")
+                continue
+            moved = create_partition(start)
+            self.stdout.write(self.style.SUCCESS(f"Created {name}" + (f" ({moved} calls moved from the default partition)" if moved else "")))
+
+        cutoff = retention_cutoff()
+        if cutoff is None:
+            return
+        drop = options['action'] == 'drop'
+        for name, start in list_partitions():
+            if add_months(start, 1) > cutoff:
+                break
+            if dry_run:
+                self.stdout.write(f"Would {options['action']} {name}")
+                continue
+            expire_partition(name, start, drop=drop)
+            self.stdout.write(self.style.SUCCESS(f"{'Dropped' if drop else 'Detached'} {name}"))
+        if not dry_run:
+            deleted = expire_default(cutoff)
+            if deleted:
+                self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired calls from the default partition"))
@@ -0,0 +1,62 @@
+from collections import Counter
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+from calls.models import Call, CallDailyStats, CallReasonDailyStats
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per-user daily call statistics rollup from the Call table (backfill / repair)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=str, default=None, help='Only rebuild the stats of this phone number')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per bulk insert')
+
+    def handle(self, *args, **options):
+        calls = Call.objects.exclude(user=None)
+        daily_stats = CallDailyStats.objects.all()
+        reason_stats = CallReasonDailyStats.objects.all()
+        if options['user']:
+            calls = calls.filter(user__phone_number=options['user'])
+            daily_stats = daily_stats.filter(user__phone_number=options['user'])
+            reason_stats = reason_stats.filter(user__phone_number=options['user'])
+        batch_size = options['batch_size']
+
+        with transaction.atomic():
+            daily_stats.delete()
+            reason_stats.delete()
+
+            rows = (
+                calls.annotate(day=TruncDate('created_at'))
+                .values('user_id', 'day')
+                .annotate(
+                    n=Count('id'),
+                    bytes=Coalesce(Sum('wav_size'), 0),
+                    talk=Coalesce(Sum('talk_time'), 0.0),
+                )
+                .order_by()
+            )
+            created = CallDailyStats.objects.bulk_create(
+                (CallDailyStats(user_id=row['user_id'], day=row['day'], call_count=row['n'],
+                                wav_bytes=row['bytes'], talk_time=row['talk']) for row in rows.iterator()),
+                batch_size=batch_size,
+            )
+
+            # Stream the normalized reason arrays and count per (user, local day)
+            reasons = Counter()
+            for user_id, created_at, call_reasons in (
+                    calls.exclude(reasons=[])
+                    .values_list('user_id', 'created_at', 'reasons').iterator(chunk_size=5000)):
+                day = timezone.localdate(created_at)
+                for reason in call_reasons:
+                    reasons[(user_id, day, reason)] += 1
+            CallReasonDailyStats.objects.bulk_create(
+                (CallReasonDailyStats(user_id=user_id, day=day, reason=reason, call_count=count)
+                 for (user_id, day, reason), count in reasons.items()),
+                batch_size=batch_size,
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {len(created)} daily rows and {len(reasons)} reason rows."))
@@ -0,0 +1,40 @@
+import datetime
+import os
+from django.core.management.base import BaseCommand
+from calls.ingest import CallWriter
+from calls.reconcile import DELETE_GRACE, Reconciler
+
+
+class Command(BaseCommand):
+    help = 'Reconciles calls with the recordings on disk: marks (or deletes) calls whose recording is gone and ingests recordings the database never saw'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', type=str, default='/usr/local/share/asterisk/sounds/call_sessions', help='Path to call sessions')
+        parser.add_argument('--delete', action='store_true', help='Delete calls whose recording is gone instead of marking them missing')
+        parser.add_argument('--grace-minutes', type=int, default=int(DELETE_GRACE.total_seconds() // 60), help='With --delete, keep calls written within this many minutes')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would change')
+        parser.add_argument('--registered-only', action='store_true', help='Do not create users for unknown caller folders (as watch_calls)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows updated or written per query')
+
+    def handle(self, *args, **options):
+        base_dir = options['path']
+        if not os.path.exists(base_dir):
+            self.stdout.write(self.style.ERROR(f"Directory {base_dir} does not exist."))
+            return
+
+        self.stdout.write(f"Reconciling {base_dir}{' (dry run)' if options['dry_run'] else ''}...")
+        writer = CallWriter(create_users=not options['registered_only'], batch_size=options['batch_size'])
+        reconciler = Reconciler(
+            base_dir, writer,
+            delete=options['delete'],
+            delete_grace=datetime.timedelta(minutes=options['grace_minutes']),
+            dry_run=options['dry_run'],
+            batch_size=options['batch_size'],
+        )
+        reconciler.run()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Reconcile complete. Matched: {reconciler.count_matched}, "
+            f"{'Deleted' if options['delete'] else 'Missing'}: {reconciler.count_missing}, "
+            f"Restored: {reconciler.count_restored}, New: {reconciler.count_new} "
+            f"(written: {writer.count_created + writer.count_updated})"))
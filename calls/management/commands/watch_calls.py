@@ -1,126 +1,129 @@
+import datetime
 import os
 import time
-import datetime
+from collections import OrderedDict
+from django import db
 from django.core.management.base import BaseCommand
-from django.utils.timezone import make_aware
-from django.conf import settings
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
+from prometheus_client import start_http_server
 from calls.models import Call, User
+from calls.database import CONNECTION_ERRORS, MAX_BACKOFF, refresh
+from calls.ingest import CallWriter, link_missing_conversations
+from calls.journal import ALL, IngestJournal, partition_checkpoint
+from calls.metrics import INGEST_EVENTS
+from calls.pipeline import CONVERSATION_NAME, IngestPipeline
+from calls.registry import RegisteredUsers
+from calls.sharding import PartitionLeases, caller_partition
+from calls.scanner import Scanner
+
+# Calls this long before the checkpoint may still have been in progress, their conversation unfinished
+CONVERSATION_LOOKBACK = datetime.timedelta(hours=2)
+# Conversation folders watched at once (ConversationHandler); each is an inotify instance and a
+# thread in watchdog, so beyond this the oldest are left to the settle stage's polling
+MAX_CONVERSATION_WATCHES = 64
+
 
 class CallHandler(FileSystemEventHandler):
-    def __init__(self, stdout, style):
+    # Runs on watchdog's dispatch thread: only enqueue, never sleep or touch the DB
+    def __init__(self, stdout, style, pipeline, shard=None):
         self.stdout = stdout
         self.style = style
+        self.pipeline = pipeline
+        # PartitionLeases: other replicas own the callers outside our partitions
+        self.shard = shard
+
+    def owns(self, path):
+        return self.shard is None or self.shard.owns(os.path.basename(os.path.dirname(path)))
 
     def on_created(self, event):
-        if event.is_directory:
+        if event.is_directory or not self.owns(event.src_path):
             return
-        
+        INGEST_EVENTS.labels('created').inc()
+
         filename = os.path.basename(event.src_path)
         if filename.endswith('_full.wav'):
             self.stdout.write(f"Detected new call: {filename}")
-            self.process_file(event.src_path)
+        self.pipeline.submit(event.src_path)
+
+    def on_closed(self, event):
+        # IN_CLOSE_WRITE: the writer is done with the file
+        if not event.is_directory and self.owns(event.src_path):
+            INGEST_EVENTS.labels('closed').inc()
+            self.pipeline.submit(event.src_path, closed=True)
+
+    def on_moved(self, event):
+        # Recordings renamed into place are complete
+        if not event.is_directory and self.owns(event.dest_path):
+            INGEST_EVENTS.labels('moved').inc()
+            self.pipeline.submit(event.dest_path, closed=True)
+
 
-    def process_file(self, wav_path):
-        # Wait a brief moment to ensure file write is complete (optional but safer)
-        time.sleep(1)
+class ConversationHandler(FileSystemEventHandler):
+    """
+    Watches the sessions root (non-recursively) for new {caller_id}_{session_id}
+    folders, and each new folder until its full_conversation.wav is closed or
+    renamed into place, so the call is linked when its conversation ends however
+    long it lasts.
+    """
 
+    def __init__(self, pipeline, root, shard=None, observer=None):
+        self.pipeline = pipeline
+        self.root = root
+        self.shard = shard
+        self.observer = observer
+        self.watches = OrderedDict()
+
+    def submit(self, session_dir):
+        name = os.path.basename(session_dir)
+        if os.path.dirname(session_dir) != self.root or '_' not in name:
+            return
+        if self.shard is not None and not self.shard.owns(name.split('_', 1)[0]):
+            return
+        INGEST_EVENTS.labels('conversation').inc()
+        self.pipeline.submit_conversation(session_dir)
+        self.watch(session_dir)
+
+    def watch(self, session_dir):
+        if self.observer is None or session_dir in self.watches:
+            return
         try:
-            # Path structure: .../caller_id/filename.wav
-            dir_path = os.path.dirname(wav_path)
-            caller_id = os.path.basename(dir_path)
-            filename = os.path.basename(wav_path)
-
-            # Extract Session ID
-            # format: {caller_id}_{session_id}_full.wav
-            base_name = filename.replace('_full.wav', '')
-            
-            parts = base_name.split('_')
-            # Assuming format is always caller_id_sessionid...
-            # If caller_id can contain underscores, this might be tricky. 
-            # But based on user script: session_id=$(echo "$base_name" | cut -d'_' -f2)
-            # which implies caller_id is the first part.
-            session_id = parts[1] if len(parts) >= 2 else base_name
-
-            # Check if User exists
-            user = User.objects.filter(phone_number=caller_id).first()
-            if not user:
-                self.stdout.write(self.style.WARNING(f"Ignored file from {caller_id}: User not registered."))
-                return
-
-            relative_path = os.path.join(caller_id, filename)
-
-            # Normal _full.wav processing
-            txt_filename = filename.replace('_full.wav', '_full.txt')
-            txt_path = os.path.join(dir_path, txt_filename)
-
-            # Check for conversation file in sibling directory: ../{caller_session}/full_conversation.wav
-            # dir_path is likely .../call_sessions/{caller_id}
-            # We need .../sounds/{caller_session}/full_conversation.wav
-            # which is ../../{caller_session}/full_conversation.wav relative to dir_path
-            # OR ../{caller_session}/full_conversation.wav relative to root (call_sessions)
-            
-            # Construct the absolute path to check
-            # We assume dir_path is .../call_sessions/{caller_id}
-            # so dir_path/../../ is .../sounds/
-            sounds_root = os.path.abspath(os.path.join(dir_path, '../../')) 
-            conversation_dir = os.path.join(sounds_root, base_name) # base_name is {caller_id}_{session_id}
-            conversation_file_path = os.path.join(conversation_dir, 'full_conversation.wav')
-            
-            full_conv_relative = None
-            if os.path.exists(conversation_file_path):
-                # Store relative to call_sessions (which is the settings.RECORDINGS_ROOT)
-                # So path should be ../{base_name}/full_conversation.wav
-                full_conv_relative = os.path.join('..', base_name, 'full_conversation.wav')
-                self.stdout.write(f"Found conversation file at {full_conv_relative}")
-
-            # Metadata
-            wav_size = os.path.getsize(wav_path)
-            created_timestamp = os.path.getmtime(wav_path)
-            created_at = make_aware(datetime.datetime.fromtimestamp(created_timestamp))
-
-            txt_size = 0
-            transfer_reasons = ""
-            transfer_reason_descriptions = ""
-
-            if os.path.exists(txt_path):
-                txt_size = os.path.getsize(txt_path)
-                try:
-                    with open(txt_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read()
-                        for line in content.splitlines():
-                            if line.startswith('TRANSFER_REASONS:'):
-                                transfer_reasons = line.replace('TRANSFER_REASONS:', '').strip()
-                            if line.startswith('TRANSFER_REASON_DESCRIPTIONS:'):
-                                transfer_reason_descriptions = line.replace('TRANSFER_REASON_DESCRIPTIONS:', '').strip()
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f"Error reading txt file: {e}"))
-
-            # Prepare defaults
-            defaults = {
-                'user': user,
-                'caller_id': caller_id,
-                'wav_filename': relative_path,
-                'txt_filename': txt_filename,
-                'wav_size': wav_size,
-                'txt_size': txt_size,
-                'created_at': created_at,
-                'transfer_reasons': transfer_reasons,
-                'transfer_reason_descriptions': transfer_reason_descriptions,
-            }
-            # Only update full_conversation_filename if we found it, otherwise don't overwrite it (if it was set by the other event)
-            if full_conv_relative:
-                defaults['full_conversation_filename'] = full_conv_relative
-
-            Call.objects.update_or_create(
-                session_id=session_id,
-                defaults=defaults
-            )
-            self.stdout.write(self.style.SUCCESS(f"Processed match call {session_id}"))
+            self.watches[session_dir] = self.observer.schedule(self, session_dir, recursive=False)
+        except OSError:
+            # e.g. out of inotify instances: the settle stage still polls for the recording
+            return
+        while len(self.watches) > MAX_CONVERSATION_WATCHES:
+            self.unwatch(next(iter(self.watches)))
 
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f"Error processing file {wav_path}: {e}"))
+    def unwatch(self, session_dir):
+        watch = self.watches.pop(session_dir, None)
+        if watch is not None:
+            self.observer.unschedule(watch)
+
+    def recording(self, path):
+        # The conversation is complete: link it now and stop watching its folder
+        if os.path.basename(path) == CONVERSATION_NAME and os.path.dirname(path) in self.watches:
+            INGEST_EVENTS.labels('conversation').inc()
+            self.pipeline.submit(path, closed=True)
+            self.unwatch(os.path.dirname(path))
+
+    def on_created(self, event):
+        if event.is_directory:
+            self.submit(event.src_path)
+
+    def on_moved(self, event):
+        if event.is_directory:
+            self.submit(event.dest_path)
+        else:
+            self.recording(event.dest_path)
+
+    def on_closed(self, event):
+        if not event.is_directory:
+            self.recording(event.src_path)
+
+    def on_deleted(self, event):
+        if event.is_directory:
+            self.unwatch(event.src_path)
 
 
 class Command(BaseCommand):
@@ -128,43 +131,160 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('--path', type=str, default='/usr/local/share/asterisk/sounds/call_sessions', help='Path to watch')
+        parser.add_argument('--workers', type=int, default=None, help='Parallel directory scanners for the initial scan and audio analysis processes (default: CPU count)')
+        parser.add_argument('--processes', action='store_true', help='Run the initial scan with a process pool instead of threads')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Calls written per bulk upsert')
+        parser.add_argument('--metrics-port', type=int, default=9108, help='Port for Prometheus metrics (0 disables)')
+        parser.add_argument('--settle-time', type=float, default=0.5, help='Seconds a recording must stay unchanged before ingest when no close event arrives')
+        parser.add_argument('--partitions', type=int, default=0, help='Hash partitions of caller folders shared between watcher replicas through Postgres advisory locks (0: this process watches everything)')
+        parser.add_argument('--full-scan', action='store_true', help='Ignore the journal checkpoint and scan every registered folder on startup')
+        parser.add_argument('--rebalance-interval', type=float, default=5.0, help='Seconds between partition rebalances when --partitions is set')
 
     def handle(self, *args, **options):
         path = options['path']
+        if options['metrics_port']:
+            # Ingest counters, lag and queue depth for this process (calls.metrics)
+            start_http_server(options['metrics_port'])
+            self.stdout.write(f"Serving metrics on :{options['metrics_port']}/metrics")
         if not os.path.exists(path):
             self.stdout.write(self.style.WARNING(f"Path {path} does not exist. Waiting..."))
             
-        # Initial Scan (Optimized for performance)
-        self.stdout.write(f"Performing initial scan of {path} for registered users...")
-        handler = CallHandler(self.stdout, self.style)
-        
-        # Only scan folders of registered users
-        registered_numbers = User.objects.values_list('phone_number', flat=True)
-        
-        for phone_number in registered_numbers:
-            user_dir = os.path.join(path, phone_number)
-            if os.path.exists(user_dir):
-                # self.stdout.write(f"Scanning calls for {phone_number}...")
-                for root, dirs, files in os.walk(user_dir):
-                    for file in files:
-                        if file.endswith('_full.wav'):
-                            handler.process_file(os.path.join(root, file))
-            else:
-                # User might not have any calls folder yet
-                pass
-                
-        self.stdout.write(self.style.SUCCESS("Initial scan complete."))
+        # Registered phone numbers, kept in memory and refreshed on LISTEN/NOTIFY from user changes
+        users = RegisteredUsers()
+        users.start()
+
+        # Seen-but-unwritten recordings and per-partition checkpoints survive restarts
+        journal = IngestJournal(path)
+        shard = None
+        if options['partitions']:
+            # Partitions are scanned as they are claimed, from the loop below
+            shard = PartitionLeases(options['partitions'], interval=options['rebalance_interval'])
+            shard.start()
+
+        def checkpoints():
+            if shard is None:
+                return {ALL}
+            return {partition_checkpoint(partition, shard.partitions) for partition in shard.owned}
 
         self.stdout.write(f"Starting watchdog on {path}...")
-        
+
+        # Events are settled and written in batches off the observer thread
+        pipeline = IngestPipeline(
+            self.stdout, self.style,
+            settle_time=options['settle_time'],
+            batch_size=options['batch_size'],
+            analysis_workers=options['workers'],
+            users=users,
+            journal=journal,
+            checkpoints=checkpoints,
+        )
+        pipeline.start()
+        handler = CallHandler(self.stdout, self.style, pipeline, shard=shard)
+
         # We use the native Observer (Inotify on Linux) for efficient event sensing
         observer = Observer()
         observer.schedule(handler, path, recursive=True)
+        # Conversation recordings live next to call_sessions, one folder per call: watch for
+        # new folders there, and each new folder until its recording is complete
+        sessions_root = os.path.dirname(os.path.abspath(path))
+        observer.schedule(
+            ConversationHandler(pipeline, sessions_root, shard=shard, observer=observer), sessions_root, recursive=False)
         observer.start()
 
+        # Catch up with what happened while we were not watching; the observer is
+        # already running, so nothing written meanwhile is missed
+        initial_scan = shard is None
+        backoff = 1
+        retry_at = 0
         try:
             while True:
+                if time.monotonic() >= retry_at:
+                    # A catch-up that failed on the database is retried, backing off
+                    try:
+                        refresh()
+                        if initial_scan:
+                            self.stdout.write(f"Performing initial scan of {path} for registered users...")
+                            self.catch_up(path, [ALL], users.phone_numbers(), pipeline, journal, users, options)
+                            initial_scan = False
+                        if shard is not None:
+                            self.scan_acquired(path, shard, pipeline, journal, users, options)
+                        backoff = 1
+                    except CONNECTION_ERRORS as e:
+                        db.connection.close()
+                        self.stdout.write(self.style.ERROR(f"Database unavailable ({e}), retrying the scan in {backoff}s"))
+                        retry_at = time.monotonic() + backoff
+                        backoff = min(backoff * 2, MAX_BACKOFF)
                 time.sleep(1)
         except KeyboardInterrupt:
             observer.stop()
         observer.join()
+        pipeline.stop()
+        if shard is not None:
+            shard.stop()
+        users.stop()
+
+    def scan(self, path, caller_ids, users, options, since=None):
+        # Only scan folders of registered users, in parallel, writing in batches;
+        # calls already stored with the same size and mtime are not re-read
+        writer = CallWriter(create_users=False, batch_size=options['batch_size'], users=users)
+        scanner = Scanner(
+            path,
+            workers=options['workers'],
+            use_processes=options['processes'],
+            link_conversation=True,
+            skip_existing=True,
+            since=since,
+        )
+        if os.path.exists(path):
+            scanner.run(writer, caller_ids=caller_ids)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Scan complete. Created: {writer.count_created}, Updated: {writer.count_updated}, "
+            f"Unchanged: {scanner.count_skipped}"))
+
+    def catch_up(self, path, names, caller_ids, pipeline, journal, users, options, owns=None):
+        # Replay the journal, then scan what changed since the checkpoints `names`
+        replay = [
+            wav_path for wav_path in journal.pending()
+            if owns is None or owns(journal.key(wav_path).split(os.sep, 1)[0])
+        ]
+        for wav_path in replay:
+            pipeline.submit(wav_path)
+        since = None if options['full_scan'] else journal.checkpoint(names)
+        self.stdout.write(
+            f"Replaying {len(replay)} journaled recordings, scanning "
+            + (f"changes since {since:%Y-%m-%d %H:%M:%S}" if since else "everything"))
+        if since is not None:
+            # Users who registered meanwhile may have older recordings that were never ingested
+            joined = set(User.objects.filter(phone_number__in=caller_ids, date_joined__gte=since)
+                         .values_list('phone_number', flat=True))
+            if joined:
+                self.scan(path, sorted(joined), users, options)
+            caller_ids = [caller_id for caller_id in caller_ids if caller_id not in joined]
+        self.scan(path, caller_ids, users, options, since=since)
+        if since is not None:
+            # Conversations finished while we were away, for calls already stored before then
+            linked = link_missing_conversations(path, Call.objects.filter(
+                caller_id__in=caller_ids, created_at__gte=since - CONVERSATION_LOOKBACK))
+            self.stdout.write(f"Linked {linked} late conversation recordings")
+        pipeline.settle.mark_caught_up(names)
+
+    def scan_acquired(self, path, shard, pipeline, journal, users, options):
+        # Catch up on partitions taken over from a replica that left (or on startup)
+        acquired = shard.take_acquired()
+        if not acquired:
+            return
+        self.stdout.write(f"Claimed partitions {sorted(acquired)}, scanning...")
+        try:
+            caller_ids = [
+                caller_id for caller_id in users.phone_numbers()
+                if caller_partition(caller_id, shard.partitions) in acquired
+            ]
+            self.catch_up(
+                path, [partition_checkpoint(partition, shard.partitions) for partition in acquired],
+                caller_ids, pipeline, journal, users, options,
+                owns=lambda caller_id: caller_partition(caller_id, shard.partitions) in acquired,
+            )
+        except CONNECTION_ERRORS:
+            shard.retake(acquired)
+            raise
@@ -0,0 +1,65 @@
+"""
+Prometheus metrics for ingest and the web views.
+
+The web process exposes them on /metrics (calls.views.MetricsView); watch_calls
+serves its own with prometheus_client's HTTP server (--metrics-port). With
+several gunicorn workers, set PROMETHEUS_MULTIPROC_DIR so /metrics aggregates
+all of them. /metrics needs METRICS_TOKEN (or METRICS_PUBLIC=True) to answer.
+
+Alert on ingest falling behind with e.g.
+    histogram_quantile(0.95, rate(pbx_ingest_lag_seconds_bucket[5m])) > 30
+or  time() - pbx_ingest_last_write_timestamp_seconds > 300
+"""
+import os
+import time
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LAG_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 300, 900, 3600)
+
+INGEST_EVENTS = Counter(
+    'pbx_ingest_events_total', 'Filesystem events received by watch_calls', ['event'])
+INGEST_FILES = Counter(
+    'pbx_ingest_files_total', 'Recordings processed by ingest', ['result'])
+INGEST_ERRORS = Counter(
+    'pbx_ingest_errors_total', 'Ingest errors', ['stage'])
+INGEST_QUEUE_DEPTH = Gauge(
+    'pbx_ingest_queue_depth', 'Recordings waiting in a watch_calls pipeline stage', ['stage'],
+    multiprocess_mode='livesum')
+INGEST_UPSERT_SECONDS = Histogram(
+    'pbx_ingest_upsert_seconds', 'Time to write one batch of calls (CallWriter.flush)', buckets=LATENCY_BUCKETS)
+INGEST_BATCH_SIZE = Histogram(
+    'pbx_ingest_batch_calls', 'Calls per CallWriter batch', buckets=(1, 5, 10, 50, 100, 500, 1000, 5000))
+INGEST_LAG_SECONDS = Histogram(
+    'pbx_ingest_lag_seconds', 'Seconds from a recording\'s mtime to its Call row being committed (watch_calls)',
+    buckets=LAG_BUCKETS)
+INGEST_PARTITIONS = Gauge(
+    'pbx_ingest_partitions_owned', 'Caller directory partitions claimed by a watch_calls replica (--partitions)',
+    multiprocess_mode='livesum')
+INGEST_LAST_WRITE = Gauge(
+    'pbx_ingest_last_write_timestamp_seconds', 'Unix time of the last committed watch_calls batch',
+    multiprocess_mode='max')
+
+VIEW_SECONDS = Histogram(
+    'pbx_view_duration_seconds', 'Time until a view returned its response (streams: until headers)',
+    ['view', 'status'], buckets=LATENCY_BUCKETS)
+VIEW_BYTES = Counter(
+    'pbx_view_response_bytes_total', 'Response body bytes sent', ['view'])
+
+
+def record_ingest_lag(created_ats):
+    # created_at is the wav mtime (calls.ingest.build_call_record)
+    now = time.time()
+    for created_at in created_ats:
+        INGEST_LAG_SECONDS.observe(max(now - created_at.timestamp(), 0))
+    INGEST_LAST_WRITE.set(now)
+
+
+def render_metrics():
+    # One registry per process, or the aggregate of all workers in multiprocess mode
+    registry = REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
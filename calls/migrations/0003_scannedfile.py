@@ -0,0 +1,25 @@
+# Generated by Django 5.0.14 on 2026-10-17 03:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calls', '0002_call_full_conversation_filename'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScannedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255, unique=True)),
+                ('directory', models.CharField(db_index=True, max_length=255)),
+                ('inode', models.BigIntegerField()),
+                ('size', models.BigIntegerField()),
+                ('mtime_ns', models.BigIntegerField()),
+                ('scanned_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.14 on 2026-10-17 03:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calls', '0003_scannedfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='call',
+            name='peaks',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='call',
+            name='rms',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='call',
+            name='silence_ratio',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='call',
+            name='talk_time',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.14 on 2026-10-17 03:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calls', '0004_call_audio_metrics'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='call',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='call_user_created_idx'),
+        ),
+    ]
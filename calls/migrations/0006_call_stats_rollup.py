@@ -0,0 +1,60 @@
+# Generated by Django 5.0.14 on 2026-10-17 03:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Existing calls, so the rollup (DASHBOARD_TOTAL='rollup') starts in step with Call; the reason
+# rollup is filled by 0008 once the normalized reasons exist. Days are local dates, as in calls.stats
+BACKFILL_DAILY_STATS = """
+INSERT INTO calls_calldailystats (user_id, day, call_count, wav_bytes, talk_time)
+SELECT user_id, (created_at AT TIME ZONE %s)::date, count(*), coalesce(sum(wav_size), 0), coalesce(sum(talk_time), 0)
+FROM calls_call
+WHERE user_id IS NOT NULL
+GROUP BY 1, 2
+"""
+
+
+def backfill_daily_stats(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(BACKFILL_DAILY_STATS, [settings.TIME_ZONE])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calls', '0005_call_user_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CallDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('call_count', models.IntegerField(default=0)),
+                ('wav_bytes', models.BigIntegerField(default=0)),
+                ('talk_time', models.FloatField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CallReasonDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('reason', models.CharField(max_length=100)),
+                ('call_count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reason_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='calldailystats',
+            constraint=models.UniqueConstraint(fields=('user', 'day'), name='call_daily_stats_user_day'),
+        ),
+        migrations.AddConstraint(
+            model_name='callreasondailystats',
+            constraint=models.UniqueConstraint(fields=('user', 'day', 'reason'), name='call_reason_stats_user_day_reason'),
+        ),
+        migrations.RunPython(backfill_daily_stats, migrations.RunPython.noop),
+    ]
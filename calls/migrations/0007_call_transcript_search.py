@@ -0,0 +1,29 @@
+# Generated by Django 5.0.14 on 2026-10-17 03:51
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calls', '0006_call_stats_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='call',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='call',
+            name='transcript',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddIndex(
+            model_name='call',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='call_search_vector_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.0.14 on 2026-10-17 03:53
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.conf import settings
+from django.db import migrations, models
+
+# Same rules as calls.stats.split_transfer_reasons: split on commas, collapse
+# whitespace, lowercase, truncate to 100 characters, drop empties and duplicates
+BACKFILL_REASONS = r"""
+UPDATE calls_call SET reasons = ARRAY(
+    SELECT reason FROM (
+        SELECT left(lower(btrim(regexp_replace(part, '\s+', ' ', 'g'))), 100) AS reason, min(n) AS n
+        FROM unnest(string_to_array(transfer_reasons, ',')) WITH ORDINALITY AS t(part, n)
+        GROUP BY 1
+    ) s WHERE reason <> '' ORDER BY n
+)
+WHERE transfer_reasons IS NOT NULL AND transfer_reasons <> ''
+"""
+
+# Re-key the reason rollup on the normalized names (days are local dates, as in calls.stats)
+REBUILD_REASON_STATS = """
+DELETE FROM calls_callreasondailystats;
+INSERT INTO calls_callreasondailystats (user_id, day, reason, call_count)
+SELECT user_id, (created_at AT TIME ZONE %s)::date, reason, count(*)
+FROM calls_call, unnest(reasons) AS reason
+WHERE user_id IS NOT NULL
+GROUP BY 1, 2, 3
+"""
+
+
+def backfill_reasons(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(BACKFILL_REASONS)
+        cursor.execute(REBUILD_REASON_STATS, [settings.TIME_ZONE])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calls', '0007_call_transcript_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='call',
+            name='reasons',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=100), blank=True, default=list, size=None),
+        ),
+        migrations.RunPython(backfill_reasons, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='call',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['reasons'], name='call_reasons_idx'),
+        ),
+    ]
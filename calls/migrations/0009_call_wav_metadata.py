@@ -0,0 +1,42 @@
+# Generated by Django 5.0.14 on 2026-10-17 03:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calls', '0008_call_reasons'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='call',
+            name='channels',
+            field=models.SmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='call',
+            name='codec',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='call',
+            name='conversation_duration',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='call',
+            name='duration',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='call',
+            name='sample_rate',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='call',
+            index=models.Index(fields=['user', 'duration'], name='call_user_duration_idx'),
+        ),
+    ]
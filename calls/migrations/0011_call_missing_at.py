@@ -0,0 +1,23 @@
+# Generated by Django 5.0.14 on 2026-10-17 04:14
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calls', '0010_ingest_journal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='call',
+            name='missing_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='call',
+            index=models.Index(django.db.models.functions.comparison.Collate('wav_filename', 'C'), models.F('id'), name='call_wav_filename_c_idx'),
+        ),
+    ]
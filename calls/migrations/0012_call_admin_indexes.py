@@ -0,0 +1,29 @@
+# Generated by Django 5.0.14 on 2026-10-17 04:22
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.operations
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calls', '0011_call_missing_at'),
+    ]
+
+    operations = [
+        django.contrib.postgres.operations.TrigramExtension(),
+        migrations.AddIndex(
+            model_name='call',
+            index=models.Index(fields=['-created_at', '-id'], name='call_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='call',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('session_id'), name='gin_trgm_ops'), name='call_session_id_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='call',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('caller_id'), name='gin_trgm_ops'), name='call_caller_id_trgm_idx'),
+        ),
+    ]
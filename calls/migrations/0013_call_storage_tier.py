@@ -0,0 +1,23 @@
+# Generated by Django 5.0.14 on 2026-10-17 04:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calls', '0012_call_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='call',
+            name='archive_filename',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='call',
+            name='storage_tier',
+            field=models.CharField(choices=[('hot', 'Hot'), ('cold', 'Cold (compressed archive)')], default='hot', max_length=10),
+        ),
+    ]
@@ -1,5 +1,9 @@
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.functions import Collate, Upper
 
 class User(AbstractUser):
     phone_number = models.CharField(max_length=15, unique=True)
@@ -11,9 +15,13 @@ class User(AbstractUser):
     def __str__(self):
         return self.phone_number
 
+STORAGE_TIERS = [('hot', 'Hot'), ('cold', 'Cold (compressed archive)')]
+
 class Call(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='calls', null=True, blank=True)
     caller_id = models.CharField(max_length=20)
+    # Upsert target of CallWriter. A partitioned table can't hold this constraint: partition_calls
+    # --convert replaces it with UNIQUE (session_id, created_at) (calls.partitions.SESSION_CONSTRAINT)
     session_id = models.CharField(max_length=100, unique=True)
     wav_filename = models.CharField(max_length=255)
     full_conversation_filename = models.CharField(max_length=255, blank=True, null=True)
@@ -23,7 +31,120 @@ class Call(models.Model):
     created_at = models.DateTimeField()
     transfer_reasons = models.TextField(blank=True, null=True)
     transfer_reason_descriptions = models.TextField(blank=True, null=True)
+    # transfer_reasons split and normalized at ingest (calls.stats.split_transfer_reasons), for filtering
+    reasons = ArrayField(models.CharField(max_length=100), blank=True, default=list)
     last_updated_at = models.DateTimeField(auto_now=True)
+    # Set by reconcile_calls when the recording is no longer on disk; cleared when it reappears
+    missing_at = models.DateTimeField(blank=True, null=True)
+    # 'cold': archive_recordings moved the recording to archive_filename, relative to
+    # COLD_RECORDINGS_ROOT (a compressed calls.coldstore archive)
+    storage_tier = models.CharField(max_length=10, choices=STORAGE_TIERS, default='hot')
+    archive_filename = models.CharField(max_length=255, blank=True, default='')
+
+    # Computed at ingest by calls.analysis; peaks is the packed min/max waveform envelope
+    peaks = models.BinaryField(blank=True, null=True, editable=False)
+    rms = models.FloatField(blank=True, null=True)
+    silence_ratio = models.FloatField(blank=True, null=True)
+    talk_time = models.FloatField(blank=True, null=True)  # seconds
+
+    # Read from the WAV headers at ingest by calls.wav.wav_metadata (backfill: backfill_call_metadata)
+    duration = models.FloatField(blank=True, null=True)  # seconds
+    sample_rate = models.IntegerField(blank=True, null=True)
+    channels = models.SmallIntegerField(blank=True, null=True)
+    codec = models.CharField(max_length=20, blank=True, null=True)
+    conversation_duration = models.FloatField(blank=True, null=True)  # seconds, full_conversation_filename
+
+    # Transcript text and its tsvector, filled at ingest (see calls.search)
+    transcript = models.TextField(blank=True, default='')
+    search_vector = SearchVectorField(blank=True, null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Dashboard keyset pagination: WHERE user_id = ? ORDER BY created_at DESC, id DESC
+            models.Index(fields=['user', '-created_at', '-id'], name='call_user_created_idx'),
+            # Dashboard duration range filter
+            models.Index(fields=['user', 'duration'], name='call_user_duration_idx'),
+            GinIndex(fields=['search_vector'], name='call_search_vector_idx'),
+            # Reason filters: WHERE reasons @> ARRAY['billing']
+            GinIndex(fields=['reasons'], name='call_reasons_idx'),
+            # reconcile_calls walks calls in the filesystem's (byte) order: ORDER BY wav_filename COLLATE "C", id
+            models.Index(Collate('wav_filename', 'C'), 'id', name='call_wav_filename_c_idx'),
+            # Admin changelist order and month filter: ORDER BY created_at DESC, id DESC / created_at ranges
+            models.Index(fields=['-created_at', '-id'], name='call_created_idx'),
+            # Admin search: UPPER(session_id::text) LIKE UPPER('%...%') (pg_trgm)
+            GinIndex(OpClass(Upper('session_id'), name='gin_trgm_ops'), name='call_session_id_trgm_idx'),
+            GinIndex(OpClass(Upper('caller_id'), name='gin_trgm_ops'), name='call_caller_id_trgm_idx'),
+        ]
 
     def __str__(self):
         return f"{self.caller_id} - {self.session_id}"
+
+class ScannedFile(models.Model):
+    # Scan manifest used by `sync_calls --incremental` to skip recordings that did not change
+    path = models.CharField(max_length=255, unique=True)  # relative to the recordings root
+    directory = models.CharField(max_length=255, db_index=True)  # caller folder
+    inode = models.BigIntegerField()
+    size = models.BigIntegerField()
+    mtime_ns = models.BigIntegerField()
+    scanned_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.path
+
+
+class CallDailyStats(models.Model):
+    # Per-user, per-day rollup of Call, maintained incrementally at ingest (see calls.stats)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_stats')
+    day = models.DateField()
+    call_count = models.IntegerField(default=0)
+    wav_bytes = models.BigIntegerField(default=0)
+    talk_time = models.FloatField(default=0)  # seconds
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day'], name='call_daily_stats_user_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.day}"
+
+
+class CallReasonDailyStats(models.Model):
+    # Calls per transfer reason, per user and day
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reason_stats')
+    day = models.DateField()
+    reason = models.CharField(max_length=100)
+    call_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day', 'reason'], name='call_reason_stats_user_day_reason'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.day} {self.reason}"
+
+
+class IngestJournalEntry(models.Model):
+    # Recordings seen by watch_calls and not yet committed (done_at is null); replayed on restart (see calls.journal)
+    path = models.CharField(max_length=255, unique=True)  # {caller_id}/{...}_full.wav, relative to the watched folder
+    caller_id = models.CharField(max_length=20)
+    observed_at = models.DateTimeField()
+    done_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['caller_id'], condition=models.Q(done_at__isnull=True), name='journal_pending_idx'),
+        ]
+
+    def __str__(self):
+        return self.path
+
+
+class IngestCheckpoint(models.Model):
+    # Every recording last modified before `position` is in the journal or already written, per watcher partition
+    name = models.CharField(max_length=50, unique=True)
+    position = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} {self.position}"
@@ -0,0 +1,133 @@
+import base64
+import binascii
+import datetime
+import json
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+def encode_cursor(call):
+    raw = f'{call.created_at.isoformat()}|{call.pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    # Returns (created_at, id), or None for a missing or tampered cursor
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, pk = raw.rsplit('|', 1)
+        return datetime.datetime.fromisoformat(created_at), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def estimate_count(queryset):
+    """
+    Row estimate from the Postgres planner (EXPLAIN) instead of a COUNT(*) scan.
+    Falls back to an exact count on other databases.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def table_estimate(model, using='default'):
+    """
+    Row count of `model`'s table from pg_class.reltuples (kept by VACUUM / ANALYZE),
+    or None when Postgres has no statistics for it yet.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+        row = cursor.fetchone()
+    # -1 (or 0 on older servers) until the table is first analyzed
+    return int(row[0]) if row and row[0] > 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for large tables: the count comes from the table statistics
+    (unfiltered) or the planner's row estimate (filtered) instead of COUNT(*).
+    Small results, where an exact count is cheap, are still counted.
+    """
+    exact_below = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if queryset.query.where:
+            estimate = estimate_count(queryset)
+        else:
+            estimate = table_estimate(queryset.model, queryset.db)
+        if estimate is None or estimate < self.exact_below:
+            return queryset.count()
+        return estimate
+
+
+class KeysetPage:
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.object_list[-1]) if self.has_next and self.object_list else None
+
+    @property
+    def previous_cursor(self):
+        return encode_cursor(self.object_list[0]) if self.has_previous and self.object_list else None
+
+
+class KeysetPaginator:
+    """
+    Cursor pagination over (created_at, id), newest first.
+
+    Each page is an index range scan that starts at the cursor and stops after
+    per_page + 1 rows, so deep pages cost the same as the first one. Backed by
+    the (user, -created_at, -id) index on Call.
+    """
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset.order_by('-created_at', '-id')
+        self.per_page = per_page
+
+    def page(self, after=None, before=None):
+        after, before = decode_cursor(after), decode_cursor(before)
+        if before:
+            created_at, pk = before
+            # Walk backwards (oldest first) from the cursor, then restore newest-first order
+            rows = list(
+                self.queryset.filter(created_at__gte=created_at)
+                .exclude(created_at=created_at, id__lte=pk)
+                .order_by('created_at', 'id')[:self.per_page + 1]
+            )
+            has_previous = len(rows) > self.per_page
+            return KeysetPage(rows[:self.per_page][::-1], has_next=True, has_previous=has_previous)
+
+        queryset = self.queryset
+        if after:
+            created_at, pk = after
+            # created_at__lte bounds the index scan; the exclude breaks ties on id
+            queryset = queryset.filter(created_at__lte=created_at).exclude(created_at=created_at, id__gte=pk)
+        rows = list(queryset[:self.per_page + 1])
+        has_next = len(rows) > self.per_page
+        return KeysetPage(rows[:self.per_page], has_next=has_next, has_previous=bool(after))
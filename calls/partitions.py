@@ -0,0 +1,169 @@
+"""
+Optional monthly range partitioning of calls_call on created_at
+(`manage.py partition_calls`).
+
+Partitions are named {table}_pYYYY_MM and cover one month in the project time
+zone, so an expired partition holds exactly the calls of the CallDailyStats
+days it covers. A DEFAULT partition catches rows outside the created months
+(mtimes far in the past or future); creating a month moves its rows out of it.
+"""
+import datetime
+import re
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import Call, CallDailyStats, CallReasonDailyStats
+
+TABLE = Call._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+PARTITION_RE = re.compile(rf'^{TABLE}_p(\d{{4}})_(\d{{2}})$')
+# Replaces the unique session_id, since unique constraints must include the partition key
+SESSION_CONSTRAINT = 'call_session_created_uniq'
+
+
+def month_start(dt):
+    local = timezone.localtime(dt)
+    return timezone.make_aware(datetime.datetime(local.year, local.month, 1))
+
+
+def add_months(start, months):
+    year, month = divmod(start.year * 12 + start.month - 1 + months, 12)
+    return timezone.make_aware(datetime.datetime(year, month + 1, 1))
+
+
+def partition_name(start):
+    return f'{TABLE}_p{start.year:04d}_{start.month:02d}'
+
+
+def retention_cutoff(now=None):
+    # Calls created before this are expired (CALL_RETENTION_MONTHS whole months back), or None to keep all
+    months = settings.CALL_RETENTION_MONTHS
+    if not months:
+        return None
+    return add_months(month_start(now or timezone.now()), -months)
+
+
+def is_partitioned():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT relkind FROM pg_class WHERE oid = %s::regclass', [TABLE])
+        return cursor.fetchone()[0] == 'p'
+
+
+def list_partitions():
+    # [(name, month start)] of the monthly partitions, oldest first
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = %s::regclass', [TABLE])
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = []
+    for name in names:
+        match = PARTITION_RE.match(name)
+        if match:
+            start = timezone.make_aware(datetime.datetime(int(match.group(1)), int(match.group(2)), 1))
+            partitions.append((name, start))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def create_partition(start):
+    """
+    Attach the partition for the month starting at `start`, moving the rows the
+    DEFAULT partition already holds for it (ATTACH would refuse otherwise).
+    Returns the number of rows moved.
+    """
+    name, end = partition_name(start), add_months(start, 1)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s RETURNING *) '
+            f'INSERT INTO {name} SELECT * FROM moved', [start, end])
+        moved = cursor.rowcount
+        # Indexes and the foreign key are cloned from the parent on attach
+        cursor.execute(f'ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)', [start, end])
+    return moved
+
+
+def expire_partition(name, start, drop=False):
+    """
+    Detach (or drop) a month of calls, a catalog change rather than a DELETE,
+    and remove its days from the rollups. A detached table stays in place for
+    archiving (pg_dump -t); re-attaching it needs `rebuild_call_stats`.
+    """
+    end = add_months(start, 1)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {name}')
+        if drop:
+            cursor.execute(f'DROP TABLE {name}')
+        remove_stats(start.date(), end.date())
+
+
+def expire_default(cutoff):
+    # Stray expired rows in the DEFAULT partition; returns how many were deleted
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {DEFAULT_PARTITION} WHERE created_at < %s', [cutoff])
+        deleted = cursor.rowcount
+        remove_stats(None, timezone.localdate(cutoff))
+    return deleted
+
+
+def remove_stats(day_from, day_to):
+    for model in (CallDailyStats, CallReasonDailyStats):
+        rows = model.objects.filter(day__lt=day_to)
+        if day_from is not None:
+            rows = rows.filter(day__gte=day_from)
+        rows.delete()
+
+
+def convert_table(premake):
+    """
+    One-off conversion of an unpartitioned calls_call: the rows are copied into
+    a new partitioned table under an ACCESS EXCLUSIVE lock, so run it in a
+    maintenance window (watch_calls' journal replays what it missed). The
+    primary key becomes (id, created_at) and UNIQUE (session_id) becomes
+    SESSION_CONSTRAINT, as Postgres requires of unique constraints on a
+    partitioned table; ids keep coming from a sequence.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE')
+        # Constraints (but the primary key) and plain indexes, recreated on the new table
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype <> 'p'", [TABLE])
+        constraints = cursor.fetchall()
+        cursor.execute(
+            "SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i WHERE i.indrelid = %s::regclass "
+            "AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid AND c.contype IN ('p', 'u', 'x'))",
+            [TABLE])
+        indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute(f'SELECT min(created_at), max(id) FROM {TABLE}')
+        oldest, max_id = cursor.fetchone()
+
+        old = f'{TABLE}_unpartitioned'
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {old}')
+        # No INCLUDING IDENTITY: identity columns need Postgres 17 on partitioned tables
+        cursor.execute(
+            f'CREATE TABLE {TABLE} (LIKE {old} INCLUDING DEFAULTS INCLUDING STORAGE) PARTITION BY RANGE (created_at)')
+        cursor.execute(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT')
+        start = month_start(oldest or timezone.now())
+        last = add_months(month_start(timezone.now()), premake)
+        while start <= last:
+            end = add_months(start, 1)
+            cursor.execute(
+                f'CREATE TABLE {partition_name(start)} PARTITION OF {TABLE} FOR VALUES FROM (%s) TO (%s)', [start, end])
+            start = end
+        cursor.execute(f'INSERT INTO {TABLE} SELECT * FROM {old}')
+        # Frees the index and constraint names (and the identity sequence)
+        cursor.execute(f'DROP TABLE {old}')
+
+        cursor.execute(f'CREATE SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id')
+        cursor.execute(f"SELECT setval('{TABLE}_id_seq', %s, %s)", [max_id or 1, max_id is not None])
+        cursor.execute(f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{TABLE}_id_seq')")
+        cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id, created_at)')
+        for name, definition in constraints:
+            if definition == 'UNIQUE (session_id)':
+                continue
+            cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}')
+        if SESSION_CONSTRAINT not in {name for name, _ in constraints}:
+            cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {SESSION_CONSTRAINT} UNIQUE (session_id, created_at)')
+        for definition in indexes:
+            cursor.execute(definition)
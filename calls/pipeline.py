@@ -0,0 +1,450 @@
+import os
+import queue
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from django import db
+from django.db import transaction
+from django.utils import timezone
+from .analysis import ANALYSIS_FIELDS, analyze_recording
+from .database import MAX_BACKOFF, connection_lost, refresh, wait_for_database
+from .ingest import CallWriter, build_call_record, link_conversation, stat_or_none
+from .journal import CHECKPOINT_SLACK
+from .metrics import INGEST_ERRORS, INGEST_FILES, INGEST_QUEUE_DEPTH, record_ingest_lag
+from .partitions import retention_cutoff
+
+
+CONVERSATION_NAME = 'full_conversation.wav'
+# Conversation recordings grow for the whole call; without a close event (e.g. the
+# folder could not be watched) they must be idle for longer before linking
+CONVERSATION_SETTLE = 5.0
+# How long a new conversation folder is polled for its recording; a later close or
+# rename of the recording (watch_calls.ConversationHandler) brings it back
+CONVERSATION_WAIT = 60.0
+
+
+def is_conversation(path):
+    return os.path.basename(path) == CONVERSATION_NAME
+
+
+def recording_key(path):
+    # Events for the wav and its transcript coalesce onto the wav path (one per session)
+    if path.endswith('_full.txt'):
+        return path[:-len('_full.txt')] + '_full.wav'
+    if path.endswith('_full.wav'):
+        return path
+    return None
+
+
+def recording_signature(wav_path):
+    # Size and mtime of the wav and its transcript; stable across ticks means writing stopped
+    signature = []
+    for path in (wav_path, wav_path.replace('_full.wav', '_full.txt')):
+        st = stat_or_none(path)
+        signature.append((st.st_size, st.st_mtime_ns) if st is not None else None)
+    return tuple(signature)
+
+
+class PendingRecording:
+    __slots__ = ('signature', 'stable_since', 'closed')
+
+    def __init__(self):
+        self.signature = None
+        self.stable_since = None
+        self.closed = False
+
+
+class SettleStage(threading.Thread):
+    """
+    Tracks recordings that are still being written and releases each session to
+    the writer once complete: immediately on IN_CLOSE_WRITE of (or a rename onto) the
+    wav, otherwise after the size and mtime of the wav and its transcript have been
+    stable for `settle_time` seconds.
+
+    With a `journal` (calls.journal.IngestJournal), newly seen sessions are
+    journaled before they are released, and every `checkpoint_interval` seconds
+    the checkpoints named by `checkpoints()` that have been caught up are moved
+    to the start of the cycle (less CHECKPOINT_SLACK). While the journal can't be
+    written, recordings are still released and it is retried with backoff.
+
+    Conversation recordings (`{caller_id}_{session_id}/full_conversation.wav`,
+    submitted when their folder appears) are the pending-match index for late
+    linking: each is released to the writer, which links it to its call if that
+    already exists, on its close event or once idle for CONVERSATION_SETTLE seconds.
+    """
+
+    def __init__(self, events, ready, settle_time=0.5, tick=0.1, journal=None, checkpoints=None,
+                 checkpoint_interval=5.0):
+        super().__init__(name='settle', daemon=True)
+        self.events = events
+        self.ready = ready
+        self.settle_time = settle_time
+        self.tick = tick
+        self.pending = {}
+        self.conversations = {}
+        self.stopping = threading.Event()
+        self.journal = journal
+        self.checkpoints = checkpoints
+        self.checkpoint_interval = checkpoint_interval
+        self.next_checkpoint = 0
+        self.unjournaled = []
+        # Journaled sessions dropped without a wav (deleted, or never written), to mark done
+        self.vanished = []
+        # Checkpoints whose catch-up scan (watch_calls) has finished; only these may advance
+        self.caught_up = set()
+        self.caught_up_lock = threading.Lock()
+        self.journal_backoff = 0
+        self.journal_retry_at = 0
+
+    def mark_caught_up(self, names):
+        with self.caught_up_lock:
+            self.caught_up |= set(names)
+
+    def run(self):
+        try:
+            self._run()
+        finally:
+            db.connection.close()
+
+    def _run(self):
+        while not self.stopping.is_set():
+            cycle_start = timezone.now()
+            owned = self.checkpoints() if self.journal is not None else None
+            new = []
+            deadline = time.monotonic() + self.tick
+            while True:
+                try:
+                    path, closed = self.events.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if is_conversation(path):
+                    pending = self.conversations.setdefault(path, PendingRecording())
+                    pending.closed = pending.closed or closed
+                    continue
+                key = recording_key(path)
+                if key is None:
+                    continue
+                if key not in self.pending:
+                    self.pending[key] = PendingRecording()
+                    new.append(key)
+                if closed and path == key:
+                    # Only the wav's own close completes it; the transcript's is just activity,
+                    # which the signature polled in _release_settled already covers
+                    self.pending[key].closed = True
+            self.unjournaled.extend(new)
+            journal_due = self.journal is not None and time.monotonic() >= self.journal_retry_at
+            if journal_due:
+                self._journal(cycle_start, owned)
+            self._release_settled()
+            self._release_conversations()
+            if self.vanished and journal_due:
+                self._complete_vanished()
+
+    def _journal_failed(self):
+        INGEST_ERRORS.labels('journal').inc()
+        db.connection.close()
+        self.journal_backoff = min(self.journal_backoff * 2 or 1, MAX_BACKOFF)
+        self.journal_retry_at = time.monotonic() + self.journal_backoff
+
+    def _complete_vanished(self):
+        try:
+            self.journal.complete(self.vanished, timezone.now())
+            self.vanished = []
+        except Exception:
+            self._journal_failed()
+
+    def _journal(self, cycle_start, owned):
+        if not self.unjournaled and time.monotonic() < self.next_checkpoint:
+            return
+        refresh()
+        try:
+            if self.unjournaled:
+                self.journal.append(self.unjournaled)
+                self.unjournaled = []
+            if time.monotonic() >= self.next_checkpoint:
+                # Dropped from or taken over during this cycle: don't vouch for it
+                current = self.checkpoints()
+                with self.caught_up_lock:
+                    self.caught_up &= current
+                    names = owned & current & self.caught_up
+                self.journal.advance(names, cycle_start - CHECKPOINT_SLACK)
+                self.next_checkpoint = time.monotonic() + self.checkpoint_interval
+            self.journal_backoff = 0
+        except Exception:
+            # Recordings are still released; the checkpoint waits until the journal catches up
+            self._journal_failed()
+
+    def _release_settled(self):
+        now = time.monotonic()
+        for wav_path, pending in list(self.pending.items()):
+            signature = recording_signature(wav_path)
+            if signature[0] is None:
+                # No wav (yet); a transcript on its own is not a call. The wav's own
+                # events will bring the session back.
+                if pending.closed or (pending.stable_since and now - pending.stable_since >= self.settle_time):
+                    del self.pending[wav_path]
+                    if self.journal is not None:
+                        self.vanished.append(wav_path)
+                elif pending.stable_since is None:
+                    pending.stable_since = now
+                continue
+
+            if signature != pending.signature:
+                pending.signature = signature
+                pending.stable_since = now
+            if pending.closed or now - pending.stable_since >= self.settle_time:
+                del self.pending[wav_path]
+                self.ready.put(wav_path)
+
+    def _release_conversations(self):
+        now = time.monotonic()
+        for path, pending in list(self.conversations.items()):
+            st = stat_or_none(path)
+            if st is None:
+                if pending.stable_since is None:
+                    pending.stable_since = now
+                elif now - pending.stable_since >= CONVERSATION_WAIT:
+                    del self.conversations[path]
+                continue
+            signature = (st.st_size, st.st_mtime_ns)
+            if pending.closed:
+                del self.conversations[path]
+                self.ready.put(path)
+            elif signature != pending.signature:
+                pending.signature = signature
+                pending.stable_since = now
+            elif now - pending.stable_since >= max(CONVERSATION_SETTLE, self.settle_time):
+                del self.conversations[path]
+                self.ready.put(path)
+
+    def stop(self):
+        self.stopping.set()
+
+
+class WriterStage(threading.Thread):
+    """
+    Collects settled recordings into batches (up to `batch_size`, waiting at most
+    `flush_interval` seconds), analyses their audio in a process pool and writes
+    each batch with one CallWriter flush. With a `users` registry
+    (calls.registry.RegisteredUsers), recordings of unregistered callers are
+    dropped before they are parsed or analysed. With a `journal`, the batch's
+    entries are marked done in the transaction that writes it.
+
+    A batch that fails because the database went away is kept and written again
+    once a connection can be made (backing off meanwhile), rather than dropped;
+    only stopping gives it up, and then the journal replays it on restart. Other
+    failures are narrowed down to the records that cause them (_commit).
+    """
+
+    def __init__(self, ready, stdout, style, batch_size=100, flush_interval=0.1, analysis_workers=None,
+                 users=None, journal=None):
+        super().__init__(name='writer', daemon=True)
+        self.ready = ready
+        self.stdout = stdout
+        self.style = style
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.analysis_workers = analysis_workers
+        self.users = users
+        self.journal = journal
+        self.stopping = threading.Event()
+
+    def run(self):
+        # Spawned (not forked) so workers don't inherit this process's DB connections
+        self.analysis_pool = ProcessPoolExecutor(
+            max_workers=self.analysis_workers, mp_context=multiprocessing.get_context('spawn'))
+        try:
+            while True:
+                batch = self._collect()
+                if batch:
+                    self._store(batch)
+                if None in batch:
+                    break
+        finally:
+            self.analysis_pool.shutdown()
+            db.connection.close()
+
+    def _collect(self):
+        batch = [self.ready.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while batch[-1] is not None and len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.ready.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _store(self, batch):
+        while True:
+            refresh()
+            try:
+                self._write(batch)
+                return
+            except Exception as e:
+                if not connection_lost(e):
+                    INGEST_ERRORS.labels('write').inc()
+                    self.stdout.write(self.style.ERROR(f"Error writing batch: {e}"))
+                    return
+                INGEST_ERRORS.labels('database').inc()
+                self.stdout.write(self.style.ERROR(f"Lost the database connection ({e}), retrying the batch once it is back"))
+            if not wait_for_database(self.stopping):
+                return
+
+    def _write(self, batch):
+        collected_at = timezone.now()
+        cutoff = retention_cutoff()
+        records = []
+        wav_paths = []
+        callers = {}
+        for wav_path in batch:
+            if wav_path is None:
+                continue
+            if is_conversation(wav_path):
+                self._link(wav_path)
+                continue
+            dir_path = os.path.dirname(wav_path)
+            caller_id = os.path.basename(dir_path)
+            filename = os.path.basename(wav_path)
+            if self.users is not None and caller_id not in self.users:
+                INGEST_FILES.labels('ignored').inc()
+                self.stdout.write(self.style.WARNING(f"Ignored file from {caller_id}: User not registered."))
+                continue
+            try:
+                wav_stat = os.stat(wav_path)
+                txt_stat = stat_or_none(wav_path.replace('_full.wav', '_full.txt'))
+                record = build_call_record(dir_path, filename, caller_id, wav_stat, txt_stat, link_conversation=True)
+            except Exception as e:
+                INGEST_ERRORS.labels('parse').inc()
+                self.stdout.write(self.style.ERROR(f"Error processing file {wav_path}: {e}"))
+                continue
+            if cutoff is not None and record['created_at'] < cutoff:
+                INGEST_FILES.labels('ignored').inc()
+                self.stdout.write(self.style.WARNING(f"Ignored file {wav_path}: older than the retention period."))
+                continue
+            callers[record['session_id']] = caller_id
+            records.append(record)
+            wav_paths.append(wav_path)
+
+        futures = [self.analysis_pool.submit(analyze_recording, wav_path) for wav_path in wav_paths]
+        for record, wav_path, future in zip(records, wav_paths, futures):
+            try:
+                record.update(future.result())
+            except Exception as e:
+                # Stored without metrics rather than failing the rest of the batch
+                INGEST_ERRORS.labels('analysis').inc()
+                self.stdout.write(self.style.ERROR(f"Error analysing {wav_path}: {e}"))
+                record.update(dict.fromkeys(ANALYSIS_FIELDS))
+
+        # Ignored and unparseable recordings are journaled too: replaying them would not change anything
+        recorded = set(wav_paths)
+        others = [wav_path for wav_path in batch
+                  if wav_path is not None and not is_conversation(wav_path) and wav_path not in recorded]
+        failed = []
+        calls = self._commit(records, wav_paths, others, collected_at, failed)
+        record_ingest_lag(call.created_at for call in calls)
+        written = {call.session_id for call in calls}
+        INGEST_FILES.labels('ignored').inc(len(callers) - len(written) - len(failed))
+
+        for session_id, caller_id in callers.items():
+            if session_id in failed:
+                continue
+            if session_id in written:
+                self.stdout.write(self.style.SUCCESS(f"Processed match call {session_id}"))
+            else:
+                self.stdout.write(self.style.WARNING(f"Ignored file from {caller_id}: User not registered."))
+
+
+    def _commit(self, records, wav_paths, others, collected_at, failed):
+        """
+        Write `records` and mark them (and `others`) done in the journal, in one
+        transaction; returns the calls written. A batch that fails for any reason
+        but a lost connection is split in halves and retried, down to the records
+        that fail on their own, so one bad record doesn't hold back (or, through
+        the journal, replay forever) the rest of its batch. Their session ids are
+        added to `failed`.
+        """
+        try:
+            with transaction.atomic():
+                calls = CallWriter(create_users=False, users=self.users).write(records)
+                if self.journal is not None:
+                    self.journal.complete(wav_paths + others, collected_at)
+            return calls
+        except Exception as e:
+            if connection_lost(e):
+                raise
+            if self.users is not None:
+                # e.g. a user deleted before its notification arrived
+                self.users.invalidate()
+            if len(records) > 1:
+                middle = len(records) // 2
+                return (self._commit(records[:middle], wav_paths[:middle], others, collected_at, failed)
+                        + self._commit(records[middle:], wav_paths[middle:], [], collected_at, failed))
+            INGEST_ERRORS.labels('write').inc()
+            self.stdout.write(self.style.ERROR(f"Error writing {', '.join(wav_paths) or 'batch'}: {e}"))
+            failed.extend(record['session_id'] for record in records)
+        if self.journal is not None:
+            # Given up rather than replayed on every restart; reconcile_calls ingests it once fixed
+            self.journal.complete(wav_paths + others, collected_at)
+        return []
+
+    def _link(self, conversation):
+        # The call's recording arrived first; otherwise ingesting it will link the conversation
+        try:
+            linked = link_conversation(conversation)
+        except Exception as e:
+            if connection_lost(e):
+                raise
+            INGEST_ERRORS.labels('link').inc()
+            self.stdout.write(self.style.ERROR(f"Error linking {conversation}: {e}"))
+            return
+        if linked:
+            INGEST_FILES.labels('linked').inc()
+            self.stdout.write(self.style.SUCCESS(
+                f"Linked conversation {os.path.basename(os.path.dirname(conversation))}"))
+
+
+class IngestPipeline:
+    """
+    Watchdog handler -> events queue -> SettleStage -> ready queue -> WriterStage.
+    submit() never blocks, so the observer's dispatch thread stays free.
+    """
+
+    def __init__(self, stdout, style, settle_time=0.5, batch_size=100, flush_interval=0.1, analysis_workers=None,
+                 users=None, journal=None, checkpoints=None):
+        self.events = queue.Queue()
+        self.ready = queue.Queue()
+        self.settle = SettleStage(
+            self.events, self.ready, settle_time=settle_time, journal=journal, checkpoints=checkpoints)
+        self.writer = WriterStage(
+            self.ready, stdout, style,
+            batch_size=batch_size, flush_interval=flush_interval, analysis_workers=analysis_workers,
+            users=users, journal=journal,
+        )
+        # Sampled at scrape time
+        INGEST_QUEUE_DEPTH.labels('events').set_function(self.events.qsize)
+        INGEST_QUEUE_DEPTH.labels('settling').set_function(lambda: len(self.settle.pending))
+        INGEST_QUEUE_DEPTH.labels('conversations').set_function(lambda: len(self.settle.conversations))
+        INGEST_QUEUE_DEPTH.labels('ready').set_function(self.ready.qsize)
+
+    def submit(self, path, closed=False):
+        self.events.put((path, closed))
+
+    def submit_conversation(self, session_dir):
+        # A {caller_id}_{session_id} folder appeared next to call_sessions
+        self.events.put((os.path.join(session_dir, CONVERSATION_NAME), False))
+
+    def start(self):
+        self.settle.start()
+        self.writer.start()
+
+    def stop(self):
+        self.settle.stop()
+        self.settle.join()
+        self.ready.put(None)
+        # Gives up waiting for the database; what is left is journaled
+        self.writer.stopping.set()
+        self.writer.join()
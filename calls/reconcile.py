@@ -0,0 +1,166 @@
+"""
+Reconcile Call rows against the recordings on disk (`manage.py reconcile_calls`).
+
+Both sides are streamed in the same order, byte order of wav_filename, and
+merge-joined: the filesystem one caller folder at a time, the calls table in
+keyset pages over call_wav_filename_c_idx. Memory is bounded by one folder
+listing and one page, whatever the size of the archive.
+"""
+import datetime
+import os
+from django.db.models import Q
+from django.db.models.functions import Collate
+from django.utils import timezone
+from .analysis import analyze_recording
+from .ingest import build_call_record, conversation_path, manifest_entries, parse_session_id, stat_or_none
+from .journal import IngestJournal
+from .models import Call, ScannedFile
+
+# --delete leaves rows written this recently: a recording being moved may not have reached its new row yet
+DELETE_GRACE = datetime.timedelta(hours=1)
+
+
+def iter_recordings(base_dir):
+    # wav_filename of every recording, sorted as Postgres sorts them under COLLATE "C"
+    with os.scandir(base_dir) as it:
+        # 'caller/' is the prefix compared in wav_filename, so '100-1/' sorts before '100/'
+        callers = sorted((entry.name for entry in it if entry.is_dir(follow_symlinks=False)),
+                         key=lambda name: name + os.sep)
+    for caller_id in callers:
+        try:
+            with os.scandir(os.path.join(base_dir, caller_id)) as it:
+                names = sorted(entry.name for entry in it
+                               if entry.name.endswith('_full.wav') and entry.is_file(follow_symlinks=False))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        for name in names:
+            yield os.path.join(caller_id, name)
+
+
+def iter_calls(page_size=2000):
+    # (wav_filename, id, missing_at, storage_tier) in the same order, one indexed page at a time
+    calls = Call.objects.alias(wav_key=Collate('wav_filename', 'C')).order_by('wav_key', 'id').values_list(
+        'wav_filename', 'id', 'missing_at', 'storage_tier')
+    last = None
+    while True:
+        rows = []
+        if last is not None:
+            # Rest of a run of rows sharing one wav_filename, then the next filenames
+            rows = list(calls.filter(wav_key=last[0], id__gt=last[1])[:page_size])
+        if not rows:
+            rows = list((calls.filter(wav_key__gt=last[0]) if last is not None else calls)[:page_size])
+        if not rows:
+            return
+        yield from rows
+        last = rows[-1][:2]
+
+
+class Reconciler:
+    """
+    Calls whose recording is gone are marked missing (or deleted with
+    `delete=True`), calls marked missing whose recording is back are cleared,
+    and recordings without a call are ingested through `writer`. A recording
+    moved to another folder is both, and since the upsert on session_id points
+    its row at the new path, the orphan update skips rows written during the run.
+    Deleting also skips rows written within `delete_grace` and sessions that
+    watch_calls has journalled but not yet written, whose row still has the old path.
+    """
+
+    def __init__(self, base_dir, writer, delete=False, dry_run=False, batch_size=1000, delete_grace=DELETE_GRACE):
+        self.base_dir = base_dir
+        self.writer = writer
+        self.delete = delete
+        self.dry_run = dry_run
+        self.batch_size = batch_size
+        self.delete_grace = delete_grace
+        self.orphans = []
+        self.restored = []
+        self.count_matched = 0
+        self.count_missing = 0
+        self.count_restored = 0
+        self.count_new = 0
+        self.started_at = None
+
+    def run(self):
+        self.started_at = timezone.now()
+        files = iter_recordings(self.base_dir)
+        calls = iter_calls()
+        path = next(files, None)
+        call = next(calls, None)
+        while path is not None or call is not None:
+            if call is None or (path is not None and path < call[0]):
+                self.count_new += 1
+                if not self.dry_run:
+                    self._ingest(path)
+                path = next(files, None)
+            elif path is None or call[0] < path:
+                self._orphan(call)
+                call = next(calls, None)
+            else:
+                self.count_matched += 1
+                if call[2] is not None:
+                    self._restore(call)
+                call = next(calls, None)
+                # Several rows may share a recording
+                if call is None or call[0] != path:
+                    path = next(files, None)
+        if not self.dry_run:
+            self.writer.flush()
+        self._flush()
+
+    def _ingest(self, path):
+        caller_id, filename = os.path.split(path)
+        dir_path = os.path.join(self.base_dir, caller_id)
+        wav_stat = stat_or_none(os.path.join(dir_path, filename))
+        if wav_stat is None:
+            return
+        txt_stat = stat_or_none(os.path.join(dir_path, filename.replace('_full.wav', '_full.txt')))
+        conversation_stat = stat_or_none(conversation_path(dir_path, parse_session_id(filename)[0]))
+        record = build_call_record(dir_path, filename, caller_id, wav_stat, txt_stat, link_conversation=True)
+        record.update(analyze_recording(os.path.join(dir_path, filename)))
+        self.writer.add(record, manifest_entries(caller_id, filename, wav_stat, txt_stat, conversation_stat))
+
+    def _orphan(self, call):
+        # Archived recordings (archive_recordings) are expected to be gone from the recordings folder
+        if call[3] == 'cold':
+            return
+        # Already marked on an earlier run: nothing to do unless deleting
+        if call[2] is None or self.delete:
+            if self.dry_run:
+                self.count_missing += 1
+            self.orphans.append(call[:2])
+            if len(self.orphans) >= self.batch_size:
+                self._flush()
+
+    def _restore(self, call):
+        self.count_restored += 1
+        self.restored.append(call[1])
+        if len(self.restored) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        orphans, self.orphans = self.orphans, []
+        restored, self.restored = self.restored, []
+        if self.dry_run:
+            return
+        if orphans:
+            paths = [wav_filename for wav_filename, _ in orphans]
+            # Rows the writer upserted during this run (moved recordings) are on disk
+            gone = Call.objects.filter(
+                pk__in=[pk for _, pk in orphans], wav_filename__in=paths, last_updated_at__lt=self.started_at)
+            if self.delete:
+                gone = gone.filter(last_updated_at__lt=self.started_at - self.delete_grace).exclude(
+                    session_id__in=self._pending_sessions())
+                # Through the ORM so the post_delete handler in calls.signals keeps the rollups in step
+                self.count_missing += gone.delete()[1].get(Call._meta.label, 0)
+            else:
+                self.count_missing += gone.filter(missing_at__isnull=True).update(missing_at=timezone.now())
+            ScannedFile.objects.filter(
+                Q(path__in=paths) | Q(path__in=[path.replace('_full.wav', '_full.txt') for path in paths])
+            ).delete()
+        if restored:
+            Call.objects.filter(pk__in=restored).update(missing_at=None)
+
+    def _pending_sessions(self):
+        # Re-read on every flush: watch_calls may journal a move while the run is going
+        return {parse_session_id(os.path.basename(path))[1] for path in IngestJournal(self.base_dir).pending()}
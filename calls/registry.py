@@ -0,0 +1,104 @@
+import select
+import threading
+import time
+from django.db import connection
+from .models import User
+
+# NOTIFY channel raised (transactionally) whenever the set of users changes; see notify_users_changed()
+USERS_CHANNEL = 'pbx_users'
+
+
+def notify_users_changed():
+    # Delivered to listeners when the surrounding transaction commits, dropped on rollback
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_notify(%s, %s)', [USERS_CHANNEL, ''])
+
+
+class RegisteredUsers:
+    """
+    In-memory phone_number -> user id map of registered users for long-running
+    ingest processes (watch_calls).
+
+    Users are created and deleted by other processes (signup, admin, sync_calls),
+    so the map is invalidated through Postgres LISTEN/NOTIFY rather than local
+    signals: calls.signals and CallWriter raise USERS_CHANNEL and a listener
+    thread marks the map stale. It is reloaded (one query) on next use, and at
+    least every `refresh_interval` seconds in case a notification was missed
+    while the listener was reconnecting.
+    """
+
+    def __init__(self, refresh_interval=300):
+        self.refresh_interval = refresh_interval
+        self.users = {}
+        self.loaded_at = None
+        self.stale = True
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.listener = None
+
+    def _current(self):
+        with self.lock:
+            if self.stale or time.monotonic() - self.loaded_at >= self.refresh_interval:
+                # Clear first: a notification arriving during the query marks it stale again
+                self.stale = False
+                try:
+                    self.users = dict(User.objects.values_list('phone_number', 'id'))
+                except Exception:
+                    # e.g. the database is unreachable: reload on next use, not after refresh_interval
+                    self.stale = True
+                    raise
+                self.loaded_at = time.monotonic()
+            return self.users
+
+    def invalidate(self):
+        self.stale = True
+
+    def get(self, phone_number):
+        return self._current().get(phone_number)
+
+    def __contains__(self, phone_number):
+        return phone_number in self._current()
+
+    def resolve(self, phone_numbers):
+        # The subset of phone_numbers that are registered, as phone_number -> user id
+        users = self._current()
+        return {phone_number: users[phone_number] for phone_number in phone_numbers if phone_number in users}
+
+    def phone_numbers(self):
+        return list(self._current())
+
+    def start(self):
+        self.listener = threading.Thread(target=self._listen, name='users-listener', daemon=True)
+        self.listener.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.listener:
+            self.listener.join()
+
+    def _listen(self):
+        backoff = 1
+        while not self.stopping.is_set():
+            conn = None
+            try:
+                # A dedicated psycopg2 connection outside Django's per-thread handling, in autocommit
+                conn = connection.get_new_connection(connection.get_connection_params())
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN {USERS_CHANNEL}')
+                # Changes made while we were not listening
+                self.stale = True
+                backoff = 1
+                while not self.stopping.is_set():
+                    if select.select([conn], [], [], 1.0)[0]:
+                        conn.poll()
+                        if conn.notifies:
+                            conn.notifies.clear()
+                            self.stale = True
+            except Exception:
+                self.stale = True
+                self.stopping.wait(backoff)
+                backoff = min(backoff * 2, 60)
+            finally:
+                if conn is not None:
+                    conn.close()
@@ -0,0 +1,205 @@
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from django import db
+from .analysis import analyze_recording
+from .ingest import (
+    build_call_record, call_signature, conversation_filename, conversation_path, file_signature, load_existing_calls,
+    load_manifests, manifest_entries, parse_session_id, stat_or_none,
+)
+
+# Caller folders whose manifests are fetched with a single query
+MANIFEST_CHUNK = 500
+
+
+def scan_caller_dir(base_dir, caller_id, known=None, link_conversation=False, stored=None, since=None):
+    """
+    Scan one caller folder and parse its changed recordings.
+
+    Runs inside a pool worker, so it only touches the filesystem: `known` is the
+    manifest for this folder (path -> signature) and `stored` what the calls table
+    holds for it (calls.ingest.load_existing_calls), both fetched by the producer thread.
+    With `since` (a Unix time), only folders and recordings changed after it are read;
+    ctime rather than mtime, so recordings moved or copied in with an old mtime count.
+    Returns (records, skipped) where records is a list of (record, manifest entries).
+    """
+    dir_path = os.path.join(base_dir, caller_id)
+    known = known or {}
+    try:
+        # New recordings update the folder's ctime; nothing arrived if it is older
+        if since is not None and os.stat(dir_path).st_ctime < since:
+            return [], 0
+        with os.scandir(dir_path) as it:
+            files = {entry.name: entry for entry in it if entry.is_file(follow_symlinks=False)}
+    except (FileNotFoundError, NotADirectoryError):
+        return [], 0
+
+    records = []
+    skipped = 0
+    for name, entry in files.items():
+        if not name.endswith('_full.wav'):
+            continue
+        txt_name = name.replace('_full.wav', '_full.txt')
+        try:
+            wav_stat = entry.stat()
+            txt_stat = files[txt_name].stat() if txt_name in files else None
+        except FileNotFoundError:
+            continue
+
+        if since is not None and wav_stat.st_ctime < since and (txt_stat is None or txt_stat.st_ctime < since):
+            skipped += 1
+            continue
+
+        base_name = parse_session_id(name)[0]
+        conversation_stat = None
+        if link_conversation:
+            conversation_stat = stat_or_none(conversation_path(dir_path, base_name))
+
+        if known:
+            txt_signature = file_signature(txt_stat) if txt_stat is not None else None
+            conversation_signature = file_signature(conversation_stat) if conversation_stat is not None else None
+            if (known.get(os.path.join(caller_id, name)) == file_signature(wav_stat)
+                    and known.get(os.path.join(caller_id, txt_name)) == txt_signature
+                    and (not link_conversation or known.get(conversation_filename(base_name)) == conversation_signature)):
+                skipped += 1
+                continue
+
+        if stored:
+            wav_filename = os.path.join(caller_id, name)
+            if wav_filename in stored:
+                *signature, linked = stored[wav_filename]
+                # Unchanged, and no conversation recording appeared since it was stored
+                if tuple(signature) == call_signature(wav_stat, txt_stat) and (linked or conversation_stat is None):
+                    skipped += 1
+                    continue
+
+        record = build_call_record(dir_path, name, caller_id, wav_stat, txt_stat, link_conversation)
+        # One memory-mapped pass over the audio; in process mode this runs in the process pool
+        record.update(analyze_recording(entry.path))
+        records.append((record, manifest_entries(caller_id, name, wav_stat, txt_stat, conversation_stat)))
+    return records, skipped
+
+
+def list_caller_dirs(base_dir):
+    with os.scandir(base_dir) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield entry.name
+
+
+class Scanner:
+    """
+    Fans caller folders out over a thread or process pool and streams the parsed
+    records, in submission order, through a bounded queue to a single CallWriter
+    running on the calling thread.
+    """
+
+    def __init__(self, base_dir, workers=None, use_processes=False, incremental=False,
+                 link_conversation=False, skip_existing=False, since=None, queue_size=None):
+        self.base_dir = base_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.use_processes = use_processes
+        self.incremental = incremental
+        self.link_conversation = link_conversation
+        # Skip recordings whose stored call matches on size and mtime (watch_calls has no manifest)
+        self.skip_existing = skip_existing
+        # watch_calls' journal checkpoint: older files are already written or journaled
+        self.since = since.timestamp() if since is not None else None
+        # Bounds the folders in flight (submitted but not yet written)
+        self.queue_size = queue_size or self.workers * 4
+        self.count_skipped = 0
+        self.count_dirs = 0
+
+    def run(self, writer, caller_ids=None):
+        if caller_ids is None:
+            caller_ids = list_caller_dirs(self.base_dir)
+
+        if self.use_processes:
+            # Forked workers must not inherit the parent's open DB connections
+            db.connections.close_all()
+            executor = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='scan')
+
+        results = queue.Queue(maxsize=self.queue_size)
+        errors = []
+        stopping = threading.Event()
+        producer = threading.Thread(
+            target=self._produce, args=(executor, caller_ids, results, errors, stopping), name='scan-producer',
+            daemon=True)
+
+        with executor:
+            producer.start()
+            try:
+                while True:
+                    future = results.get()
+                    if future is None:
+                        break
+                    records, skipped = future.result()
+                    self.count_dirs += 1
+                    self.count_skipped += skipped
+                    for record, entries in records:
+                        writer.add(record, entries)
+            except BaseException:
+                # A failed folder or write: stop the producer, drop what it queued and let it close its connection
+                stopping.set()
+                while producer.is_alive() or not results.empty():
+                    try:
+                        future = results.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    if future is not None:
+                        future.cancel()
+                executor.shutdown(cancel_futures=True)
+                raise
+            finally:
+                producer.join()
+        writer.flush()
+
+        if errors:
+            raise errors[0]
+
+    def _produce(self, executor, caller_ids, results, errors, stopping):
+        try:
+            chunk = []
+            for caller_id in caller_ids:
+                chunk.append(caller_id)
+                if len(chunk) >= MANIFEST_CHUNK:
+                    self._submit(executor, chunk, results, stopping)
+                    chunk = []
+            if chunk:
+                self._submit(executor, chunk, results, stopping)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            # This thread used its own connection for the manifest lookups
+            db.connection.close()
+            self._put(results, None, stopping)
+
+    def _submit(self, executor, chunk, results, stopping):
+        if stopping.is_set():
+            return
+        manifests = load_manifests(chunk) if self.incremental else {}
+        existing = load_existing_calls(chunk) if self.skip_existing else {}
+        for caller_id in chunk:
+            if stopping.is_set():
+                return
+            future = executor.submit(
+                scan_caller_dir, self.base_dir, caller_id, manifests.get(caller_id), self.link_conversation,
+                existing.get(caller_id), self.since)
+            # Blocks once queue_size folders are in flight, so neither the pool
+            # nor the parsed records get ahead of the DB writer.
+            if not self._put(results, future, stopping):
+                future.cancel()
+                return
+
+    def _put(self, results, item, stopping):
+        # Gives up (False) once run() has stopped taking results
+        while not stopping.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
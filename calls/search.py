@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+from django.db.models import F
+from django.utils.html import conditional_escape
+from django.utils.safestring import mark_safe
+
+# Markers ts_headline puts around matches; swapped for <mark> after HTML-escaping the snippet
+START_SEL = '\x02'
+STOP_SEL = '\x03'
+
+
+def transcript_vector():
+    return SearchVector('transcript', config=settings.TRANSCRIPT_SEARCH_CONFIG)
+
+
+def transcript_query(q):
+    return SearchQuery(q, config=settings.TRANSCRIPT_SEARCH_CONFIG, search_type='websearch')
+
+
+def search_annotations(query):
+    # `rank` for ordering and a `headline` snippet (see highlight()) for display
+    return {
+        'rank': SearchRank(F('search_vector'), query),
+        'headline': SearchHeadline(
+            'transcript', query, config=settings.TRANSCRIPT_SEARCH_CONFIG,
+            start_sel=START_SEL, stop_sel=STOP_SEL, max_fragments=2, max_words=20, min_words=8,
+        ),
+    }
+
+
+def search_calls(queryset, q):
+    """
+    Full-text search over transcripts through the GIN-indexed search_vector,
+    best matches first.
+    """
+    query = transcript_query(q)
+    return queryset.filter(search_vector=query).annotate(**search_annotations(query)).order_by('-rank', '-id')
+
+
+def highlight(headline):
+    if not headline:
+        return ''
+    escaped = conditional_escape(headline)
+    return mark_safe(escaped.replace(START_SEL, '<mark>').replace(STOP_SEL, '</mark>'))
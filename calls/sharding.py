@@ -0,0 +1,131 @@
+import math
+import random
+import threading
+import zlib
+from django.db import connection
+from .metrics import INGEST_PARTITIONS
+
+# Advisory lock namespaces (first key of pg_advisory_lock(int, int)): one lock per
+# live watcher, one per owned partition of the caller directories
+MEMBER_LOCKS = 0x70627801
+PARTITION_LOCKS = 0x70627802
+
+
+def caller_partition(caller_id, partitions):
+    # Stable across processes and restarts, unlike hash()
+    return zlib.crc32(caller_id.encode()) % partitions
+
+
+class PartitionLeases:
+    """
+    Splits the caller directories into `partitions` hash partitions and claims a
+    fair share of them for this watch_calls replica, using Postgres session
+    advisory locks on a dedicated connection: no lease table to expire, since
+    Postgres drops a dead replica's locks with its connection.
+
+    Every `interval` seconds the replica counts the live members (their member
+    locks in pg_locks), releases partitions above its share and try-locks free
+    ones up to it. Newly claimed partitions are queued for take_acquired(), so
+    the caller can rescan them; losing the connection drops every partition.
+    """
+
+    def __init__(self, partitions, interval=5.0):
+        self.partitions = partitions
+        self.interval = interval
+        self.owned = frozenset()
+        self.acquired = set()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def owns(self, caller_id):
+        return caller_partition(caller_id, self.partitions) in self.owned
+
+    def take_acquired(self):
+        # Partitions claimed since the last call, which have not been scanned yet
+        with self.lock:
+            acquired = self.acquired & self.owned
+            self.acquired = set()
+        return acquired
+
+    def retake(self, partitions):
+        # Acquired partitions whose catch-up failed, returned by the next take_acquired()
+        with self.lock:
+            self.acquired |= set(partitions)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='partition-leases', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join()
+
+    def _set_owned(self, owned):
+        with self.lock:
+            self.acquired |= owned - self.owned
+            self.owned = frozenset(owned)
+        INGEST_PARTITIONS.set(len(owned))
+
+    def _run(self):
+        backoff = 1
+        while not self.stopping.is_set():
+            conn = None
+            try:
+                # Locks live as long as this connection, so it is ours alone and in autocommit
+                conn = connection.get_new_connection(connection.get_connection_params())
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    self._join(cursor)
+                    backoff = 1
+                    while not self.stopping.is_set():
+                        self._rebalance(cursor)
+                        self.stopping.wait(self.interval)
+            except Exception:
+                self.stopping.wait(backoff)
+                backoff = min(backoff * 2, 60)
+            finally:
+                # Whatever we held is released (or will be, once Postgres notices)
+                self._set_owned(set())
+                if conn is not None:
+                    conn.close()
+
+    def _join(self, cursor):
+        while True:
+            cursor.execute('SELECT pg_try_advisory_lock(%s, %s)', [MEMBER_LOCKS, random.getrandbits(31)])
+            if cursor.fetchone()[0]:
+                return
+
+    def _rebalance(self, cursor):
+        cursor.execute(
+            "SELECT classid::int, objid::int, pid = pg_backend_pid() FROM pg_locks "
+            "WHERE locktype = 'advisory' AND granted AND objsubid = 2 "
+            "AND database = (SELECT oid FROM pg_database WHERE datname = current_database()) "
+            "AND classid::int IN (%s, %s)",
+            [MEMBER_LOCKS, PARTITION_LOCKS])
+        members = 0
+        taken = set()
+        owned = set()
+        for namespace, key, mine in cursor.fetchall():
+            if namespace == MEMBER_LOCKS:
+                members += 1
+            elif mine:
+                owned.add(key)
+            else:
+                taken.add(key)
+
+        share = math.ceil(self.partitions / max(members, 1))
+        # Give up the surplus first, so replicas that just joined can claim it
+        for partition in sorted(owned, reverse=True)[:max(len(owned) - share, 0)]:
+            cursor.execute('SELECT pg_advisory_unlock(%s, %s)', [PARTITION_LOCKS, partition])
+            owned.discard(partition)
+
+        free = [partition for partition in range(self.partitions) if partition not in owned and partition not in taken]
+        for partition in free:
+            if len(owned) >= share:
+                break
+            cursor.execute('SELECT pg_try_advisory_lock(%s, %s)', [PARTITION_LOCKS, partition])
+            if cursor.fetchone()[0]:
+                owned.add(partition)
+        self._set_owned(owned)
@@ -0,0 +1,23 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Call, User
+from .registry import notify_users_changed
+from .stats import remove_call_from_stats
+
+
+@receiver(post_delete, sender=Call)
+def call_deleted(sender, instance, **kwargs):
+    # Keep the per-user rollup in step with deletions (admin, cascades, cleanup jobs)
+    remove_call_from_stats(instance)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Watchers cache registered phone numbers (calls.registry); logins only touch last_login
+    if created or update_fields is None or 'phone_number' in update_fields:
+        notify_users_changed()
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    notify_users_changed()
@@ -0,0 +1,122 @@
+from collections import defaultdict
+from django.db import connection
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import CallDailyStats, CallReasonDailyStats
+
+# Columns of Call that feed the rollup; ingest prefetches these for rows it is about to overwrite
+STATS_FIELDS = ('user_id', 'created_at', 'wav_size', 'talk_time', 'reasons')
+
+
+def normalize_reason(reason):
+    # Case and whitespace insensitive; 0008_call_reasons applies the same rules in SQL
+    return ' '.join(reason.split()).lower()[:100]
+
+
+def split_transfer_reasons(transfer_reasons):
+    # "TRANSFER_REASONS: Billing, technical, billing" -> ['billing', 'technical']
+    if not transfer_reasons:
+        return []
+    reasons = (normalize_reason(reason) for reason in transfer_reasons.split(','))
+    return list(dict.fromkeys(reason for reason in reasons if reason))
+
+
+class StatsDelta:
+    """
+    Accumulates rollup changes for a batch of calls so they can be applied with
+    one upsert per rollup table.
+    """
+
+    def __init__(self):
+        self.days = defaultdict(lambda: [0, 0, 0.0])
+        self.reasons = defaultdict(int)
+
+    def add(self, values, sign=1):
+        # values: a dict (or object attributes) with the STATS_FIELDS of one call
+        if values['user_id'] is None:
+            return
+        key = (values['user_id'], timezone.localdate(values['created_at']))
+        totals = self.days[key]
+        totals[0] += sign
+        totals[1] += sign * (values['wav_size'] or 0)
+        totals[2] += sign * (values['talk_time'] or 0)
+        for reason in values['reasons'] or ():
+            self.reasons[key + (reason,)] += sign
+
+    def replace(self, old, new):
+        # An upsert: drop what the previous version of the row contributed, add the new one
+        if old is not None:
+            self.add(old, sign=-1)
+        self.add(new)
+
+    def apply(self):
+        """
+        INSERT ... ON CONFLICT DO UPDATE adding the deltas to the stored totals.
+        Call inside the same transaction as the Call writes.
+        """
+        days = [(user_id, day, *totals) for (user_id, day), totals in self.days.items() if any(totals)]
+        reasons = [key + (count,) for key, count in self.reasons.items() if count]
+        daily_table = CallDailyStats._meta.db_table
+        reason_table = CallReasonDailyStats._meta.db_table
+        with connection.cursor() as cursor:
+            if days:
+                cursor.executemany(
+                    f'INSERT INTO {daily_table} (user_id, day, call_count, wav_bytes, talk_time) '
+                    f'VALUES (%s, %s, %s, %s, %s) '
+                    f'ON CONFLICT (user_id, day) DO UPDATE SET '
+                    f'call_count = {daily_table}.call_count + EXCLUDED.call_count, '
+                    f'wav_bytes = {daily_table}.wav_bytes + EXCLUDED.wav_bytes, '
+                    f'talk_time = {daily_table}.talk_time + EXCLUDED.talk_time',
+                    days,
+                )
+            if reasons:
+                cursor.executemany(
+                    f'INSERT INTO {reason_table} (user_id, day, reason, call_count) '
+                    f'VALUES (%s, %s, %s, %s) '
+                    f'ON CONFLICT (user_id, day, reason) DO UPDATE SET '
+                    f'call_count = {reason_table}.call_count + EXCLUDED.call_count',
+                    reasons,
+                )
+        self.days.clear()
+        self.reasons.clear()
+
+
+def remove_call_from_stats(call):
+    """
+    Decrement the rollup for a deleted call. Only updates existing rows: when the
+    whole user is being deleted their stats rows are already gone.
+    """
+    if call.user_id is None:
+        return
+    day = timezone.localdate(call.created_at)
+    CallDailyStats.objects.filter(user_id=call.user_id, day=day).update(
+        call_count=F('call_count') - 1,
+        wav_bytes=F('wav_bytes') - call.wav_size,
+        talk_time=F('talk_time') - (call.talk_time or 0),
+    )
+    if call.reasons:
+        CallReasonDailyStats.objects.filter(user_id=call.user_id, day=day, reason__in=call.reasons).update(
+            call_count=F('call_count') - 1)
+
+
+def user_totals(user):
+    # All-time totals for one user, summed from the rollup (one row per active day)
+    totals = CallDailyStats.objects.filter(user=user).aggregate(
+        calls=Sum('call_count'), wav_bytes=Sum('wav_bytes'), talk_time=Sum('talk_time'))
+    return {key: value or 0 for key, value in totals.items()}
+
+
+def reason_counts(user=None, since=None):
+    """
+    Calls per transfer reason, most frequent first, summed from the rollup
+    rather than by unnesting Call.reasons. Calls without a user are not counted.
+    """
+    rows = CallReasonDailyStats.objects.all()
+    if user is not None:
+        rows = rows.filter(user=user)
+    if since is not None:
+        rows = rows.filter(day__gte=since)
+    return (
+        rows.values('reason').annotate(calls=Sum('call_count'))
+        .filter(calls__gt=0).order_by('-calls', 'reason')
+    )
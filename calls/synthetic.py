@@ -0,0 +1,133 @@
+"""
+Synthetic Asterisk recording trees for benchmarks and local testing.
+
+Mirrors the layout the dialplan produces under the sounds directory:
+
+    {root}/call_sessions/{caller_id}/{caller_id}_{session_id}_full.wav
+    {root}/call_sessions/{caller_id}/{caller_id}_{session_id}_full.txt
+    {root}/{caller_id}_{session_id}/full_conversation.wav
+
+Audio is 16-bit mono PCM: bursts of voiced noise separated by pauses, so the
+waveform and silence metrics have something to measure.
+"""
+import datetime
+import os
+import random
+import struct
+
+import numpy as np
+
+REASONS = ['billing', 'technical', 'cancellation', 'sales', 'complaint', 'account', 'delivery', 'refund']
+AGENT_LINES = [
+    "Thank you for calling, how can I help you today?",
+    "Let me check that for you.",
+    "I can see the invoice on your account.",
+    "I will transfer you to the right team.",
+    "Is there anything else I can help you with?",
+]
+CALLER_LINES = [
+    "Hi, I have a question about my last invoice.",
+    "My internet connection keeps dropping.",
+    "I would like to cancel my subscription.",
+    "The delivery has not arrived yet.",
+    "Can you tell me my account balance?",
+]
+# Distinct audio clips generated per tree; calls reuse them so generation stays I/O bound
+CLIP_POOL = 16
+
+
+def synth_pcm(duration, sample_rate, rng):
+    # int16 samples: 0.3-2 s voiced bursts alternating with 0.2-1 s pauses
+    n = int(duration * sample_rate)
+    samples = np.zeros(n, dtype=np.float32)
+    t = 0
+    while t < n:
+        burst = int(rng.uniform(0.3, 2.0) * sample_rate)
+        end = min(t + burst, n)
+        k = np.arange(end - t, dtype=np.float32)
+        pitch = rng.uniform(90, 250)
+        tone = np.sin(2 * np.pi * pitch * k / sample_rate) * 0.5 + np.sin(4 * np.pi * pitch * k / sample_rate) * 0.2
+        envelope = np.sin(np.pi * k / max(end - t, 1))
+        noise = np.random.default_rng(rng.randrange(2 ** 32)).normal(0, 0.05, end - t)
+        samples[t:end] = (tone + noise) * envelope * rng.uniform(0.2, 0.6)
+        t = end + int(rng.uniform(0.2, 1.0) * sample_rate)
+    return (np.clip(samples, -1, 1) * 32767).astype('<i2').tobytes()
+
+
+def wav_bytes(pcm, sample_rate, channels=1, bits=16):
+    block_align = channels * bits // 8
+    header = b'RIFF' + struct.pack('<I', 36 + len(pcm)) + b'WAVE'
+    header += b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, sample_rate, sample_rate * block_align, block_align, bits)
+    header += b'data' + struct.pack('<I', len(pcm))
+    return header + pcm
+
+
+def make_clips(sample_rate, min_duration, max_duration, rng, count=CLIP_POOL):
+    return [
+        wav_bytes(synth_pcm(rng.uniform(min_duration, max_duration), sample_rate, rng), sample_rate)
+        for _ in range(count)
+    ]
+
+
+def transcript_text(caller_id, rng):
+    reasons = rng.sample(REASONS, rng.randint(0, 2))
+    lines = [
+        f"CALLER: {caller_id}",
+        f"TRANSFER_REASONS: {','.join(reasons)}",
+        f"TRANSFER_REASON_DESCRIPTIONS: {'|'.join(reason.capitalize() for reason in reasons)}",
+        "",
+    ]
+    for turn in range(rng.randint(2, 8)):
+        speaker, pool = ('Agent', AGENT_LINES) if turn % 2 == 0 else ('Caller', CALLER_LINES)
+        lines.append(f"[00:{turn * 7 // 60:02d}:{turn * 7 % 60:02d}] {speaker}: {rng.choice(pool)}")
+    return '\n'.join(lines) + '\n'
+
+
+def write_call(root, caller_id, session_id, created_at, clips, rng):
+    """
+    Write one call (transcript, filtered and full conversation recordings) and
+    return the path of its `_full.wav`. The transcript is written first so the
+    call is complete once the wav is closed.
+    """
+    base_name = f'{caller_id}_{session_id}'
+    caller_dir = os.path.join(root, 'call_sessions', caller_id)
+    conversation_dir = os.path.join(root, base_name)
+    os.makedirs(caller_dir, exist_ok=True)
+    os.makedirs(conversation_dir, exist_ok=True)
+
+    timestamp = created_at.timestamp()
+    paths = [
+        (os.path.join(caller_dir, f'{base_name}_full.txt'), transcript_text(caller_id, rng).encode()),
+        (os.path.join(conversation_dir, 'full_conversation.wav'), rng.choice(clips)),
+        (os.path.join(caller_dir, f'{base_name}_full.wav'), rng.choice(clips)),
+    ]
+    for path, data in paths:
+        with open(path, 'wb') as f:
+            f.write(data)
+        os.utime(path, (timestamp, timestamp))
+    return paths[-1][0]
+
+
+def generate_tree(root, callers, calls, first_caller=10000, days=30, sample_rate=8000,
+                  min_duration=1.0, max_duration=10.0, seed=0, progress=None):
+    """
+    Write `calls` calls for each of `callers` caller ids under `root` (the
+    sounds directory), spread over the last `days` days. Returns the number of
+    calls written; `progress(done)` is called after every caller.
+    """
+    rng = random.Random(seed)
+    clips = make_clips(sample_rate, min_duration, max_duration, rng)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    epoch = int(now.timestamp()) - days * 86400
+    sequence = 0
+    for index in range(callers):
+        caller_id = str(first_caller + index)
+        for _ in range(calls):
+            # Asterisk-style uniqueid: {epoch}.{sequence}
+            session_id = f'{epoch}.{sequence}'
+            created_at = now - datetime.timedelta(seconds=rng.uniform(0, days * 86400))
+            write_call(root, caller_id, session_id, created_at, clips, rng)
+            sequence += 1
+        if progress:
+            progress(sequence)
+    return sequence
@@ -1,3 +1,1050 @@
-from django.test import TestCase
+import asyncio
+import concurrent.futures
+import datetime
+import io
+import json
+import os
+import queue
+import random
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from unittest import mock
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.core.management.color import no_style
+from django import db
+from django.db import connection
+from django.db import transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from watchdog.observers import Observer
+from .analysis import ANALYSIS_FIELDS, PEAK_BUCKETS, analyze_recording, analyze_wav
+from .audio import MAX_RANGES, if_range_matches, parse_range_header, recording_etag, serve_recording
+from .coldstore import ArchiveReader, archive_crc, open_recording, write_archive
+from .export import iter_export_zip
+from .ingest import CallWriter
+from .journal import ALL, CHECKPOINT_SLACK, IngestJournal
+from .live import call_events
+from .management.commands.watch_calls import Command as WatchCommand, ConversationHandler
+from .models import Call, CallDailyStats, CallReasonDailyStats, IngestCheckpoint, IngestJournalEntry, User
+from .pagination import KeysetPaginator, decode_cursor, encode_cursor
+from .partitions import convert_table
+from .pipeline import SettleStage, WriterStage
+from .reconcile import Reconciler
+from .registry import USERS_CHANNEL, RegisteredUsers
+from .scanner import Scanner
+from .search import transcript_query
+from .sharding import PartitionLeases, caller_partition
+from .stats import split_transfer_reasons
+from .synthetic import make_clips, synth_pcm, wav_bytes, write_call
+from .transcripts import IndexCache, TranscriptIndex, read_header, segment_index, transfer_fields
+from .views import CallEventsView
+from .wav import WAV_FIELDS, read_wav_header, wav_metadata
 
-# Create your tests here.
+
+class TempDirMixin:
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+
+class RangeHeaderTests(SimpleTestCase):
+    def test_single_and_open_ranges(self):
+        self.assertEqual(parse_range_header('bytes=0-99', 1000), [(0, 99)])
+        self.assertEqual(parse_range_header('bytes=900-', 1000), [(900, 999)])
+        self.assertEqual(parse_range_header('bytes=900-5000', 1000), [(900, 999)])
+
+    def test_suffix_ranges(self):
+        self.assertEqual(parse_range_header('bytes=-100', 1000), [(900, 999)])
+        self.assertEqual(parse_range_header('bytes=-5000', 1000), [(0, 999)])
+
+    def test_overlapping_and_adjacent_ranges_are_merged(self):
+        self.assertEqual(parse_range_header('bytes=500-599, 0-99,50-149,150-199', 1000), [(0, 199), (500, 599)])
+
+    def test_too_many_ranges_are_ignored(self):
+        spec = ','.join(f'{i * 10}-{i * 10 + 1}' for i in range(MAX_RANGES + 1))
+        self.assertIsNone(parse_range_header(f'bytes={spec}', 1000))
+        spec = ','.join(f'{i * 10}-{i * 10 + 1}' for i in range(MAX_RANGES))
+        self.assertEqual(len(parse_range_header(f'bytes={spec}', 1000)), MAX_RANGES)
+
+    def test_unsatisfiable_ranges(self):
+        # [] is answered with 416
+        self.assertEqual(parse_range_header('bytes=1000-1100', 1000), [])
+        self.assertEqual(parse_range_header('bytes=-0', 1000), [])
+
+    def test_malformed_headers_are_ignored(self):
+        for header in ('', 'bytes', 'items=0-1', 'bytes=abc', 'bytes=5-1', 'bytes=0'):
+            self.assertIsNone(parse_range_header(header, 1000), header)
+
+
+class IfRangeTests(TempDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.st = os.stat(self.write('a.wav', b'x' * 10))
+        self.etag = recording_etag(self.st)
+
+    def matches(self, if_range=None):
+        headers = {'HTTP_IF_RANGE': if_range} if if_range is not None else {}
+        return if_range_matches(RequestFactory().get('/', **headers), self.etag, self.st)
+
+    def test_without_if_range(self):
+        self.assertTrue(self.matches())
+
+    def test_etags(self):
+        self.assertTrue(self.matches(self.etag))
+        self.assertFalse(self.matches('"other"'))
+        self.assertFalse(self.matches('W/' + self.etag))
+
+    def test_dates(self):
+        self.assertTrue(self.matches(http_date(self.st.st_mtime)))
+        self.assertFalse(self.matches(http_date(self.st.st_mtime - 60)))
+        self.assertFalse(self.matches('not a date'))
+
+
+@override_settings(AUDIO_OFFLOAD='', AUDIO_STREAM_CHUNK_SIZE=1000)
+class ServeRecordingTests(TempDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = wav_bytes(synth_pcm(2, 8000, random.Random(4)), 8000)
+        self.path = self.write('a.wav', self.data)
+        self.archive = os.path.join(self.tmp, 'a.wav.pbxz')
+        write_archive(self.path, self.archive, block_size=4096)
+
+    def serve(self, path, asynchronous, range_header=None):
+        headers = {'HTTP_RANGE': range_header} if range_header else {}
+        response = serve_recording(RequestFactory().get('/', **headers), path, asynchronous=asynchronous)
+        if not response.streaming:
+            return response, response.content
+        if asynchronous:
+            async def collect():
+                return b''.join([chunk async for chunk in response.streaming_content])
+            return response, asyncio.run(collect())
+        body = b''.join(response.streaming_content)
+        # As the WSGI server does once the body is sent
+        response.close()
+        return response, body
+
+    def test_sync_and_async_bodies_match(self):
+        for path in (self.path, self.archive):
+            for asynchronous in (False, True):
+                for range_header, status, expected in (
+                        (None, 200, self.data),
+                        ('bytes=100-4999', 206, self.data[100:5000]),
+                        ('bytes=-10', 206, self.data[-10:]),
+                        ('bytes=999999-', 416, b'')):
+                    with self.subTest(path=path, asynchronous=asynchronous, range=range_header):
+                        response, body = self.serve(path, asynchronous, range_header)
+                        self.assertEqual(response.status_code, status)
+                        self.assertEqual(body, expected)
+                        if status != 416:
+                            self.assertEqual(response['Content-Length'], str(len(expected)))
+
+    def test_multipart_ranges(self):
+        for asynchronous in (False, True):
+            response, body = self.serve(self.archive, asynchronous, 'bytes=0-3,5000-5009')
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response['Content-Length'], str(len(body)))
+            self.assertIn(b'Content-Range: bytes 0-3/%d\r\n\r\nRIFF\r\n' % len(self.data), body)
+            self.assertIn(self.data[5000:5010], body)
+
+
+class WavHeaderTests(TempDirMixin, SimpleTestCase):
+    def test_pcm_header(self):
+        path = self.write('a.wav', wav_bytes(b'\x00\x00' * 16000, 8000, channels=2))
+        with open(path, 'rb') as f:
+            header = read_wav_header(f)
+        self.assertEqual((header['sample_rate'], header['channels'], header['bits_per_sample']), (8000, 2, 16))
+        self.assertEqual((header['data_offset'], header['data_size']), (44, 32000))
+        self.assertEqual(wav_metadata(path), {'duration': 1.0, 'sample_rate': 8000, 'channels': 2, 'codec': 'pcm_s16le'})
+
+    def test_placeholder_data_size_is_read_from_the_file(self):
+        # As a recording still being written carries it
+        data = bytearray(wav_bytes(b'\x00\x00' * 800, 8000))
+        data[40:44] = b'\xff\xff\xff\xff'
+        with open(self.write('a.wav', data), 'rb') as f:
+            self.assertEqual(read_wav_header(f)['data_size'], 1600)
+
+    def test_malformed_headers_are_rejected(self):
+        pcm = b'\x00\x00' * 800
+        for name, data in (
+                ('empty', b''),
+                ('not riff', b'OggS' + bytes(40)),
+                ('truncated fmt', wav_bytes(pcm, 8000)[:30]),
+                ('no data', wav_bytes(pcm, 8000)[:36]),
+                ('zero channels', wav_bytes(pcm, 8000, channels=0))):
+            with open(self.write('bad.wav', data), 'rb') as f, self.assertRaises(ValueError, msg=name):
+                read_wav_header(f)
+        self.assertEqual(wav_metadata(os.path.join(self.tmp, 'bad.wav')), dict.fromkeys(WAV_FIELDS))
+        self.assertEqual(wav_metadata(os.path.join(self.tmp, 'missing.wav')), dict.fromkeys(WAV_FIELDS))
+
+    def test_zero_sample_rate_is_rejected(self):
+        path = self.write('zero.wav', wav_bytes(b'\x00\x01' * 800, 0))
+        with open(path, 'rb') as f, self.assertRaises(ValueError):
+            read_wav_header(f)
+
+    def test_zero_sample_rate_is_not_analysed(self):
+        path = self.write('zero.wav', wav_bytes(b'\x00\x01' * 800, 0))
+        self.assertEqual(analyze_recording(path), dict.fromkeys(ANALYSIS_FIELDS))
+
+
+class AnalysisTests(TempDirMixin, SimpleTestCase):
+    def test_silence(self):
+        result = analyze_wav(self.write('a.wav', wav_bytes(b'\x00\x00' * 16000, 8000)))
+        self.assertEqual((result['rms'], result['silence_ratio'], result['talk_time']), (0.0, 1.0, 0.0))
+        self.assertEqual(set(result['peaks']), {0})
+
+    def test_empty_recording(self):
+        result = analyze_wav(self.write('a.wav', wav_bytes(b'', 8000)))
+        self.assertEqual(result, {'peaks': b'', 'rms': 0.0, 'silence_ratio': 1.0, 'talk_time': 0.0})
+
+    def test_speech(self):
+        pcm = synth_pcm(20, 8000, random.Random(5))
+        result = analyze_wav(self.write('a.wav', wav_bytes(pcm, 8000)))
+        # (min, max) per bucket: one per 20 ms window up to PEAK_BUCKETS
+        self.assertEqual(len(result['peaks']), 2 * PEAK_BUCKETS)
+        self.assertGreater(result['rms'], 0.01)
+        self.assertTrue(0 < result['silence_ratio'] < 1)
+        self.assertAlmostEqual(result['talk_time'], 20 * (1 - result['silence_ratio']), delta=0.05)
+
+    def test_stereo_is_mixed_to_mono(self):
+        pcm = synth_pcm(2, 8000, random.Random(5))
+        mono = analyze_wav(self.write('mono.wav', wav_bytes(pcm, 8000)))
+        # The same samples on both channels
+        stereo_pcm = b''.join(pcm[i:i + 2] * 2 for i in range(0, len(pcm), 2))
+        stereo = analyze_wav(self.write('stereo.wav', wav_bytes(stereo_pcm, 8000, channels=2)))
+        self.assertEqual(stereo['peaks'], mono['peaks'])
+        self.assertAlmostEqual(stereo['rms'], mono['rms'], places=5)
+
+    def test_malformed_header_is_not_analysed(self):
+        path = self.write('a.wav', b'RIFF\x00\x00\x00\x00WAVEjunk')
+        with self.assertRaises(ValueError):
+            analyze_wav(path)
+        self.assertEqual(analyze_recording(path), dict.fromkeys(ANALYSIS_FIELDS))
+
+
+def call_record(session_id, created_at, wav_size=100):
+    return {
+        'caller_id': '10000',
+        'session_id': session_id,
+        'wav_filename': f'10000/10000_{session_id}_full.wav',
+        'txt_filename': '',
+        'wav_size': wav_size,
+        'created_at': created_at,
+        'reasons': [],
+    }
+
+
+class ColdStoreTests(TempDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        # Several blocks, the last one partial
+        self.data = wav_bytes(synth_pcm(9, 8000, random.Random(7)), 8000)
+        self.src = self.write('a.wav', self.data)
+
+    def check_round_trip(self, codec):
+        dst = os.path.join(self.tmp, 'cold', 'a.wav.pbxz')
+        size, archive_size, crc = write_archive(self.src, dst, codec=codec, block_size=4096)
+        self.assertEqual(size, len(self.data))
+        self.assertLess(archive_size, size)
+        self.assertEqual(archive_crc(dst), crc)
+        self.assertEqual(os.stat(dst).st_mtime_ns, os.stat(self.src).st_mtime_ns)
+        rng = random.Random(codec)
+        with ArchiveReader(dst) as f:
+            self.assertEqual(f.read(), self.data)
+            for _ in range(200):
+                offset = rng.randrange(len(self.data) + 100)
+                length = rng.randrange(10000)
+                f.seek(offset)
+                # A read stops at the end of a block, as a raw file's may stop short
+                data = b''
+                while len(data) < length:
+                    chunk = f.read(length - len(data))
+                    if not chunk:
+                        break
+                    data += chunk
+                self.assertEqual(data, self.data[offset:offset + length])
+            self.assertEqual(f.seek(-10, os.SEEK_END), len(self.data) - 10)
+            self.assertEqual(f.read(), self.data[-10:])
+        self.assertEqual(wav_metadata(dst, open_file=open_recording), wav_metadata(self.src))
+
+    def test_lzma_round_trip(self):
+        self.check_round_trip('lzma')
+
+    def test_zlib_round_trip(self):
+        self.check_round_trip('zlib')
+
+    def test_truncated_archive_is_rejected(self):
+        dst = os.path.join(self.tmp, 'a.wav.pbxz')
+        write_archive(self.src, dst)
+        with open(dst, 'r+b') as f:
+            f.truncate(os.path.getsize(dst) - 4)
+        with self.assertRaises(ValueError):
+            ArchiveReader(dst)
+        with self.assertRaises(ValueError):
+            ArchiveReader(self.src)
+
+    def test_failed_archive_leaves_no_temporary_file(self):
+        dst = os.path.join(self.tmp, 'cold', 'a.wav.pbxz')
+        with mock.patch('calls.coldstore.os.fsync', side_effect=OSError('No space left on device')):
+            with self.assertRaises(OSError):
+                write_archive(self.src, dst)
+        self.assertEqual(os.listdir(os.path.dirname(dst)), [])
+
+
+class CallWriterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='10000', phone_number='10000')
+        self.created_at = timezone.now().replace(microsecond=0) - datetime.timedelta(days=3)
+
+    def record(self, session_id='5001', created_at=None, wav_size=100):
+        return call_record(session_id, created_at or self.created_at, wav_size)
+
+    def write(self, *records):
+        return CallWriter(create_users=False).write(list(records))
+
+    def day_counts(self):
+        return dict(CallDailyStats.objects.filter(user=self.user).values_list('day', 'call_count'))
+
+    def test_upsert_updates_the_existing_call(self):
+        self.write(self.record())
+        writer = CallWriter(create_users=False)
+        writer.write([self.record(wav_size=200)])
+        self.assertEqual(writer.count_updated, 1)
+        self.assertEqual(list(Call.objects.values_list('session_id', 'wav_size')), [('5001', 200)])
+
+    def test_reingested_cold_call_returns_to_the_hot_tier(self):
+        self.write(self.record())
+        Call.objects.update(storage_tier='cold', archive_filename='10000/10000_5001_full.wav.pbxz')
+        self.write(self.record())
+        self.assertEqual(list(Call.objects.values_list('storage_tier', 'archive_filename')), [('hot', '')])
+
+    def test_caller_whose_username_is_taken_is_reported(self):
+        User.objects.create(username='20000', phone_number='555')
+        writer = CallWriter()
+        with self.assertLogs('calls.ingest', 'WARNING'):
+            writer.write([dict(self.record(), caller_id='20000')])
+        self.assertEqual(writer.unresolved_callers, {'20000'})
+        self.assertEqual(list(Call.objects.values_list('user', flat=True)), [None])
+
+    def test_moved_recording_keeps_one_row_and_moves_its_stats(self):
+        self.write(self.record())
+        moved = self.created_at + datetime.timedelta(days=1)
+        self.write(self.record(created_at=moved))
+        self.assertEqual(list(Call.objects.values_list('created_at', flat=True)), [moved])
+        self.assertEqual(self.day_counts(), {
+            timezone.localdate(self.created_at): 0, timezone.localdate(moved): 1})
+
+    def test_moved_recording_on_a_partitioned_table(self):
+        convert_table(premake=1)
+        self.write(self.record())
+        moved = self.created_at + datetime.timedelta(days=1)
+        self.write(self.record(created_at=moved))
+        self.assertEqual(list(Call.objects.values_list('created_at', flat=True)), [moved])
+
+    def test_duplicate_sessions_are_merged_on_a_partitioned_table(self):
+        convert_table(premake=1)
+        self.write(self.record())
+        # As two writers racing with different mtimes would leave it
+        other = self.created_at + datetime.timedelta(hours=1)
+        self.write(self.record(session_id='5002', created_at=other))
+        Call.objects.filter(session_id='5002').update(session_id='5001')
+        self.write(self.record(created_at=other, wav_size=300))
+        self.assertEqual(list(Call.objects.values_list('created_at', 'wav_size')), [(other, 300)])
+        self.assertEqual(sum(self.day_counts().values()), 1)
+
+
+class CallStatsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='10000', phone_number='10000')
+        self.day = timezone.now().replace(microsecond=0) - datetime.timedelta(days=2)
+
+    def record(self, session_id, created_at=None, wav_size=100, talk_time=1.5, reasons=()):
+        return dict(call_record(session_id, created_at or self.day, wav_size),
+                    talk_time=talk_time, reasons=list(reasons))
+
+    def rollup(self):
+        days = {day: (count, wav_bytes, talk_time) for day, count, wav_bytes, talk_time in
+                CallDailyStats.objects.filter(call_count__gt=0).values_list('day', 'call_count', 'wav_bytes', 'talk_time')}
+        reasons = dict(((day, reason), count) for day, reason, count in
+                       CallReasonDailyStats.objects.filter(call_count__gt=0).values_list('day', 'reason', 'call_count'))
+        return days, reasons
+
+    def assertInStep(self, days, reasons):
+        self.assertEqual(self.rollup(), (days, reasons))
+        # A rebuild from Call agrees with the incremental totals
+        call_command('rebuild_call_stats', stdout=io.StringIO())
+        self.assertEqual(self.rollup(), (days, reasons))
+
+    def test_rollup_follows_inserts_updates_and_deletes(self):
+        day, next_day = timezone.localdate(self.day), timezone.localdate(self.day + datetime.timedelta(days=1))
+        writer = CallWriter(create_users=False)
+        writer.write([self.record('1', reasons=['billing']), self.record('2', wav_size=50, reasons=['billing', 'sales'])])
+        self.assertInStep({day: (2, 150, 3.0)}, {(day, 'billing'): 2, (day, 'sales'): 1})
+
+        # New reasons and talk time for one call, another moved to the next day
+        writer.write([self.record('1', talk_time=4.0, reasons=['refund']),
+                      self.record('2', created_at=self.day + datetime.timedelta(days=1), wav_size=50, reasons=['sales'])])
+        self.assertInStep({day: (1, 100, 4.0), next_day: (1, 50, 1.5)},
+                          {(day, 'refund'): 1, (next_day, 'sales'): 1})
+
+        Call.objects.get(session_id='1').delete()
+        self.assertInStep({next_day: (1, 50, 1.5)}, {(next_day, 'sales'): 1})
+
+
+class ConcurrentWriterTests(TransactionTestCase):
+    def test_racing_writers_count_a_call_once(self):
+        user = User.objects.create(username='10000', phone_number='10000')
+        record = call_record('5001', timezone.now())
+        written, release = threading.Event(), threading.Event()
+
+        def first():
+            try:
+                with transaction.atomic():
+                    CallWriter(create_users=False).write([dict(record)])
+                    written.set()
+                    release.wait(5)
+            finally:
+                connection.close()
+
+        def second():
+            try:
+                written.wait(5)
+                CallWriter(create_users=False).write([dict(record, wav_size=300)])
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=first), threading.Thread(target=second)]
+        for thread in threads:
+            thread.start()
+        # The second writer now waits on the first one's session lock
+        time.sleep(0.3)
+        release.set()
+        for thread in threads:
+            thread.join()
+        stats = CallDailyStats.objects.get(user=user)
+        self.assertEqual((stats.call_count, stats.wav_bytes), (1, 300))
+
+
+class ReconcilerTests(TempDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        User.objects.create(username='10000', phone_number='10000')
+        CallWriter(create_users=False).write([call_record(session_id, timezone.now()) for session_id in '123'])
+        os.mkdir(os.path.join(self.tmp, '10000'))
+
+    def reconcile(self):
+        Reconciler(self.tmp, CallWriter(create_users=False), delete=True).run()
+        return sorted(Call.objects.values_list('session_id', flat=True))
+
+    def test_delete_keeps_recently_written_calls(self):
+        Call.objects.filter(session_id='1').update(last_updated_at=timezone.now() - datetime.timedelta(days=1))
+        self.assertEqual(self.reconcile(), ['2', '3'])
+
+    def test_delete_keeps_calls_pending_in_the_journal(self):
+        Call.objects.update(last_updated_at=timezone.now() - datetime.timedelta(days=1))
+        # Moved to another folder and seen by watch_calls, but not yet written
+        IngestJournal(self.tmp).append([os.path.join(self.tmp, '10001', '10001_2_full.wav')])
+        self.assertEqual(self.reconcile(), ['2'])
+
+
+class KeysetPaginationTests(TestCase):
+    def test_cursor_round_trip(self):
+        created_at = timezone.now()
+        cursor = encode_cursor(Call(pk=42, created_at=created_at))
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor), (created_at, 42))
+
+    def test_tampered_cursors_are_ignored(self):
+        for cursor in ('', None, '!!!', 'bm90IGEgY3Vyc29y', encode_cursor(Call(pk=1, created_at=timezone.now()))[:-4]):
+            self.assertIsNone(decode_cursor(cursor), cursor)
+
+    def test_pages_walk_every_call_once(self):
+        User.objects.create(username='10000', phone_number='10000')
+        # Ties on created_at are broken by id
+        created_at = timezone.now().replace(microsecond=0)
+        CallWriter(create_users=False).write(
+            [call_record(str(i), created_at - datetime.timedelta(minutes=i // 2)) for i in range(7)])
+        expected = list(Call.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        paginator = KeysetPaginator(Call.objects.all(), per_page=3)
+        pages = [paginator.page()]
+        while pages[-1].has_next:
+            pages.append(paginator.page(after=pages[-1].next_cursor))
+        self.assertEqual([call.id for page in pages for call in page], expected)
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        back = paginator.page(before=pages[-1].previous_cursor)
+        self.assertEqual([call.id for call in back], expected[3:6])
+        self.assertTrue(back.has_previous)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='10000', phone_number='10000')
+        self.created_at = timezone.now().replace(microsecond=0)
+
+    def write(self, session_id, transcript):
+        CallWriter(create_users=False).write([dict(call_record(session_id, self.created_at), transcript=transcript)])
+
+    def dashboard(self, **params):
+        self.client.force_login(self.user)
+        return self.client.get(reverse('dashboard'), params, HTTP_HOST='localhost')
+
+    def test_dashboard_takes_web_search_syntax(self):
+        self.write('5001', 'The customer asked for a refund on the invoice')
+        self.write('5002', 'The customer asked about a refund and was transferred')
+        self.write('5003', 'Billing question about the invoice')
+        response = self.dashboard(q='"asked for a refund" -transferred')
+        self.assertEqual([call.session_id for call in response.context['calls']], ['5001'])
+        self.assertIn('<mark>refund</mark>', response.context['calls'][0].snippet)
+        response = self.dashboard(q='refund or billing')
+        self.assertEqual({call.session_id for call in response.context['calls']}, {'5001', '5002', '5003'})
+
+    def test_search_vector_follows_the_upserted_transcript(self):
+        self.write('5001', 'The caller wanted a refund')
+        self.write('5001', 'The caller reported an outage')
+        matches = Call.objects.filter(search_vector=transcript_query('outage'))
+        self.assertEqual(list(matches.values_list('session_id', flat=True)), ['5001'])
+        self.assertFalse(Call.objects.filter(search_vector=transcript_query('refund')).exists())
+
+    def test_admin_search_matches_ids_or_transcripts(self):
+        self.write('5001', 'Nothing to see here')
+        self.write('5002', 'Please call back about ticket 5001')
+        self.write('5003', 'Unrelated conversation')
+        self.client.force_login(User.objects.create_superuser(username='admin', phone_number='1', password='x'))
+        response = self.client.get(reverse('admin:calls_call_changelist'), {'q': '5001'}, HTTP_HOST='localhost')
+        self.assertEqual({call.session_id for call in response.context['cl'].result_list}, {'5001', '5002'})
+
+
+class DashboardFacetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='10000', phone_number='10000')
+        created_at = timezone.now().replace(microsecond=0)
+        CallWriter(create_users=False).write([
+            dict(call_record(str(i), created_at), reasons=[reason]) for i, reason in enumerate(['billing', 'outage'])])
+        self.client.force_login(self.user)
+
+    def test_facet_links_keep_the_other_filters(self):
+        response = self.client.get(reverse('dashboard'), {
+            'q': 'refund', 'reason': 'billing', 'min_duration': '5', 'max_duration': '60', 'after': 'cursor',
+        }, HTTP_HOST='localhost')
+        links = {facet['reason']: parse_qs(facet['query']) for facet in response.context['reason_facets']}
+        filters = {'q': ['refund'], 'min_duration': ['5.0'], 'max_duration': ['60.0']}
+        # The selected reason's link clears it; the others switch to theirs
+        self.assertEqual(links, {'billing': filters, 'outage': dict(filters, reason=['outage'])})
+        self.assertContains(response, 'href="?q=refund&amp;min_duration=5.0&amp;max_duration=60.0&amp;reason=outage"')
+
+
+class ExportTests(TempDirMixin, TestCase):
+    def test_export_is_a_valid_zip(self):
+        User.objects.create(username='10000', phone_number='10000')
+        created_at = timezone.now()
+        records = [call_record(session_id, created_at) for session_id in ('1', '2', '3')]
+        records[0]['txt_filename'] = '10000_1_full.txt'
+        CallWriter(create_users=False).write(records)
+        os.mkdir(os.path.join(self.tmp, '10000'))
+        wav = wav_bytes(synth_pcm(3, 8000, random.Random(3)), 8000)
+        self.write('10000/10000_1_full.wav', wav)
+        self.write('10000/10000_1_full.txt', b'CALLER: 10000\n')
+        # Call 2 is on the cold tier, call 3's recording is gone
+        write_archive(self.write('10000/10000_2_full.wav', wav), os.path.join(self.tmp, 'cold', '10000_2.pbxz'))
+        Call.objects.filter(session_id='2').update(storage_tier='cold', archive_filename='10000_2.pbxz')
+
+        with override_settings(COLD_RECORDINGS_ROOT=os.path.join(self.tmp, 'cold')):
+            data = b''.join(iter_export_zip(Call.objects.order_by('session_id'), self.tmp, chunk_size=1000))
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), [
+                '10000/1/10000_1_full.wav', '10000/1/10000_1_full.txt', '10000/2/10000_2_full.wav'])
+            self.assertEqual(archive.read('10000/1/10000_1_full.txt'), b'CALLER: 10000\n')
+            self.assertEqual(archive.read('10000/2/10000_2_full.wav'), wav)
+
+
+class WaitMixin:
+    def wait_for(self, condition, timeout=10):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("timed out")
+            time.sleep(0.05)
+
+
+class PartitionLeaseTests(WaitMixin, SimpleTestCase):
+    # Leases hold session advisory locks on connections of their own
+    databases = {'default'}
+
+    def leases(self):
+        leases = PartitionLeases(8, interval=0.05)
+        leases.start()
+        self.addCleanup(leases.stop)
+        return leases
+
+    def test_caller_partition_is_stable(self):
+        self.assertEqual(caller_partition('10000', 8), caller_partition('10000', 8))
+        self.assertEqual({caller_partition(str(caller), 8) for caller in range(10000, 10100)}, set(range(8)))
+
+    def test_replicas_split_the_partitions_and_take_over(self):
+        first = self.leases()
+        self.wait_for(lambda: len(first.owned) == 8)
+        self.assertEqual(first.take_acquired(), set(range(8)))
+        second = self.leases()
+        self.wait_for(lambda: len(first.owned) == 4 and len(second.owned) == 4)
+        self.assertFalse(first.owned & second.owned)
+        self.assertNotEqual(first.owns('10000'), second.owns('10000'))
+
+        released = set(second.owned)
+        second.stop()
+        self.wait_for(lambda: len(first.owned) == 8)
+        # Queued for a catch-up scan
+        self.assertEqual(first.take_acquired(), released)
+
+
+class WriterStageTests(TempDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        User.objects.create(username='10000', phone_number='10000')
+        self.journal = IngestJournal(self.tmp)
+        self.stage = WriterStage(queue.Queue(), io.StringIO(), no_style(), journal=self.journal)
+        self.stage.analysis_pool = concurrent.futures.ThreadPoolExecutor(1)
+        self.addCleanup(self.stage.analysis_pool.shutdown)
+
+    def test_bad_record_does_not_fail_its_batch(self):
+        rng = random.Random(1)
+        clips = make_clips(8000, 1, 1, rng, count=1)
+        # The last session id is longer than Call.session_id allows
+        sessions = ['1', '2', '3', 'x' * 101, '4']
+        paths = [write_call(self.tmp, '10000', session_id, timezone.now(), clips, rng) for session_id in sessions]
+        self.journal.append(paths)
+        self.stage._write(paths)
+        self.assertEqual(sorted(Call.objects.values_list('session_id', flat=True)), ['1', '2', '3', '4'])
+        self.assertIn(f'Error writing {paths[3]}', self.stage.stdout.getvalue())
+        # Written off rather than replayed on every restart
+        self.assertFalse(IngestJournalEntry.objects.filter(done_at__isnull=True).exists())
+
+    def test_late_conversation_is_linked(self):
+        rng = random.Random(1)
+        clips = make_clips(8000, 1, 1, rng, count=1)
+        wav_path = write_call(self.tmp, '10000', '1', timezone.now(), clips, rng)
+        conversation = os.path.join(self.tmp, '10000_1', 'full_conversation.wav')
+        os.rename(conversation, conversation + '.part')
+        self.stage._write([wav_path])
+        self.assertEqual(list(Call.objects.values_list('full_conversation_filename', flat=True)), [None])
+        # The call ends after its recording was ingested
+        os.rename(conversation + '.part', conversation)
+        self.stage._write([conversation])
+        call = Call.objects.get()
+        self.assertEqual(call.full_conversation_filename, '../10000_1/full_conversation.wav')
+        self.assertIsNotNone(call.conversation_duration)
+
+
+class WriterRetryTests(TempDirMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        User.objects.create(username='10000', phone_number='10000')
+        self.journal = IngestJournal(self.tmp)
+        self.stage = WriterStage(queue.Queue(), io.StringIO(), no_style(), journal=self.journal)
+        self.stage.analysis_pool = concurrent.futures.ThreadPoolExecutor(1)
+        self.addCleanup(self.stage.analysis_pool.shutdown)
+        self.stage.stopping = mock.Mock(**{'wait.return_value': False})
+
+    def test_lost_connection_is_waited_out_and_the_batch_written(self):
+        rng = random.Random(1)
+        clips = make_clips(8000, 1, 1, rng, count=1)
+        paths = [write_call(self.tmp, '10000', session_id, timezone.now(), clips, rng) for session_id in '12']
+        self.journal.append(paths)
+        writes = []
+        write = CallWriter.write
+
+        def drop_connection_once(writer, records):
+            writes.append(len(records))
+            if len(writes) == 1:
+                # The server goes away mid-batch
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_terminate_backend(pg_backend_pid())')
+            return write(writer, records)
+
+        ensure_connection = connection.ensure_connection
+
+        def reconnect():
+            # ... and stays down until the writer has backed off twice
+            if connection.connection is None and self.stage.stopping.wait.call_count < 2:
+                raise db.OperationalError('connection refused')
+            ensure_connection()
+
+        with mock.patch.object(CallWriter, 'write', drop_connection_once), \
+                mock.patch.object(connection, 'ensure_connection', reconnect):
+            self.stage._store(paths)
+        self.assertIn('Lost the database connection', self.stage.stdout.getvalue())
+        self.assertEqual(self.stage.stopping.wait.call_args_list, [mock.call(1), mock.call(2)])
+        # The whole batch again, not split up as for a bad record
+        self.assertEqual(writes, [2, 2])
+        self.assertEqual(sorted(Call.objects.values_list('session_id', flat=True)), ['1', '2'])
+        self.assertFalse(IngestJournalEntry.objects.filter(done_at__isnull=True).exists())
+
+
+class RecordingPipeline:
+    # Stands in for IngestPipeline: what catch_up and the handlers submit, and what is marked caught up
+    def __init__(self):
+        self.submitted = []
+        self.closed = []
+        self.caught_up = set()
+        self.settle = self
+
+    def submit(self, path, closed=False):
+        (self.closed if closed else self.submitted).append(path)
+
+    def submit_conversation(self, session_dir):
+        self.submitted.append(os.path.join(session_dir, 'full_conversation.wav'))
+
+    def mark_caught_up(self, names):
+        self.caught_up |= set(names)
+
+
+class JournalTests(TempDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.journal = IngestJournal(self.tmp)
+        self.paths = [os.path.join(self.tmp, '10000', f'10000_{i}_full.wav') for i in range(3)]
+
+    def catch_up(self, full_scan=False):
+        command = WatchCommand(stdout=io.StringIO())
+        scans = []
+        command.scan = lambda path, caller_ids, users, options, since=None: scans.append(since)
+        pipeline = RecordingPipeline()
+        command.catch_up(self.tmp, [ALL], ['10000'], pipeline, self.journal, None, {'full_scan': full_scan})
+        return pipeline, scans
+
+    def test_pending_entries_are_replayed(self):
+        self.journal.append(self.paths)
+        self.journal.complete(self.paths[:1], timezone.now())
+        pipeline, scans = self.catch_up()
+        self.assertEqual(sorted(pipeline.submitted), self.paths[1:])
+        self.assertEqual(pipeline.caught_up, {ALL})
+        # No checkpoint yet: everything is scanned
+        self.assertEqual(scans, [None])
+
+    def test_seen_again_after_collection_stays_pending(self):
+        collected_at = timezone.now()
+        self.journal.append(self.paths)
+        self.journal.complete(self.paths, collected_at)
+        self.assertEqual(sorted(self.journal.pending()), self.paths)
+
+    def test_scan_starts_at_the_checkpoint_unless_full_scan(self):
+        position = timezone.now() - datetime.timedelta(hours=1)
+        self.journal.advance([ALL], position)
+        self.assertEqual(self.catch_up()[1], [position])
+        self.assertEqual(self.catch_up(full_scan=True)[1], [None])
+
+
+class FailingJournal(IngestJournal):
+    def append(self, wav_paths):
+        raise RuntimeError("journal unavailable")
+
+
+class CheckpointTests(TempDirMixin, TransactionTestCase):
+    # A journal failure closes the connection, as it would in the settle thread
+    def settle(self, journal, owned):
+        return SettleStage(queue.Queue(), queue.Queue(), journal=journal, checkpoints=lambda: owned)
+
+    def positions(self):
+        return dict(IngestCheckpoint.objects.values_list('name', 'position'))
+
+    def test_checkpoint_waits_for_the_catch_up_scan(self):
+        stage = self.settle(IngestJournal(self.tmp), {'p0', 'p1'})
+        cycle_start = timezone.now()
+        stage.mark_caught_up({'p0'})
+        stage._journal(cycle_start, {'p0', 'p1'})
+        self.assertEqual(self.positions(), {'p0': cycle_start - CHECKPOINT_SLACK})
+
+    def test_checkpoint_skips_partitions_handed_off_during_the_cycle(self):
+        owned = {'p0', 'p1'}
+        stage = self.settle(IngestJournal(self.tmp), owned)
+        stage.mark_caught_up({'p0', 'p1', 'p2'})
+        cycle_start = timezone.now()
+        # p1 was lost and p2 claimed after the cycle started
+        owned.clear()
+        owned.update({'p0', 'p2'})
+        stage._journal(cycle_start, {'p0', 'p1'})
+        self.assertEqual(set(self.positions()), {'p0'})
+        # p1 is no longer caught up: owning it again needs a new catch-up scan first
+        owned.add('p1')
+        stage.next_checkpoint = 0
+        stage._journal(timezone.now(), set(owned))
+        self.assertEqual(set(self.positions()), {'p0', 'p2'})
+
+    def test_checkpoint_does_not_pass_unjournaled_recordings(self):
+        stage = self.settle(FailingJournal(self.tmp), {ALL})
+        stage.mark_caught_up({ALL})
+        stage.unjournaled = [os.path.join(self.tmp, '10000', '10000_1_full.wav')]
+        stage._journal(timezone.now(), {ALL})
+        self.assertEqual(self.positions(), {})
+        self.assertEqual(len(stage.unjournaled), 1)
+
+
+class RegisteredUsersTests(WaitMixin, TransactionTestCase):
+    def listening(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1 FROM pg_stat_activity WHERE query = %s', [f'LISTEN {USERS_CHANNEL}'])
+            return cursor.fetchone() is not None
+
+    def test_user_changes_reach_the_cache(self):
+        users = RegisteredUsers()
+        users.start()
+        self.addCleanup(users.stop)
+        self.wait_for(self.listening)
+        # The listener marks the map stale once it is listening; let that pass, then load it
+        time.sleep(0.2)
+        self.assertNotIn('10000', users)
+        self.assertFalse(users.stale)
+        # Committed, as signup or the admin would; only the notification can mark the map stale
+        user = User.objects.create(username='10000', phone_number='10000')
+        self.wait_for(lambda: users.stale)
+        self.assertIn('10000', users)
+        user.delete()
+        self.wait_for(lambda: users.stale)
+        self.assertNotIn('10000', users)
+
+    def test_writer_drops_unregistered_callers(self):
+        User.objects.create(username='10000', phone_number='10000')
+        users = RegisteredUsers()
+        stage = WriterStage(queue.Queue(), io.StringIO(), no_style(), users=users)
+        stage.analysis_pool = concurrent.futures.ThreadPoolExecutor(1)
+        self.addCleanup(stage.analysis_pool.shutdown)
+        with tempfile.TemporaryDirectory() as tmp:
+            rng = random.Random(1)
+            clips = make_clips(8000, 1, 1, rng, count=1)
+            stage._write([write_call(tmp, caller_id, '1' + caller_id, timezone.now(), clips, rng)
+                          for caller_id in ('10000', '20000')])
+        self.assertEqual(list(Call.objects.values_list('caller_id', flat=True)), ['10000'])
+        self.assertIn('Ignored file from 20000: User not registered.', stage.stdout.getvalue())
+
+
+class FailingWriter:
+    def add(self, record, entries=()):
+        raise RuntimeError("write failed")
+
+    def flush(self):
+        pass
+
+
+class ScannerTests(TempDirMixin, SimpleTestCase):
+    def test_failed_write_stops_the_producer(self):
+        rng = random.Random(2)
+        clips = make_clips(8000, 1, 1, rng, count=1)
+        for caller in range(8):
+            write_call(self.tmp, str(10000 + caller), str(caller), timezone.now(), clips, rng)
+        scanner = Scanner(os.path.join(self.tmp, 'call_sessions'), workers=1, queue_size=1)
+        with self.assertRaises(RuntimeError):
+            scanner.run(FailingWriter())
+        self.assertNotIn('scan-producer', [thread.name for thread in threading.enumerate()])
+
+
+class SettleStageTests(TempDirMixin, SimpleTestCase):
+    def test_only_the_wav_close_releases_a_recording(self):
+        wav_path = self.write('10000_1_full.wav', wav_bytes(b'\x00\x00' * 800, 8000))
+        txt_path = self.write('10000_1_full.txt', b'TRANSFER_REASONS: billing\n')
+        events, ready = queue.Queue(), queue.Queue()
+        settle = SettleStage(events, ready, settle_time=30, tick=0.05)
+        settle.start()
+        self.addCleanup(settle.join)
+        self.addCleanup(settle.stop)
+
+        events.put((txt_path, True))
+        with self.assertRaises(queue.Empty):
+            ready.get(timeout=0.5)
+        events.put((wav_path, True))
+        self.assertEqual(ready.get(timeout=5), wav_path)
+
+    @mock.patch('calls.pipeline.CONVERSATION_WAIT', 0.1)
+    def test_conversation_closed_after_the_wait_is_released(self):
+        conversation = os.path.join(self.tmp, '10000_1', 'full_conversation.wav')
+        events, ready = queue.Queue(), queue.Queue()
+        settle = SettleStage(events, ready, tick=0.05)
+        settle.start()
+        self.addCleanup(settle.join)
+        self.addCleanup(settle.stop)
+
+        events.put((conversation, False))
+        # Polled for longer than CONVERSATION_WAIT without the recording appearing
+        time.sleep(0.5)
+        self.assertEqual(settle.conversations, {})
+        os.mkdir(os.path.dirname(conversation))
+        self.write(conversation, wav_bytes(b'\x00\x00' * 800, 8000))
+        events.put((conversation, True))
+        # Well before CONVERSATION_SETTLE: the close event completes it
+        self.assertEqual(ready.get(timeout=2), conversation)
+
+
+class ConversationHandlerTests(WaitMixin, TempDirMixin, SimpleTestCase):
+    def test_recording_closed_in_a_new_folder_is_submitted(self):
+        pipeline = RecordingPipeline()
+        observer = Observer()
+        handler = ConversationHandler(pipeline, self.tmp, observer=observer)
+        observer.schedule(handler, self.tmp, recursive=False)
+        observer.start()
+        self.addCleanup(observer.join)
+        self.addCleanup(observer.stop)
+
+        session_dir = os.path.join(self.tmp, '10000_1')
+        os.mkdir(session_dir)
+        self.wait_for(lambda: session_dir in handler.watches)
+        conversation = self.write('10000_1/full_conversation.wav', wav_bytes(b'\x00\x00' * 800, 8000))
+        self.wait_for(lambda: pipeline.closed)
+        self.assertEqual(pipeline.submitted, [conversation])
+        self.assertEqual(pipeline.closed, [conversation])
+        self.assertEqual(handler.watches, {})
+
+
+class TranscriptTests(TempDirMixin, SimpleTestCase):
+    def test_header_stops_at_the_blank_line(self):
+        f = io.BytesIO(b'CALLER: 10000\nTRANSFER_REASONS: billing \n\n[00:00:01] Agent: Hi\n')
+        fields, raw = read_header(f)
+        self.assertEqual(fields, {'CALLER': '10000', 'TRANSFER_REASONS': 'billing'})
+        self.assertEqual(raw, b'CALLER: 10000\nTRANSFER_REASONS: billing \n\n')
+        self.assertEqual(f.read(), b'[00:00:01] Agent: Hi\n')
+
+    def test_header_stops_at_the_first_turn(self):
+        f = io.BytesIO(b'CALLER: 10000\n[00:00:01] Agent: Hi\n')
+        self.assertEqual(read_header(f)[0], {'CALLER': '10000'})
+        self.assertEqual(f.read(), b'[00:00:01] Agent: Hi\n')
+
+    def test_segments_are_paged(self):
+        path = self.write('a.txt', (
+            'CALLER: 10000\n\n'
+            '[00:00:01] Agent: Hello\n'
+            '[00:00:03] Caller: My invoice\nis wrong\n'
+            '[01:00:05] Agent: Let me check\n').encode())
+        index = segment_index(path)
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.read(path, 1, 5), [
+            {'time': '00:00:03', 'seconds': 3, 'speaker': 'Caller', 'text': 'My invoice\nis wrong'},
+            {'time': '01:00:05', 'seconds': 3605, 'speaker': 'Agent', 'text': 'Let me check'},
+        ])
+        self.assertEqual(index.read(path, 3, 5), [])
+
+    def test_transfer_reasons_after_the_turns_are_found(self):
+        text = (
+            'CALLER_ID: 10000\n\n'
+            '[00:00:01] Agent: Hello\n'
+            'TRANSFER_REASONS: Billing, technical\n'
+            'TRANSFER_REASON_DESCRIPTIONS: Invoice question\n'
+        )
+        self.assertEqual(transfer_fields(text), ('Billing, technical', 'Invoice question'))
+
+    def test_last_transfer_reasons_line_wins(self):
+        text = 'TRANSFER_REASONS: billing\n\n[00:00:01] Agent: Hi\nTRANSFER_REASONS: refund\n'
+        self.assertEqual(transfer_fields(text), ('refund', ''))
+
+    def test_transfer_reasons_are_normalized(self):
+        self.assertEqual(split_transfer_reasons(' Billing ,technical,  billing,, Wrong   Number'),
+                         ['billing', 'technical', 'wrong number'])
+        self.assertEqual(split_transfer_reasons(''), [])
+        self.assertEqual(split_transfer_reasons(None), [])
+
+    def test_index_cache_is_bounded_by_size(self):
+        def index(turns):
+            built = TranscriptIndex()
+            for i in range(turns):
+                built.add(i * 10, i, 'Agent')
+            return built
+        cache = IndexCache(max_bytes=index(100).nbytes() * 2)
+        for key in ('a', 'b', 'c'):
+            cache.get(key, lambda: index(100))
+        self.assertEqual(list(cache.entries), ['b', 'c'])
+        self.assertLessEqual(cache.size, cache.max_bytes)
+
+
+class CallEventsTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='10000', phone_number='10000')
+
+    def write(self, session_id='5001'):
+        CallWriter(create_users=False).write([call_record(session_id, timezone.now().replace(microsecond=0))])
+        return Call.objects.get(session_id=session_id).pk
+
+    async def test_stream_pushes_committed_calls(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('call_events'), HTTP_HOST='localhost')
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'text/event-stream'))
+        events = response.streaming_content
+        self.assertEqual(await anext(events), b'retry: 3000\n\n')
+        next_event = asyncio.ensure_future(anext(events))
+        try:
+            # LISTEN starts in the background with the first subscriber: rewrite the call until it is pushed
+            for attempt in range(20):
+                pk = await sync_to_async(self.write)()
+                done, _ = await asyncio.wait({next_event}, timeout=0.5)
+                if done:
+                    break
+            self.assertTrue(next_event.done(), "no event for the committed call")
+            self.assertEqual(next_event.result(), f'event: call\ndata: {json.dumps({"ids": [pk]})}\n\n'.encode())
+        finally:
+            next_event.cancel()
+            await asyncio.gather(next_event, return_exceptions=True)
+            await events.aclose()
+            call_events.task.cancel()
+            await asyncio.gather(call_events.task, return_exceptions=True)
+
+    @mock.patch.object(CallEventsView, 'warned', True)
+    def test_polling_returns_calls_committed_since_the_cursor(self):
+        # Served without ASGI (no LISTEN): each request answers from last_updated_at
+        self.client.force_login(self.user)
+        first = self.client.get(reverse('call_events'), HTTP_HOST='localhost')
+        self.assertNotIn(b'event: call', first.content)
+        cursor = re.search(rb'^id: (\d+)$', first.content, re.M).group(1).decode()
+        pk = self.write()
+        second = self.client.get(reverse('call_events'), HTTP_HOST='localhost', HTTP_LAST_EVENT_ID=cursor)
+        self.assertIn(f'event: call\ndata: {json.dumps({"ids": [pk]})}\n\n'.encode(), second.content)
+
+
+class MetricsViewTests(SimpleTestCase):
+    def get(self, **headers):
+        return self.client.get(reverse('metrics'), HTTP_HOST='localhost', **headers).status_code
+
+    @override_settings(METRICS_TOKEN='', METRICS_PUBLIC=False)
+    def test_closed_without_a_token(self):
+        self.assertEqual(self.get(), 403)
+
+    @override_settings(METRICS_TOKEN='', METRICS_PUBLIC=True)
+    def test_public_when_configured(self):
+        self.assertEqual(self.get(), 200)
+
+    @override_settings(METRICS_TOKEN='secret', METRICS_PUBLIC=True)
+    def test_token_is_required_when_set(self):
+        self.assertEqual(self.get(), 401)
+        self.assertEqual(self.get(HTTP_AUTHORIZATION='Bearer secret'), 200)
+
+
+class CallAdminTests(TestCase):
+    def setUp(self):
+        admin_user = User.objects.create_superuser(username='admin', phone_number='1', password='x')
+        self.client.force_login(admin_user)
+        User.objects.create(username='10000', phone_number='10000')
+        months = [timezone.make_aware(datetime.datetime(2026, month, 15)) for month in (8, 10)]
+        CallWriter(create_users=False).write([call_record(str(i), created_at) for i, created_at in enumerate(months)])
+
+    def changelist(self, **params):
+        return self.client.get(reverse('admin:calls_call_changelist'), params, HTTP_HOST='localhost')
+
+    def test_month_filter_without_a_date_scan(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.changelist()
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in queries if 'DISTINCT' in query['sql']])
+        months = [choice['display'] for choice in response.context['cl'].filter_specs[1].choices(response.context['cl'])]
+        self.assertEqual(months, ['All', 'October 2026', 'September 2026', 'August 2026'])
+        response = self.changelist(month='2026-10')
+        self.assertEqual([call.session_id for call in response.context['cl'].result_list], ['1'])
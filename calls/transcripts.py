@@ -0,0 +1,178 @@
+"""
+Transcript files: the `KEY: value` header written by the PBX, then one turn per
+line as `[HH:MM:SS] Speaker: text` (continuation lines belong to the turn above).
+
+Ingest takes the transfer reasons from `TRANSFER_REASONS:` lines anywhere in
+the file (transfer_fields), as the PBX may write them after the turns. The
+transcript endpoint pages through the body using an index of turn byte
+offsets (segment_index), cached per file version, so a page is one seek and
+one read whatever the file size.
+"""
+import os
+import re
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+
+# The header ends at its first blank line (or at the first turn, if there is none)
+HEADER_RE = re.compile(rb'^([A-Z_]+):\s*(.*?)\s*$')
+SEGMENT_RE = re.compile(rb'^\[(\d+):(\d{2}):(\d{2})\]\s*([^:\]]{1,50}):[ \t]?')
+
+# Lines anywhere in the transcript; the last of each wins
+TRANSFER_FIELDS_RE = re.compile(r'^(TRANSFER_REASONS|TRANSFER_REASON_DESCRIPTIONS):(.*)$', re.MULTILINE)
+
+# Approximate memory for the parsed transcripts kept per process
+SEGMENT_CACHE_BYTES = 32 * 1024 * 1024
+
+
+def transfer_fields(text):
+    """
+    (transfer reasons, transfer reason descriptions) from the `TRANSFER_REASONS:`
+    and `TRANSFER_REASON_DESCRIPTIONS:` lines of a decoded transcript, '' if absent.
+    """
+    fields = {}
+    for match in TRANSFER_FIELDS_RE.finditer(text):
+        fields[match.group(1)] = match.group(2).strip()
+    return fields.get('TRANSFER_REASONS', ''), fields.get('TRANSFER_REASON_DESCRIPTIONS', '')
+
+
+def read_header(f):
+    """
+    Read the header from the binary file `f`, leaving it positioned at the body.
+    Returns (fields, raw header bytes).
+    """
+    fields = {}
+    lines = []
+    while True:
+        start = f.tell()
+        line = f.readline()
+        if not line:
+            break
+        if SEGMENT_RE.match(line):
+            f.seek(start)
+            break
+        lines.append(line)
+        if not line.strip():
+            break
+        match = HEADER_RE.match(line)
+        if match:
+            fields[match.group(1).decode('ascii')] = match.group(2).decode('utf-8', errors='ignore')
+    return fields, b''.join(lines)
+
+
+class TranscriptIndex:
+    """
+    Byte offset, time and speaker of each turn, in compact arrays (a few dozen
+    bytes per turn): a turn runs from its offset to the next turn's, the last
+    one to the end of the file.
+    """
+    __slots__ = ('starts', 'seconds', 'speakers', 'end')
+
+    def __init__(self):
+        self.starts = array('q')
+        self.seconds = array('l')  # -1: no timestamp
+        self.speakers = []
+        self.end = 0
+
+    def __len__(self):
+        return len(self.starts)
+
+    def nbytes(self):
+        # The arrays plus one list slot per turn (the speaker strings are shared)
+        return (self.starts.itemsize + self.seconds.itemsize + 8) * len(self) + 200
+
+    def add(self, start, seconds, speaker):
+        self.starts.append(start)
+        self.seconds.append(seconds)
+        # Shared string objects: a transcript has a handful of speakers
+        self.speakers.append(sys.intern(speaker))
+
+    def read(self, path, offset, limit):
+        """
+        Turns [offset, offset + limit) of the transcript at `path`, with one seek and one read.
+        """
+        stop = min(offset + limit, len(self))
+        if offset >= stop:
+            return []
+        end = self.starts[stop] if stop < len(self) else self.end
+        with open(path, 'rb') as f:
+            f.seek(self.starts[offset])
+            data = f.read(end - self.starts[offset])
+
+        base = self.starts[offset]
+        segments = []
+        for i in range(offset, stop):
+            raw = data[self.starts[i] - base:(self.starts[i + 1] if i + 1 < stop else end) - base]
+            match = SEGMENT_RE.match(raw)
+            if match:
+                raw = raw[match.end():]
+            seconds = self.seconds[i] if self.seconds[i] >= 0 else None
+            segments.append({
+                'time': format_seconds(seconds) if seconds is not None else None,
+                'seconds': seconds,
+                'speaker': self.speakers[i],
+                'text': raw.decode('utf-8', errors='ignore').strip(),
+            })
+        return segments
+
+
+def format_seconds(seconds):
+    return f'{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+
+
+class IndexCache:
+    """
+    Least recently used TranscriptIndexes by (path, size, mtime_ns), evicted
+    once together they exceed `max_bytes`: a rewritten transcript is a new key.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, build):
+        with self.lock:
+            index = self.entries.get(key)
+            if index is not None:
+                self.entries.move_to_end(key)
+                return index
+        # Built outside the lock; a concurrent miss on the same key parses it twice
+        index = build()
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = index
+                self.size += index.nbytes()
+            while self.size > self.max_bytes and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.nbytes()
+        return index
+
+
+_index_cache = IndexCache(SEGMENT_CACHE_BYTES)
+
+
+def _build_index(path):
+    index = TranscriptIndex()
+    with open(path, 'rb') as f:
+        read_header(f)
+        offset = f.tell()
+        for line in f:
+            match = SEGMENT_RE.match(line)
+            if match:
+                hours, minutes, seconds = (int(group) for group in match.group(1, 2, 3))
+                speaker = match.group(4).decode('utf-8', errors='ignore').strip()
+                index.add(offset, hours * 3600 + minutes * 60 + seconds, speaker)
+            elif not len(index) and line.strip():
+                # Text before the first turn
+                index.add(offset, -1, '')
+            offset += len(line)
+        index.end = offset
+    return index
+
+
+def segment_index(path):
+    st = os.stat(path)
+    return _index_cache.get((path, st.st_size, st.st_mtime_ns), lambda: _build_index(path))
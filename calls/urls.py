@@ -7,5 +7,12 @@ urlpatterns = [
     path('login/', views.CustomLoginView.as_view(), name='login'),
     path('logout/', LogoutView.as_view(), name='logout'),
     path('', views.DashboardView.as_view(), name='dashboard'),
+    path('stats/', views.StatsView.as_view(), name='call_stats'),
+    path('export/', views.ExportView.as_view(), name='export_calls'),
+    path('events/', views.CallEventsView.as_view(), name='call_events'),
+    path('rows/', views.CallRowsView.as_view(), name='call_rows'),
+    path('metrics', views.MetricsView.as_view(), name='metrics'),
     path('call/<int:pk>/play/', views.PlayAudioView.as_view(), name='play_audio'),
+    path('call/<int:pk>/waveform/', views.WaveformView.as_view(), name='waveform'),
+    path('call/<int:pk>/transcript/', views.TranscriptView.as_view(), name='call_transcript'),
 ]
@@ -1,16 +1,39 @@
 from django.shortcuts import render, redirect
+from django.template.loader import render_to_string
 from django.contrib.auth import login
 from django.views.generic import CreateView, ListView, View
-from django.contrib.auth.views import LoginView
+from django.contrib.auth.views import LoginView, redirect_to_login
 from django.urls import reverse_lazy
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponse, Http404, FileResponse
+from django.http import HttpResponse, HttpResponseBadRequest, Http404, JsonResponse, StreamingHttpResponse
 from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.dateparse import parse_date
+from prometheus_client import CONTENT_TYPE_LATEST
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag, urlencode
 import os
-import mimetypes
+import asyncio
+import datetime
+import json
+import logging
+from asgiref.sync import sync_to_async
 
+from .audio import serve_recording
+from .coldstore import archive_path
+from .metrics import render_metrics
+from .export import aiter_in_thread, export_queryset, iter_export_zip
 from .forms import CustomUserCreationForm
-from .models import Call
+from .live import call_events
+from .pagination import KeysetPaginator, estimate_count
+from .search import highlight, search_calls
+from .stats import normalize_reason, reason_counts, user_totals
+from .transcripts import segment_index
+from .models import Call, CallDailyStats, User
+
+logger = logging.getLogger(__name__)
 
 class SignupView(CreateView):
     form_class = CustomUserCreationForm
@@ -25,16 +48,102 @@ class DashboardView(LoginRequiredMixin, ListView):
     template_name = 'calls/dashboard.html'
     context_object_name = 'calls'
     paginate_by = 20
-    ordering = ['-created_at']
+    ordering = ['-created_at', '-id']
+
+    search_limit = 50
 
     def get_queryset(self):
-        # Filter calls by the logged-in user
-        return Call.objects.filter(user=self.request.user).order_by('-created_at')
+        # Filter calls by the logged-in user; waveform peaks are fetched per call by WaveformView
+        queryset = Call.objects.filter(user=self.request.user).defer('peaks', 'transcript', 'search_vector')
+        reason = self.get_reason()
+        if reason:
+            # reasons @> ARRAY[...], served by the GIN index on Call.reasons
+            queryset = queryset.filter(reasons__contains=[reason])
+        # Duration range in seconds, on the (user, duration) index
+        min_duration, max_duration = self.get_duration_range()
+        if min_duration is not None:
+            queryset = queryset.filter(duration__gte=min_duration)
+        if max_duration is not None:
+            queryset = queryset.filter(duration__lte=max_duration)
+        q = self.request.GET.get('q', '').strip()
+        if q:
+            return search_calls(queryset, q)
+        return queryset.order_by('-created_at', '-id')
 
-class PlayAudioView(LoginRequiredMixin, View):
-    def get(self, request, pk):
+    def get_reason(self):
+        return normalize_reason(self.request.GET.get('reason', ''))
+
+    def get_duration_range(self):
+        bounds = []
+        for key in ('min_duration', 'max_duration'):
+            try:
+                bounds.append(max(float(self.request.GET[key]), 0))
+            except (KeyError, ValueError):
+                bounds.append(None)
+        return bounds
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.request.GET.get('q', '').strip():
+            # Transcript search: the best `search_limit` matches by rank, with highlighted snippets
+            calls = list(queryset[:self.search_limit])
+            for call in calls:
+                call.snippet = highlight(call.headline)
+            return None, None, calls, False
+
+        # Keyset (cursor) pagination instead of OFFSET: ?after=<cursor> / ?before=<cursor>
+        paginator = KeysetPaginator(queryset, page_size)
+        page = paginator.page(after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        return paginator, page, page.object_list, page.has_next or page.has_previous
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['q'] = self.request.GET.get('q', '').strip()
+        context['reason'] = self.get_reason()
+        context['min_duration'], context['max_duration'] = self.get_duration_range()
+        # Active filters, carried over by the pagination and facet links
+        filters = {
+            key: context[key] for key in ('q', 'reason', 'min_duration', 'max_duration')
+            if context[key] not in (None, '')}
+        context['filter_query'] = urlencode(filters)
+        # Facet counts come from the CallReasonDailyStats rollup, not from the filtered calls.
+        # Each link toggles its reason and keeps the other filters (starting over at the first page)
+        context['reason_facets'] = list(reason_counts(self.request.user))
+        for facet in context['reason_facets']:
+            query = {key: value for key, value in filters.items() if key != 'reason'}
+            if facet['reason'] != context['reason']:
+                query['reason'] = facet['reason']
+            facet['query'] = urlencode(query)
+        # New calls are pushed (CallEventsView) only onto the unfiltered first page
+        context['live'] = not context['filter_query'] and not (
+            self.request.GET.get('after') or self.request.GET.get('before'))
+        # DASHBOARD_TOTAL: 'rollup' (CallDailyStats), 'estimate' (planner row estimate),
+        # 'exact' (COUNT(*)) or 'none'
+        mode = settings.DASHBOARD_TOTAL
+        context['total_estimated'] = mode == 'estimate'
+        if mode == 'rollup':
+            context['totals'] = user_totals(self.request.user)
+            context['total_calls'] = context['totals']['calls']
+        elif mode == 'estimate':
+            context['total_calls'] = estimate_count(self.object_list)
+        elif mode == 'exact':
+            context['total_calls'] = self.object_list.count()
+        return context
+
+class AsyncLoginRequiredMixin:
+    # LoginRequiredMixin for async views: request.user would hit the DB synchronously
+    async def dispatch(self, request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await super().dispatch(request, *args, **kwargs)
+
+class PlayAudioView(AsyncLoginRequiredMixin, View):
+    # Async so that, under ASGI, a listener costs an open file and a coroutine rather than a worker thread
+    async def get(self, request, pk):
         try:
-            call = Call.objects.get(pk=pk, user=request.user)
+            call = await Call.objects.only(
+                'wav_filename', 'full_conversation_filename', 'missing_at', 'storage_tier', 'archive_filename',
+            ).aget(pk=pk, user=await request.auser())
         except Call.DoesNotExist:
             raise Http404("Call not found")
 
@@ -48,27 +157,233 @@ class PlayAudioView(LoginRequiredMixin, View):
                  raise Http404("Conversation file not available")
             file_path = os.path.join(recordings_root, call.full_conversation_filename)
         else:
-            file_path = os.path.join(recordings_root, call.wav_filename)
+            if call.missing_at:
+                # reconcile_calls found the recording gone (retention)
+                raise Http404("Recording no longer available")
+            if call.storage_tier == 'cold':
+                # Compressed archive; serve_recording decompresses the requested ranges
+                file_path = archive_path(call)
+            else:
+                file_path = os.path.join(recordings_root, call.wav_filename)
             
         # Resolve any .. components to get absolute path and ensure it's safe
         file_path = os.path.abspath(file_path)
         
-        if not os.path.exists(file_path):
+        if not await sync_to_async(os.path.exists, thread_sensitive=False)(file_path):
              raise Http404("Audio file not found on server")
 
-        # Secure file serving
-        # For development, FileResponse is fine. For production, X-Sendfile / X-Accel-Redirect is better.
-        
         # Check if download requested
         download = request.GET.get('download') == 'true'
-        
-        content_type, encoding = mimetypes.guess_type(file_path)
-        content_type = content_type or 'application/octet-stream'
 
-        response = FileResponse(open(file_path, 'rb'), content_type=content_type)
-        if download:
-            response['Content-Disposition'] = f'attachment; filename="{os.path.basename(file_path)}"'
-        else:
-            response['Content-Disposition'] = f'inline; filename="{os.path.basename(file_path)}"'
-            
+        # Range / conditional requests, or X-Accel-Redirect / X-Sendfile when AUDIO_OFFLOAD is set.
+        # Under ASGI the body is read chunk by chunk off the event loop; under WSGI it stays a file iterator.
+        return await sync_to_async(serve_recording, thread_sensitive=False)(
+            request, file_path, download=download, asynchronous=isinstance(request, ASGIRequest))
+
+class ExportView(AsyncLoginRequiredMixin, View):
+    """
+    ZIP of the recordings and transcripts of the user's calls, streamed as it is built.
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD&reason=...&reason=...; staff may pass ?user= or ?caller=.
+    """
+    async def get(self, request):
+        dates = {}
+        for key in ('from', 'to'):
+            value = request.GET.get(key)
+            try:
+                dates[key] = parse_date(value) if value else None
+            except ValueError:
+                dates[key] = None
+            if value and dates[key] is None:
+                return HttpResponseBadRequest(f"Invalid '{key}' date, expected YYYY-MM-DD")
+
+        user = await request.auser()
+        caller_id = None
+        if user.is_staff:
+            caller_id = request.GET.get('caller') or None
+            phone_number = request.GET.get('user')
+            if phone_number:
+                try:
+                    user = await User.objects.aget(phone_number=phone_number)
+                except User.DoesNotExist:
+                    raise Http404("User not found")
+            elif caller_id:
+                user = None
+
+        reasons = [normalize_reason(reason) for reason in request.GET.getlist('reason') if reason.strip()]
+        calls = export_queryset(user=user, caller_id=caller_id, date_from=dates['from'], date_to=dates['to'],
+                                reasons=reasons)
+        chunks = iter_export_zip(calls, settings.RECORDINGS_ROOT, settings.AUDIO_STREAM_CHUNK_SIZE)
+        # Under ASGI the blocking zip writer runs on its own thread; under WSGI it is iterated directly
+        if isinstance(request, ASGIRequest):
+            chunks = aiter_in_thread(chunks)
+
+        label = '_'.join(str(date) for date in dates.values() if date) or 'all'
+        response = StreamingHttpResponse(chunks, content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="calls_{label}.zip"'
         return response
+
+class CallEventsView(AsyncLoginRequiredMixin, View):
+    """
+    Server-Sent Events stream of the ids of the user's new or updated calls
+    (`event: call`, `data: {"ids": [...]}`), fed by calls.live.
+
+    Under WSGI a stream would hold a worker thread for as long as the tab is
+    open, so each request instead gets the calls updated since the cursor in
+    Last-Event-ID and a `retry` of poll_ms: EventSource reconnects (polls) on
+    its own, sending back the `id` of the response.
+    """
+    keepalive = 15
+    retry_ms = 3000
+    poll_ms = 15000
+    # Rows committed a little after their last_updated_at was set are still picked up
+    poll_slack = datetime.timedelta(seconds=5)
+    max_ids = 100
+    warned = False
+
+    async def get(self, request):
+        user = await request.auser()
+        if not isinstance(request, ASGIRequest):
+            return await self.poll(request, user)
+        response = StreamingHttpResponse(self.stream(user.pk), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # nginx would otherwise hold the events back
+        return response
+
+    async def poll(self, request, user):
+        if not CallEventsView.warned:
+            CallEventsView.warned = True
+            logger.warning("Live dashboard served without ASGI: falling back to polling every %d s", self.poll_ms // 1000)
+        cursor = timezone.now()
+        events = [f'retry: {self.poll_ms}\n\n']
+        try:
+            since = datetime.datetime.fromtimestamp(int(request.headers['Last-Event-ID']) / 1000, datetime.timezone.utc)
+        except (KeyError, ValueError, OverflowError):
+            since = None
+        if since is not None:
+            calls = Call.objects.filter(user=user, last_updated_at__gt=since - self.poll_slack).order_by(
+                '-last_updated_at').values_list('pk', flat=True)[:self.max_ids]
+            ids = [pk async for pk in calls]
+            if ids:
+                events.append(f'event: call\ndata: {json.dumps({"ids": ids})}\n\n')
+        # An event with only an id still sets the cursor EventSource sends back
+        events.append(f'id: {int(cursor.timestamp() * 1000)}\n\n')
+        response = HttpResponse(''.join(events), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    async def stream(self, user_id):
+        queue = call_events.subscribe(user_id)
+        try:
+            yield f'retry: {self.retry_ms}\n\n'
+            while True:
+                try:
+                    ids = await asyncio.wait_for(queue.get(), timeout=self.keepalive)
+                except asyncio.TimeoutError:
+                    # Comment line: keeps proxies from closing an idle stream
+                    yield ': keepalive\n\n'
+                    continue
+                yield f'event: call\ndata: {json.dumps({"ids": ids})}\n\n'
+        finally:
+            call_events.unsubscribe(user_id, queue)
+
+class CallRowsView(LoginRequiredMixin, View):
+    # Rendered dashboard rows for ?id=...&id=..., for the calls pushed by CallEventsView
+    max_rows = 100
+
+    def get(self, request):
+        try:
+            ids = [int(pk) for pk in request.GET.getlist('id')[:self.max_rows]]
+        except ValueError:
+            return HttpResponseBadRequest("id must be an integer")
+        calls = Call.objects.filter(user=request.user, pk__in=ids).defer(
+            'peaks', 'transcript', 'search_vector').order_by('-created_at', '-id')
+        return HttpResponse(''.join(
+            render_to_string('calls/_call_row.html', {'call': call}, request=request) for call in calls))
+
+class WaveformView(LoginRequiredMixin, View):
+    # Packed int8 (min, max) pairs from calls.analysis, for drawing the waveform client-side
+    def get(self, request, pk):
+        try:
+            call = Call.objects.only('peaks', 'last_updated_at').get(pk=pk, user=request.user)
+        except Call.DoesNotExist:
+            raise Http404("Call not found")
+        if call.peaks is None:
+            raise Http404("Waveform not available")
+
+        etag = quote_etag(str(int(call.last_updated_at.timestamp() * 1000)))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(bytes(call.peaks), content_type='application/octet-stream')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=3600'
+        return response
+
+class TranscriptView(LoginRequiredMixin, View):
+    """
+    One page of transcript turns as JSON: ?offset=0&limit=50. Turns are read by
+    byte offset (calls.transcripts), so only the requested page is loaded.
+    """
+    page_size = 50
+    max_page_size = 500
+
+    def get(self, request, pk):
+        try:
+            call = Call.objects.only('wav_filename', 'txt_filename').get(pk=pk, user=request.user)
+        except Call.DoesNotExist:
+            raise Http404("Call not found")
+        if not call.txt_filename:
+            raise Http404("Transcript not available")
+        try:
+            offset = max(int(request.GET.get('offset', 0)), 0)
+            limit = min(max(int(request.GET.get('limit', self.page_size)), 1), self.max_page_size)
+        except ValueError:
+            return HttpResponseBadRequest("offset and limit must be integers")
+
+        recordings_root = getattr(settings, 'RECORDINGS_ROOT', '/usr/local/share/asterisk/sounds/call_sessions')
+        path = os.path.join(recordings_root, os.path.dirname(call.wav_filename), call.txt_filename)
+        try:
+            index = segment_index(path)
+            segments = index.read(path, offset, limit)
+        except FileNotFoundError:
+            raise Http404("Transcript file not found on server")
+
+        next_offset = offset + len(segments)
+        return JsonResponse({
+            'total': len(index),
+            'offset': offset,
+            'segments': segments,
+            'next_offset': next_offset if next_offset < len(index) else None,
+        })
+
+class StatsView(LoginRequiredMixin, View):
+    # Summary panels; reads only the CallDailyStats / CallReasonDailyStats rollups
+    def get(self, request):
+        try:
+            days = min(max(int(request.GET.get('days', 30)), 1), 366)
+        except ValueError:
+            days = 30
+        since = timezone.localdate() - datetime.timedelta(days=days - 1)
+
+        daily = CallDailyStats.objects.filter(user=request.user, day__gte=since).order_by('day')
+        reasons = reason_counts(request.user, since=since)
+        return JsonResponse({
+            'totals': user_totals(request.user),
+            'daily': [
+                {'day': row.day.isoformat(), 'calls': row.call_count, 'wav_bytes': row.wav_bytes,
+                 'talk_time': row.talk_time}
+                for row in daily
+            ],
+            'reasons': list(reasons),
+        })
+
+class MetricsView(View):
+    # Prometheus scrape endpoint (see calls.metrics)
+    def get(self, request):
+        token = settings.METRICS_TOKEN
+        if token:
+            if not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+                return HttpResponse(status=401)
+        elif not settings.METRICS_PUBLIC:
+            # Closed unless configured: request paths and counts are not for anonymous visitors
+            return HttpResponse(status=403)
+        return HttpResponse(render_metrics(), content_type=CONTENT_TYPE_LATEST)
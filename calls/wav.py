@@ -0,0 +1,128 @@
+import os
+import struct
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_ALAW = 0x0006
+WAVE_FORMAT_MULAW = 0x0007
+WAVE_FORMAT_ADPCM = 0x0002
+WAVE_FORMAT_IMA_ADPCM = 0x0011
+WAVE_FORMAT_GSM610 = 0x0031
+WAVE_FORMAT_G722 = 0x028F
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Call fields filled from the header by wav_metadata()
+WAV_FIELDS = ('duration', 'sample_rate', 'channels', 'codec')
+
+# One block_align-sized frame per sample; other (compressed) formats are timed by byte_rate
+UNCOMPRESSED_FORMATS = (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_ALAW, WAVE_FORMAT_MULAW)
+
+# Codec names as ffmpeg reports them; PCM is keyed by (format, bits per sample)
+CODEC_NAMES = {
+    (WAVE_FORMAT_PCM, 8): 'pcm_u8',
+    (WAVE_FORMAT_PCM, 16): 'pcm_s16le',
+    (WAVE_FORMAT_PCM, 24): 'pcm_s24le',
+    (WAVE_FORMAT_PCM, 32): 'pcm_s32le',
+    (WAVE_FORMAT_IEEE_FLOAT, 32): 'pcm_f32le',
+    (WAVE_FORMAT_IEEE_FLOAT, 64): 'pcm_f64le',
+    WAVE_FORMAT_ALAW: 'pcm_alaw',
+    WAVE_FORMAT_MULAW: 'pcm_mulaw',
+    WAVE_FORMAT_ADPCM: 'adpcm_ms',
+    WAVE_FORMAT_IMA_ADPCM: 'adpcm_ima_wav',
+    WAVE_FORMAT_GSM610: 'gsm_ms',
+    WAVE_FORMAT_G722: 'adpcm_g722',
+}
+
+
+def read_wav_header(f):
+    """
+    Walk the RIFF chunks of an open WAV file up to the `data` chunk, seeking over
+    everything else, so only header bytes are read.
+
+    Returns a dict with format_tag, channels, sample_rate, byte_rate,
+    bits_per_sample, block_align, data_offset and data_size. Raises ValueError if this is not a WAV
+    or its format can't describe any audio (no sample rate, channels or frame size).
+    """
+    riff = f.read(12)
+    if len(riff) < 12 or riff[:4] not in (b'RIFF', b'RF64') or riff[8:12] != b'WAVE':
+        raise ValueError("Not a RIFF/WAVE file")
+
+    header = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            break
+        chunk_id = chunk[:4]
+        chunk_size = struct.unpack('<I', chunk[4:])[0]
+
+        if chunk_id == b'fmt ':
+            fmt = f.read(chunk_size)
+            if len(fmt) < 16:
+                raise ValueError("Truncated fmt chunk")
+            format_tag, channels, sample_rate, byte_rate, block_align, bits = struct.unpack('<HHIIHH', fmt[:16])
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+                # The real format is the first two bytes of the SubFormat GUID
+                format_tag = struct.unpack('<H', fmt[24:26])[0]
+            # Nothing downstream can time or frame samples without these
+            if sample_rate == 0 or channels == 0:
+                raise ValueError(f"Invalid fmt chunk ({sample_rate} Hz, {channels} channels)")
+            if block_align == 0 and bits == 0:
+                raise ValueError("Invalid fmt chunk (zero-sized sample frames)")
+            header = {
+                'format_tag': format_tag,
+                'channels': channels,
+                'sample_rate': sample_rate,
+                'byte_rate': byte_rate,
+                'bits_per_sample': bits,
+                'block_align': block_align,
+            }
+            if chunk_size & 1:
+                f.seek(1, os.SEEK_CUR)
+        elif chunk_id == b'data':
+            if header is None:
+                raise ValueError("data chunk before fmt chunk")
+            data_offset = f.tell()
+            # By seeking: archives (calls.coldstore.ArchiveReader) have no fileno()
+            file_size = f.seek(0, os.SEEK_END)
+            # Recordings still being written (or RF64) carry a placeholder size
+            if chunk_size in (0, 0xFFFFFFFF) or data_offset + chunk_size > file_size:
+                chunk_size = file_size - data_offset
+            header['data_offset'] = data_offset
+            header['data_size'] = chunk_size
+            return header
+        else:
+            f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+    raise ValueError("No data chunk")
+
+
+def codec_name(header):
+    tag = header['format_tag']
+    return CODEC_NAMES.get((tag, header['bits_per_sample'])) or CODEC_NAMES.get(tag) or f'wav_{tag:#06x}'
+
+
+def wav_metadata(path, open_file=None):
+    """
+    Duration (seconds), sample rate, channel count and codec of a WAV file,
+    from its header alone. All None when the file is missing or not a WAV.
+    `open_file(path)` opens it instead of open() (calls.coldstore.open_recording).
+    """
+    try:
+        with (open_file(path) if open_file else open(path, 'rb')) as f:
+            header = read_wav_header(f)
+    except (OSError, ValueError):
+        return dict.fromkeys(WAV_FIELDS)
+
+    duration = None
+    if header['format_tag'] in UNCOMPRESSED_FORMATS:
+        block_align = header['block_align'] or header['channels'] * header['bits_per_sample'] // 8
+        if header['sample_rate'] and block_align:
+            duration = header['data_size'] // block_align / header['sample_rate']
+    elif header['byte_rate']:
+        duration = header['data_size'] / header['byte_rate']
+    return {
+        'duration': duration,
+        'sample_rate': header['sample_rate'],
+        'channels': header['channels'],
+        'codec': codec_name(header),
+    }
@@ -38,10 +38,12 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'calls',
 ]
 
 MIDDLEWARE = [
+    'calls.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -82,6 +84,17 @@ DATABASES = {
         'PASSWORD': 'pbx_password',
         'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
         'PORT': os.environ.get('POSTGRES_PORT', '5435'),
+        # Seconds a connection is kept for reuse (0: one per request), checked with a
+        # `SELECT 1` before its first query after a request so a restarted server costs no
+        # failed request. Keep 0 under ASGI (the Dockerfile's gunicorn/uvicorn), where each
+        # request runs on a fresh thread and would leave its connection behind: pool there
+        # with PgBouncer in transaction mode. Runserver/WSGI and watch_calls can raise it.
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 0)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # libpq otherwise waits indefinitely for an unreachable host
+            'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', 5)),
+        },
     }
 }
 
@@ -133,3 +146,41 @@ LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'
 LOGOUT_REDIRECT_URL = 'login'
 
+# Dashboard "Total Calls": 'rollup' (per-user daily stats table), 'estimate' (Postgres planner
+# estimate), 'exact' (COUNT(*)) or 'none'
+DASHBOARD_TOTAL = os.environ.get('DASHBOARD_TOTAL', 'rollup')
+
+# Text search configuration used for transcripts (tsvector and queries must agree)
+TRANSCRIPT_SEARCH_CONFIG = os.environ.get('TRANSCRIPT_SEARCH_CONFIG', 'english')
+
+# Call recordings
+RECORDINGS_ROOT = os.environ.get('RECORDINGS_ROOT', '/usr/local/share/asterisk/sounds/call_sessions')
+
+# Cold tier (`archive_recordings`): recordings older than COLD_AFTER_DAYS are compressed
+# (COLD_CODEC: 'lzma' or 'zlib') into COLD_RECORDINGS_ROOT and removed from RECORDINGS_ROOT
+COLD_RECORDINGS_ROOT = os.environ.get('COLD_RECORDINGS_ROOT', '/var/lib/pbx/cold_recordings')
+COLD_AFTER_DAYS = int(os.environ.get('COLD_AFTER_DAYS', 90))
+COLD_CODEC = os.environ.get('COLD_CODEC', 'lzma')
+
+# Let the front-end server send audio bytes: '' (Django streams them), 'x-accel-redirect' (nginx)
+# or 'x-sendfile' (Apache mod_xsendfile). For nginx, AUDIO_OFFLOAD_PREFIX must be an `internal`
+# location aliased to AUDIO_OFFLOAD_ROOT (the sounds dir, so ../{session}/full_conversation.wav resolves).
+AUDIO_OFFLOAD = os.environ.get('AUDIO_OFFLOAD', '')
+AUDIO_OFFLOAD_PREFIX = os.environ.get('AUDIO_OFFLOAD_PREFIX', '/protected-recordings/')
+AUDIO_OFFLOAD_ROOT = os.environ.get('AUDIO_OFFLOAD_ROOT', os.path.dirname(RECORDINGS_ROOT))
+
+# Monthly partitions of calls_call (`partition_calls`): months created ahead of time, and
+# retention in whole months (0: keep everything); expired months are 'detach'ed (kept as
+# standalone tables for archiving) or 'drop'ped. Ingest skips recordings older than that.
+CALL_PARTITION_PREMAKE = int(os.environ.get('CALL_PARTITION_PREMAKE', 3))
+CALL_RETENTION_MONTHS = int(os.environ.get('CALL_RETENTION_MONTHS', 0))
+CALL_RETENTION_ACTION = os.environ.get('CALL_RETENTION_ACTION', 'detach')
+
+# Bytes per read when Django streams a recording itself (sync and ASGI paths)
+AUDIO_STREAM_CHUNK_SIZE = int(os.environ.get('AUDIO_STREAM_CHUNK_SIZE', 64 * 1024))
+
+# Prometheus /metrics: when set, scrapers must send `Authorization: Bearer <METRICS_TOKEN>`.
+# Without a token /metrics answers 403 unless METRICS_PUBLIC=True opens it to anyone.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_PUBLIC = os.environ.get('METRICS_PUBLIC', 'False') == 'True'
+